@@ -46,19 +46,22 @@ def draw_boxes(image, bounds, color):
     return image
 
 
-def get_document_bounds(image_file, feature):
-    """Finds the document bounds given an image and feature type.
+def get_document_bounds(image_file):
+    """Finds the document bounds of every feature type given an image.
+
+    A single document_text_detection request is made and the annotation
+    is walked once, collecting blocks, paragraphs, words and symbols
+    together.
 
     Args:
         image_file: path to the image file.
-        feature: feature type to detect.
 
     Returns:
-        List of coordinates for the corresponding feature type.
+        Dict mapping each FeatureType to its list of bounding boxes.
     """
     client = vision.ImageAnnotatorClient()
 
-    bounds = []
+    bounds = {feature: [] for feature in FeatureType}
 
     with open(image_file, "rb") as image_file:
         content = image_file.read()
@@ -68,25 +71,21 @@ def get_document_bounds(image_file, feature):
     response = client.document_text_detection(image=image)
     document = response.full_text_annotation
 
-    # Collect specified feature bounds by enumerating all document features
+    # Collect all feature bounds by enumerating all document features once
     for page in document.pages:
         for block in page.blocks:
             for paragraph in block.paragraphs:
                 for word in paragraph.words:
                     for symbol in word.symbols:
-                        if feature == FeatureType.SYMBOL:
-                            bounds.append(symbol.bounding_box)
+                        bounds[FeatureType.SYMBOL].append(symbol.bounding_box)
 
-                    if feature == FeatureType.WORD:
-                        bounds.append(word.bounding_box)
+                    bounds[FeatureType.WORD].append(word.bounding_box)
 
-                if feature == FeatureType.PARA:
-                    bounds.append(paragraph.bounding_box)
+                bounds[FeatureType.PARA].append(paragraph.bounding_box)
 
-            if feature == FeatureType.BLOCK:
-                bounds.append(block.bounding_box)
+            bounds[FeatureType.BLOCK].append(block.bounding_box)
 
-    # The list `bounds` contains the coordinates of the bounding boxes.
+    # Each list contains the coordinates of the bounding boxes.
     return bounds
 
 
@@ -98,12 +97,10 @@ def render_doc_text(filein, fileout):
         fileout: path to the output image.
     """
     image = Image.open(filein)
-    bounds = get_document_bounds(filein, FeatureType.BLOCK)
-    draw_boxes(image, bounds, "blue")
-    bounds = get_document_bounds(filein, FeatureType.PARA)
-    draw_boxes(image, bounds, "red")
-    bounds = get_document_bounds(filein, FeatureType.WORD)
-    draw_boxes(image, bounds, "yellow")
+    bounds = get_document_bounds(filein)
+    draw_boxes(image, bounds[FeatureType.BLOCK], "blue")
+    draw_boxes(image, bounds[FeatureType.PARA], "red")
+    draw_boxes(image, bounds[FeatureType.WORD], "yellow")
 
     if fileout != 0:
         image.save(fileout)
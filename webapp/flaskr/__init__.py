@@ -9,6 +9,38 @@ def create_app(test_config=None):
     app.config.from_mapping(
         SECRET_KEY='dev',
         DATABASE=os.path.join(app.instance_path, 'flaskr.sqlite'),
+        UPLOAD_FOLDER=os.path.join(app.root_path, 'static', 'uploads', 'images'),
+        OVERLAY_FOLDER=os.path.join(app.instance_path, 'overlays'),
+        MAX_CONTENT_LENGTH=16 * 1024 * 1024,
+        # Pillow's own decompression-bomb threshold
+        MAX_IMAGE_PIXELS=89_478_485,
+        USER_CACHE_SIZE=1024,
+        USER_CACHE_TTL=300,
+        FRAGMENT_CACHE_SIZE=512,
+        OCR_ENGINE='gcp',
+        CELL_OCR_ENGINE='gcp',
+        HYBRID_CONFIDENCE_THRESHOLD=0.8,
+        TROCR_MODEL='microsoft/trocr-base-handwritten',
+        # see trocr_server.py
+        TROCR_SOCKET=None,
+        TROCR_MAX_BATCH_SIZE=16,
+        TROCR_MAX_WAIT_MS=10,
+        # see tiling.py; None runs as many tiles at once as the pool allows
+        OCR_TILE_SIZE=2048,
+        OCR_TILE_OVERLAP=256,
+        OCR_TILE_WORKERS=None,
+        # import and load the OCR engines in the background at startup
+        OCR_WARMUP=False,
+        # see governor.py; OCR_RATE_LIMIT=None disables the rate limit
+        OCR_TIMEOUT=60,
+        OCR_RATE_LIMIT=10,
+        OCR_BURST=10,
+        OCR_MIN_CONCURRENCY=2,
+        OCR_MAX_CONCURRENCY=16,
+        OCR_LATENCY_TARGET=10.0,
+        OCR_MAX_RETRIES=4,
+        OCR_BACKOFF_BASE=0.5,
+        OCR_BACKOFF_MAX=30.0,
     )
 
     if test_config is None:
@@ -24,6 +56,9 @@ def create_app(test_config=None):
     except OSError:
         pass
 
+    from . import ingest
+    app.request_class = ingest.UploadRequest
+
     # a simple page that says hello
     @app.route('/hello')
     def hello():
@@ -38,6 +73,28 @@ def create_app(test_config=None):
     app.register_blueprint(auth.bp)
     from . import gcp
     app.register_blueprint(gcp.bp)
+    from . import api
+    app.register_blueprint(api.bp)
+    from . import governor
+    governor.init_app(app)
+    from . import metrics
+    app.register_blueprint(metrics.bp)
+    from . import reprocess
+    reprocess.init_app(app)
+    from . import layout
+    layout.init_app(app)
+    from . import trocr_server
+    trocr_server.init_app(app)
+    from . import search
+    search.init_app(app)
+    from . import harvest
+    harvest.init_app(app)
+    from . import evaluate
+    evaluate.init_app(app)
+    from . import capture
+    capture.init_app(app)
+    from . import startup
+    startup.init_app(app)
     # from . import blog
     # app.register_blueprint(blog.bp)
     # app.add_url_rule('/', endpoint='index')
@@ -0,0 +1,186 @@
+"""Versioned JSON API for scripts that sync posts elsewhere.
+
+``GET /api/v1/posts`` lists posts newest first, like the index page, a
+page at a time. Pages are keyset-paginated: ``next`` is an opaque cursor
+holding the last post's ``(created, id)``, so fetching a page costs the
+same however deep it is and posts added meanwhile don't shift later
+pages. ``ids=1,2,3`` instead fetches those posts, in that order, with one
+query. ``GET /api/v1/posts/<id>`` returns a single post.
+
+``fields=id,title`` limits what each post carries; ``gcp_output`` is by
+far the largest. Every response has an ETag derived from
+``post_generation`` and the query, so a poll with ``If-None-Match``
+answers ``304 Not Modified`` without querying posts until something
+changes.
+"""
+import base64
+import binascii
+import hashlib
+import json
+
+from flask import Blueprint, jsonify, request, url_for
+from werkzeug.exceptions import HTTPException, abort
+
+from flaskr import httpcache
+from flaskr.db import get_db
+
+bp = Blueprint('api', __name__, url_prefix='/api/v1')
+
+# Field name -> SQL column. ``image_url`` is built from ``img_path``.
+FIELDS = {
+    'id': 'p.id',
+    'title': 'p.title',
+    'created': 'p.created',
+    'modified': 'p.modified',
+    'author_id': 'p.author_id',
+    'author': 'u.username',
+    'layout_id': 'p.layout_id',
+    'img_path': 'p.img_path',
+    'image_url': 'p.img_path',
+    'gcp_output': 'p.gcp_output',
+}
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+
+@bp.errorhandler(HTTPException)
+def json_error(error):
+    return jsonify(error=error.description), error.code
+
+
+def selected_fields():
+    value = request.args.get('fields')
+    if not value:
+        return list(FIELDS)
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in FIELDS]
+    if unknown:
+        abort(400, f"Unknown fields: {', '.join(unknown)}.")
+    return list(dict.fromkeys(['id'] + fields))
+
+
+def select_sql(fields):
+    """``SELECT ... FROM`` for ``fields``, plus the keyset sort columns."""
+    columns = [f'{FIELDS[field]} AS {field}' for field in fields]
+    columns += ['p.id AS _id', 'CAST(p.created AS TEXT) AS _created']
+    sql = f"SELECT {', '.join(columns)} FROM post p"
+    if 'author' in fields:
+        sql += ' JOIN user u ON u.id = p.author_id'
+    return sql
+
+
+def to_json(row, fields):
+    post = {}
+    for field in fields:
+        value = row[field]
+        if field == 'image_url':
+            value = url_for('gcp.upload', img_path=value, _external=True)
+        elif field in ('created', 'modified') and value is not None:
+            value = value.isoformat()
+        post[field] = value
+    return post
+
+
+def encode_cursor(row):
+    data = json.dumps([row['_created'], row['_id']]).encode()
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    padded = cursor + '=' * (-len(cursor) % 4)
+    try:
+        created, id = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError, binascii.Error):
+        abort(400, 'Invalid cursor.')
+    if not isinstance(created, str) or not isinstance(id, int):
+        abort(400, 'Invalid cursor.')
+    return created, id
+
+
+def parse_ids(value):
+    try:
+        ids = [int(id) for id in value.split(',') if id.strip()]
+    except ValueError:
+        abort(400, 'ids must be comma-separated integers.')
+    if len(ids) > MAX_LIMIT:
+        abort(400, f'At most {MAX_LIMIT} ids per request.')
+    return list(dict.fromkeys(ids))
+
+
+def api_etag(db):
+    """ETag for the current query.
+
+    Like the index page's, it changes whenever any post is added, edited
+    or deleted, and also covers the path and arguments, which decide
+    what is returned. There is no Last-Modified: no timestamp moves when
+    a post is deleted, so ``If-Modified-Since`` polls would miss it.
+    """
+    generation = db.execute('SELECT value FROM post_generation').fetchone()[0]
+    return hashlib.sha256(f"{generation}:{request.full_path}".encode()).hexdigest()[:32]
+
+
+def conditional(view):
+    """Answers 304 when the client's copy is current, else runs ``view``."""
+    db = get_db()
+    etag = api_etag(db)
+    if httpcache.is_fresh(etag):
+        return httpcache.not_modified(etag)
+    return httpcache.add_validators(jsonify(view(db)), etag)
+
+
+def list_posts(db, fields):
+    limit = request.args.get('limit', DEFAULT_LIMIT, type=int)
+    if not 1 <= limit <= MAX_LIMIT:
+        abort(400, f'limit must be between 1 and {MAX_LIMIT}.')
+    sql = select_sql(fields)
+    args = []
+    cursor = request.args.get('after')
+    if cursor:
+        sql += ' WHERE (p.created, p.id) < (?, ?)'
+        args += decode_cursor(cursor)
+    sql += ' ORDER BY p.created DESC, p.id DESC LIMIT ?'
+    rows = db.execute(sql, args + [limit + 1]).fetchall()
+
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return {
+        'posts': [to_json(row, fields) for row in rows[:limit]],
+        'next': next_cursor,
+        'next_url': None if next_cursor is None else url_for(
+            'api.posts', _external=True,
+            **dict(request.args.items(), after=next_cursor)
+        ),
+    }
+
+
+def bulk_posts(db, fields, ids):
+    rows = {row['_id']: row for row in db.execute(
+        select_sql(fields) + ' WHERE p.id IN (SELECT value FROM json_each(?))',
+        (json.dumps(ids),)
+    )}
+    return {
+        'posts': [to_json(rows[id], fields) for id in ids if id in rows],
+        'missing': [id for id in ids if id not in rows],
+    }
+
+
+@bp.route('/posts')
+def posts():
+    fields = selected_fields()
+    ids = request.args.get('ids')
+    if ids is not None:
+        ids = parse_ids(ids)
+        return conditional(lambda db: bulk_posts(db, fields, ids))
+    return conditional(lambda db: list_posts(db, fields))
+
+
+@bp.route('/posts/<int:id>')
+def post(id):
+    fields = selected_fields()
+
+    def view(db):
+        row = db.execute(select_sql(fields) + ' WHERE p.id = ?', (id,)).fetchone()
+        if row is None:
+            abort(404, f'Post {id} does not exist.')
+        return to_json(row, fields)
+
+    return conditional(view)
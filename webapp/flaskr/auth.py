@@ -1,14 +1,34 @@
 import functools
 
 from flask import (
-    Blueprint, flash, g, redirect, render_template, request, session, url_for
+    Blueprint, current_app, flash, g, redirect, render_template, request,
+    session, url_for
 )
 from werkzeug.security import check_password_hash, generate_password_hash
 
+from flaskr.cache import LRUCache
 from flaskr.db import get_db
 
 bp = Blueprint('auth', __name__, url_prefix='/auth')
 
+
+@bp.record_once
+def init_user_cache(state):
+    state.app.extensions['user_cache'] = LRUCache(
+        state.app.config['USER_CACHE_SIZE'],
+        state.app.config['USER_CACHE_TTL'],
+    )
+
+
+def user_cache():
+    return current_app.extensions['user_cache']
+
+
+def invalidate_user(user_id):
+    """Drop a cached user record; call after changing a user row."""
+    user_cache().invalidate(user_id)
+
+
 @bp.route('/register', methods=('GET', 'POST'))
 def register():
     if request.method == 'POST':
@@ -24,11 +44,12 @@ def register():
 
         if error is None:
             try:
-                db.execute(
+                cursor = db.execute(
                     "INSERT INTO user (username, password) VALUES (?, ?)",
                     (username, generate_password_hash(password)),
                 )
                 db.commit()
+                invalidate_user(cursor.lastrowid)
             except db.IntegrityError:
                 error = f"User {username} is already registered."
             else:
@@ -69,10 +90,16 @@ def load_logged_in_user():
 
     if user_id is None:
         g.user = None
-    else:
+        return
+
+    cache = user_cache()
+    g.user = cache.get(user_id)
+    if g.user is None:
         g.user = get_db().execute(
             'SELECT * FROM user WHERE id = ?', (user_id,)
         ).fetchone()
+        if g.user is not None:
+            cache.set(user_id, g.user)
 
 
 @bp.route('/logout')
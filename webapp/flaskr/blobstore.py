@@ -0,0 +1,105 @@
+"""Content-addressed storage for uploaded images.
+
+Files are named by the SHA-256 of their content and sharded two levels
+deep (``ab/cd/abcd...ef.jpg``) under ``UPLOAD_FOLDER``. The relative path
+is what ``post.img_path`` stores, so identical uploads share one file and
+the hash doubles as a cache key. The ``blob`` table counts how many posts
+point at each file; the file is removed once the deletion of the last
+one has committed.
+"""
+import os
+import tempfile
+
+from flask import current_app
+
+
+def upload_folder():
+    return current_app.config['UPLOAD_FOLDER']
+
+
+def blob_path(digest, ext):
+    """Return the path of a blob relative to the upload folder."""
+    return f'{digest[:2]}/{digest[2:4]}/{digest}.{ext}'
+
+
+def digest_of(img_path):
+    """Return the content hash encoded in ``img_path``, or ``None``."""
+    name = os.path.basename(img_path).split('.', 1)[0]
+    if len(name) == 64 and img_path.startswith(f'{name[:2]}/{name[2:4]}/'):
+        return name
+    return None
+
+
+def temp_file():
+    """Open a temporary file on the same filesystem as the blobs.
+
+    Returns ``(file, path)``; once written, the file can be moved into
+    place with :func:`add` without copying.
+    """
+    folder = os.path.join(upload_folder(), '.tmp')
+    os.makedirs(folder, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=folder)
+    return os.fdopen(fd, 'wb'), path
+
+
+def add(db, tmp_path, digest, ext, size):
+    """Move a spooled file into the store and take a reference to it.
+
+    Must be called inside the transaction that inserts the referencing
+    post. The reference is written first so the file is only placed
+    while this connection holds the write lock, which keeps it from
+    racing a concurrent :func:`release` of the same content.
+    Returns the ``img_path`` for the post.
+    """
+    img_path = blob_path(digest, ext)
+    db.execute(
+        'INSERT INTO blob (hash, img_path, size, refcount) VALUES (?, ?, ?, 1)'
+        ' ON CONFLICT (hash) DO UPDATE SET refcount = refcount + 1',
+        (digest, img_path, size),
+    )
+    img_path = db.execute(
+        'SELECT img_path FROM blob WHERE hash = ?', (digest,)
+    ).fetchone()['img_path']
+
+    final_path = os.path.join(upload_folder(), img_path)
+    os.makedirs(os.path.dirname(final_path), exist_ok=True)
+    os.replace(tmp_path, final_path)
+    return img_path
+
+
+def release(db, img_path):
+    """Drop one reference to ``img_path``.
+
+    Returns ``True`` if that was the last one; once the transaction has
+    committed, pass the path to :func:`remove_unused`. Until then a
+    rollback can bring the reference back, so the file must stay.
+    Paths that were stored before the blob store existed have no
+    ``blob`` row and are left alone.
+    """
+    db.execute(
+        'UPDATE blob SET refcount = refcount - 1 WHERE img_path = ?',
+        (img_path,),
+    )
+    return db.execute(
+        'DELETE FROM blob WHERE img_path = ? AND refcount <= 0', (img_path,)
+    ).rowcount > 0
+
+
+def remove_unused(db, img_path):
+    """Delete the file at ``img_path`` if no blob row refers to it.
+
+    Runs under the write lock, which :func:`add` also holds while it
+    places a file, so an upload of the same content in the meantime
+    keeps its file.
+    """
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        if db.execute(
+            'SELECT 1 FROM blob WHERE img_path = ?', (img_path,)
+        ).fetchone() is None:
+            try:
+                os.unlink(os.path.join(upload_folder(), img_path))
+            except FileNotFoundError:
+                pass
+    finally:
+        db.rollback()
@@ -0,0 +1,318 @@
+"""``flask capture``: posts from a fixed camera, only when the board changes.
+
+Frames are read with OpenCV from a video file or a capture device and
+sampled every ``--interval`` seconds. Each sample goes through three
+cheap checks before anything is sent for OCR:
+
+1. The board is found by its AprilTags (tags 0-3, as for layout
+   templates) and warped onto a small rectangle. With a tagged board, a
+   frame missing any tag has someone standing in front of it. Untagged
+   boards are located once, since the camera doesn't move.
+2. The small board is compared with the previous sample. Until
+   ``--stable`` samples in a row have stopped moving, the frame is
+   ignored.
+3. A still board is compared with the last one posted. A large solid
+   patch of difference is a person or an object in the way. Ink that
+   appeared or was wiped makes a new post. Anything else, such as light
+   changing over the day, only updates the reference. Once the
+   reference has been seen again after something moved in front of it,
+   nobody is in it, and a board blocked by someone standing still is
+   never posted, however long they stay.
+
+A day of footage of a board that changes a few times makes a few posts
+and a few OCR calls. Posts are read and stored like uploads: with
+``--layout``, only the cells that changed are OCRed.
+"""
+import hashlib
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from flaskr import blobstore, gcp, layout, ocr
+from flaskr.db import get_db
+
+# Width of the board used for differencing.
+DIFF_WIDTH = 800
+# Grey levels a pixel must change by to count as changed.
+PIXEL_CHANGE = 40
+# Share of the board that may change between samples of a still board.
+MOTION_FRACTION = 0.01
+# Solid changes wider than this many pixels are in front of the board,
+# not written on it.
+OCCLUSION_KERNEL = 15
+# Share of the board a solid change must cover to block it.
+OCCLUSION_FRACTION = 0.01
+# Pixels of ink that must appear or disappear to make a new post.
+CHANGE_PIXELS = 40
+# A board still blocked after this many times ``stable`` samples has
+# changed for good, unless the reference has been seen clear (it may
+# have had someone in front of it).
+BLOCKED_PATIENCE = 10
+
+MOVING = 'moving'
+BLOCKED = 'blocked'
+SETTLING = 'settling'
+UNCHANGED = 'unchanged'
+CHANGED = 'changed'
+
+
+class BoardTracker(object):
+    """Finds the board in each frame of a fixed camera."""
+
+    def __init__(self):
+        self.corners = None
+        self.tagged = False
+
+    def locate(self, gray):
+        """Returns the board's corners, or ``None`` if a tag is covered."""
+        corners = layout.find_fiducials(gray)
+        if corners is not None:
+            self.corners = corners
+            self.tagged = True
+        elif self.tagged:
+            return None
+        elif self.corners is None:
+            self.corners = layout.find_board(gray)
+        return self.corners
+
+
+def small_board(gray, corners):
+    """Rectifies the board to ``DIFF_WIDTH``, evened out for brightness."""
+    import cv2
+
+    width, height = layout.board_size(corners)
+    size = (DIFF_WIDTH, max(round(DIFF_WIDTH * height / width), 1))
+    board = cv2.GaussianBlur(layout.rectify(gray, corners, size), (3, 3), 0)
+    # scale to a common mean so a passing cloud isn't a change
+    mean = max(float(board.mean()), 1.0)
+    return cv2.convertScaleAbs(board, alpha=160.0 / mean)
+
+
+def changed_fraction(board, other):
+    import cv2
+
+    diff = cv2.absdiff(board, other)
+    return float((diff > PIXEL_CHANGE).mean())
+
+
+def occluded(board, reference):
+    """True if a solid patch of the board differs from ``reference``.
+
+    Opening the difference with a kernel wider than a pen stroke erases
+    writing and leaves the bodies and arms in front of the board.
+    """
+    import cv2
+    import numpy as np
+
+    mask = (cv2.absdiff(board, reference) > PIXEL_CHANGE).astype(np.uint8)
+    kernel = cv2.getStructuringElement(
+        cv2.MORPH_ELLIPSE, (OCCLUSION_KERNEL, OCCLUSION_KERNEL)
+    )
+    solid = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
+    return float(solid.mean()) > OCCLUSION_FRACTION
+
+
+def ink_changed(board, reference):
+    """True if ink appeared or disappeared between two boards."""
+    import cv2
+    import numpy as np
+
+    diff = cv2.bitwise_xor(layout.ink_mask(board), layout.ink_mask(reference))
+    # a stroke's outline flickers by a pixel between frames; drop that
+    diff = cv2.morphologyEx(diff, cv2.MORPH_OPEN, np.ones((2, 2), np.uint8))
+    return int(diff.sum()) >= CHANGE_PIXELS
+
+
+class ChangeDetector(object):
+    """Classifies each small board (see :func:`small_board`) in turn."""
+
+    def __init__(self, stable=3):
+        self.stable = stable
+        self.previous = None
+        self.reference = None
+        # whether the reference is known to have nobody in front of it
+        self.clear = False
+        self.still = 0
+
+    def update(self, board):
+        previous, self.previous = self.previous, board
+        if previous is None or previous.shape != board.shape or (
+                changed_fraction(board, previous) > MOTION_FRACTION):
+            self.still = 0
+            return MOVING
+        self.still += 1
+        if self.reference is not None and occluded(board, self.reference):
+            if self.clear or self.still < self.stable * BLOCKED_PATIENCE:
+                return BLOCKED
+        elif self.reference is not None and self.still == self.stable:
+            # the reference came back after a movement: it's the board
+            self.clear = True
+        if self.still < self.stable:
+            return SETTLING
+        changed = self.reference is None or ink_changed(board, self.reference)
+        self.reference = board
+        return CHANGED if changed else UNCHANGED
+
+    def blocked(self):
+        """Records a frame where the board couldn't be seen."""
+        self.previous = None
+        self.still = 0
+        return BLOCKED
+
+
+def open_source(source):
+    import cv2
+
+    capture = cv2.VideoCapture(int(source) if source.isdigit() else source)
+    if not capture.isOpened():
+        raise click.ClickException(f'Cannot open video source {source!r}.')
+    return capture
+
+
+def sample_frames(capture, interval, live):
+    """Yields ``(seconds, frame)`` every ``interval`` seconds of video.
+
+    Every frame is grabbed, so a live device's buffer never lags, but only
+    sampled frames are decoded. Files are timed by their timestamps and
+    devices by the clock.
+    """
+    import cv2
+
+    started = time.monotonic()
+    due = 0.0
+    while capture.grab():
+        if live:
+            seconds = time.monotonic() - started
+        else:
+            seconds = capture.get(cv2.CAP_PROP_POS_MSEC) / 1000
+        if seconds < due:
+            continue
+        ok, frame = capture.retrieve()
+        if not ok:
+            break
+        due = seconds + interval
+        yield seconds, frame
+
+
+def post_frame(db, frame, title, author_id, template, created):
+    """Stores a frame as a JPEG upload and creates its post.
+
+    ``created`` is an aware datetime; it is stored in UTC.
+    """
+    import cv2
+
+    ok, encoded = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 95])
+    if not ok:
+        raise click.ClickException('Cannot encode frame.')
+    data = encoded.tobytes()
+    file, path = blobstore.temp_file()
+    with file:
+        file.write(data)
+    try:
+        try:
+            gcp_output, cells = gcp.recognize_image(db, path, template)
+        except ocr.OCRError:
+            # Vision client errors arrive wrapped by the governor
+            current_app.logger.exception('OCR failed for captured frame %r', title)
+            gcp_output, cells = '', None
+        img_path = blobstore.add(
+            db, path, hashlib.sha256(data).hexdigest(), 'jpg', len(data)
+        )
+        post_id = gcp.add_post(
+            db, title, img_path, gcp_output, author_id, template, cells,
+            created.astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S'),
+        )
+        db.commit()
+    finally:
+        # blobstore.add moved the file unless something failed first
+        if os.path.exists(path):
+            os.remove(path)
+    gcp.invalidate_post_fragments(post_id)
+    return post_id
+
+
+def capture(source, title, author_id, template=None, interval=1.0, stable=3,
+            start=None, echo=click.echo):
+    """Watches ``source`` and posts each stable change of the board.
+
+    ``start`` is when the video begins, naive in local time or aware;
+    it defaults to now. Posts are titled with the local time of the
+    frame and stored with its UTC time, like ``CURRENT_TIMESTAMP``.
+    Returns a count of samples by outcome, plus ``posts``.
+    """
+    import cv2
+
+    db = get_db()
+    video = open_source(source)
+    live = source.isdigit() or not os.path.isfile(source)
+    # naive times are local; astimezone() reads them that way
+    start = (start or datetime.now()).astimezone(timezone.utc)
+    tracker = BoardTracker()
+    detector = ChangeDetector(stable)
+    counts = dict.fromkeys((MOVING, BLOCKED, SETTLING, UNCHANGED, CHANGED, 'posts'), 0)
+    try:
+        for seconds, frame in sample_frames(video, interval, live):
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            corners = tracker.locate(gray)
+            if corners is None:
+                state = detector.blocked()
+            else:
+                state = detector.update(small_board(gray, corners))
+            counts[state] += 1
+            if state == CHANGED:
+                when = start + timedelta(seconds=seconds)
+                post_id = post_frame(
+                    db, frame, f'{title} {when.astimezone():%Y-%m-%d %H:%M}',
+                    author_id, template, when,
+                )
+                counts['posts'] += 1
+                echo(f'{seconds:9.1f}s  board changed: post {post_id}')
+    finally:
+        video.release()
+    return counts
+
+
+@click.command('capture')
+@click.argument('source')
+@click.option('--title', default='Board', show_default=True,
+              help='Post title; the capture time is appended.')
+@click.option('--author', required=True, help='Username the posts belong to.')
+@click.option('--layout', 'layout_id', type=int, default=None,
+              help='Read the board with this layout template.')
+@click.option('--interval', default=1.0, show_default=True,
+              help='Seconds of video between sampled frames.')
+@click.option('--stable', default=3, show_default=True,
+              help='Still samples in a row before a change counts.')
+@click.option('--start', type=click.DateTime(), default=None,
+              help='Local time the video starts at (default: now).')
+@with_appcontext
+def capture_command(source, title, author, layout_id, interval, stable, start):
+    """Post a fixed camera's board each time it changes.
+
+    SOURCE is a video file, a device path or a camera index.
+    """
+    db = get_db()
+    user = db.execute('SELECT id FROM user WHERE username = ?', (author,)).fetchone()
+    if user is None:
+        raise click.ClickException(f'Unknown user {author!r}.')
+    template = None
+    if layout_id is not None:
+        template = layout.get_template(db, layout_id)
+        if template is None:
+            raise click.ClickException(f'Unknown layout {layout_id}.')
+
+    counts = capture(source, title, user['id'], template, interval, stable, start)
+    sampled = sum(counts[state] for state in (MOVING, BLOCKED, SETTLING, UNCHANGED, CHANGED))
+    click.echo(
+        f"{sampled} frames sampled: {counts[CHANGED]} changes,"
+        f" {counts[UNCHANGED]} unchanged, {counts[BLOCKED]} blocked,"
+        f" {counts[MOVING] + counts[SETTLING]} moving. {counts['posts']} posts."
+    )
+
+
+def init_app(app):
+    app.cli.add_command(capture_command)
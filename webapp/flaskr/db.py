@@ -1,17 +1,56 @@
+import os
+import re
 import sqlite3
+import threading
 
 import click
 from flask import current_app, g
 from flask.cli import with_appcontext
 
+# Applied to every new connection. WAL lets readers keep going while an
+# upload is being written, and NORMAL is durable enough under WAL.
+PRAGMAS = (
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA busy_timeout = 5000',
+    'PRAGMA cache_size = -16000',
+    'PRAGMA temp_store = MEMORY',
+)
+
+MIGRATION_RE = re.compile(r'^(\d+)_\w+\.sql$')
+
+_local = threading.local()
+
+
+def connect(database):
+    """Open a new connection with the app's row factory and pragmas."""
+    db = sqlite3.connect(database, detect_types=sqlite3.PARSE_DECLTYPES)
+    db.row_factory = sqlite3.Row
+    for pragma in PRAGMAS:
+        db.execute(pragma)
+    return db
+
+
+def _thread_connections():
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+    return connections
+
 
 def get_db():
+    """Return this thread's connection to the app database.
+
+    Connections are kept open between requests and reused by the next
+    request served on the same thread.
+    """
     if 'db' not in g:
-        g.db = sqlite3.connect(
-            current_app.config['DATABASE'],
-            detect_types=sqlite3.PARSE_DECLTYPES
-        )
-        g.db.row_factory = sqlite3.Row
+        database = current_app.config['DATABASE']
+        connections = _thread_connections()
+        db = connections.get(database)
+        if db is None:
+            db = connections[database] = connect(database)
+        g.db = db
 
     return g.db
 
@@ -19,15 +58,85 @@ def get_db():
 def close_db(e=None):
     db = g.pop('db', None)
 
-    if db is not None:
+    # The connection goes back to the thread for reuse; don't let a
+    # failed request leave a transaction open on it.
+    if db is not None and db.in_transaction:
+        db.rollback()
+
+
+def close_thread_connections():
+    """Close every connection opened by the current thread."""
+    connections = _thread_connections()
+    while connections:
+        _, db = connections.popitem()
         db.close()
 
 
-def init_db():
+def migrations():
+    """Return ``(version, filename)`` for each migration, oldest first."""
+    folder = os.path.join(current_app.root_path, 'migrations')
+    found = []
+    for filename in os.listdir(folder):
+        match = MIGRATION_RE.match(filename)
+        if match:
+            found.append((int(match.group(1)), filename))
+    return sorted(found)
+
+
+def split_statements(script):
+    statements = []
+    statement = ''
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            statements.append(statement.strip())
+            statement = ''
+    if statement.strip():
+        statements.append(statement.strip())
+    return statements
+
+
+def migrate_db():
+    """Apply pending migrations and return how many were applied.
+
+    Each migration runs in its own transaction and bumps
+    ``PRAGMA user_version``, so an interrupted run picks up where it
+    stopped and existing data is left alone.
+    """
     db = get_db()
+    applied = 0
+
+    for version, filename in migrations():
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            if db.execute('PRAGMA user_version').fetchone()[0] >= version:
+                db.rollback()
+                continue
+            with current_app.open_resource(f'migrations/{filename}') as f:
+                for statement in split_statements(f.read().decode('utf8')):
+                    db.execute(statement)
+            db.execute(f'PRAGMA user_version = {version:d}')
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        applied += 1
+
+    return applied
 
-    with current_app.open_resource('schema.sql') as f:
-        db.executescript(f.read().decode('utf8'))
+
+def init_db():
+    """Drop every table and rebuild the schema from the migrations."""
+    db = get_db()
+    tables = db.execute(
+        "SELECT name FROM sqlite_master"
+        " WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+    ).fetchall()
+    for table in tables:
+        db.execute(f'DROP TABLE IF EXISTS "{table["name"]}"')
+    db.execute('PRAGMA user_version = 0')
+    db.commit()
+    migrate_db()
 
 
 @click.command('init-db')
@@ -38,6 +147,16 @@ def init_db_command():
     click.echo('Initialized the database.')
 
 
+@click.command('migrate-db')
+@with_appcontext
+def migrate_db_command():
+    """Apply pending schema migrations without touching existing data."""
+    applied = migrate_db()
+    version = get_db().execute('PRAGMA user_version').fetchone()[0]
+    click.echo(f'Applied {applied} migration(s); schema is at version {version}.')
+
+
 def init_app(app):
     app.teardown_appcontext(close_db)
     app.cli.add_command(init_db_command)
+    app.cli.add_command(migrate_db_command)
@@ -0,0 +1,316 @@
+"""``flask evaluate-ocr``: compare OCR engines on labelled images.
+
+A dataset is a folder of images, each with its ground-truth transcript
+in a ``.txt`` file of the same name (``board.jpg`` and ``board.txt``);
+images without one are skipped. Every engine reads every image on a
+thread pool, and the report gives, per engine:
+
+* CER and WER over the whole set, as ``finetune-trocr.py`` computes
+  them with the ``cer`` metric: total edits over total reference
+  characters (or words), after collapsing runs of whitespace;
+* p50 and p95 latency per image and throughput in images per second;
+* peak resident memory. Each engine runs in a process of its own,
+  forked from the command, so the figure is the command's baseline plus
+  that engine alone; where processes can't be forked it is left out.
+
+Engines are named as in ``OCR_ENGINE`` (``gcp``, ``hybrid``), or
+``trocr:<model>`` for a pretrained or fine-tuned TrOCR checkpoint read
+whole-page. Each result is cached under the image's hash, so later runs,
+and ``--offline`` runs with no network, reuse earlier responses.
+"""
+import hashlib
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from flaskr import ocr
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif')
+
+
+def normalize(text):
+    return ' '.join(text.split())
+
+
+def levenshtein(a, b):
+    """Edit distance between two sequences of hashable items.
+
+    Each row of the table is computed with numpy: substitutions and
+    deletions come from the row above, and insertions are a running
+    minimum along the row, so long page transcripts stay fast.
+    """
+    import numpy as np
+
+    if len(a) < len(b):
+        a, b = b, a
+    if not b:
+        return len(a)
+    codes = {}
+    a = np.array([codes.setdefault(item, len(codes)) for item in a])
+    b = np.array([codes.setdefault(item, len(codes)) for item in b])
+    columns = np.arange(len(b) + 1)
+    previous = columns.copy()
+    for i, item in enumerate(a, 1):
+        current = np.empty_like(previous)
+        current[0] = i
+        current[1:] = np.minimum(previous[1:] + 1, previous[:-1] + (b != item))
+        previous = np.minimum.accumulate(current - columns) + columns
+    return int(previous[-1])
+
+
+def error_rate(predictions, references, split):
+    edits = 0
+    total = 0
+    for prediction, reference in zip(predictions, references):
+        reference = split(normalize(reference))
+        edits += levenshtein(split(normalize(prediction)), reference)
+        total += len(reference)
+    return edits / total if total else 0.0
+
+
+def cer(predictions, references):
+    return error_rate(predictions, references, list)
+
+
+def wer(predictions, references):
+    return error_rate(predictions, references, str.split)
+
+
+def percentile(values, q):
+    import numpy as np
+
+    return float(np.percentile(values, q)) if values else None
+
+
+def peak_rss():
+    """Peak resident memory of this process in bytes."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def load_dataset(folder):
+    """Returns ``[(image_path, transcript)]`` for labelled images."""
+    samples = []
+    for root, dirs, files in os.walk(folder):
+        dirs.sort()
+        for name in sorted(files):
+            stem, ext = os.path.splitext(name)
+            label = os.path.join(root, stem + '.txt')
+            if ext.lower() in IMAGE_EXTENSIONS and os.path.exists(label):
+                with open(label, encoding='utf-8') as f:
+                    samples.append((os.path.join(root, name), f.read()))
+    return samples
+
+
+def get_recognizer(spec):
+    """Returns ``recognize(path) -> text`` for an engine name."""
+    name, _, model = spec.partition(':')
+    if name == 'trocr':
+        from flaskr import trocr
+
+        def recognize(path):
+            from PIL import Image
+
+            with Image.open(path) as image:
+                return trocr.generate(
+                    [image.convert('RGB')], model or current_app.config['TROCR_MODEL']
+                )[0]
+        return recognize
+    return ocr.get_engine(spec)
+
+
+class ResponseCache(object):
+    """Engine outputs on disk, keyed by engine and image content."""
+
+    def __init__(self, folder):
+        self.folder = folder
+
+    def path(self, engine, digest):
+        safe = hashlib.sha256(engine.encode()).hexdigest()[:16]
+        return os.path.join(self.folder, safe, f'{digest}.json')
+
+    def get(self, engine, digest):
+        try:
+            with open(self.path(engine, digest), encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def set(self, engine, digest, entry):
+        path = self.path(engine, digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(dict(entry, engine=engine), f)
+        os.replace(path + '.tmp', path)
+
+
+def file_digest(path):
+    with open(path, 'rb') as f:
+        return hashlib.file_digest(f, 'sha256').hexdigest()
+
+
+def evaluate_engine(engine, samples, workers=4, cache=None, offline=False):
+    """Runs one engine over ``samples`` and returns its report row."""
+    app = current_app._get_current_object()
+    recognize = None
+    if not (offline and ocr.is_online(engine.partition(':')[0])):
+        recognize = get_recognizer(engine)
+
+    def run(sample):
+        path, _ = sample
+        digest = file_digest(path)
+        entry = cache.get(engine, digest) if cache is not None else None
+        if entry is not None:
+            return dict(entry, cached=True)
+        if recognize is None:
+            return {'error': 'not cached'}
+        started = time.perf_counter()
+        try:
+            with app.app_context():
+                text = recognize(path)
+        except Exception as e:
+            return {'error': f'{type(e).__name__}: {e}'}
+        entry = {'text': text, 'latency': time.perf_counter() - started}
+        if cache is not None:
+            cache.set(engine, digest, entry)
+        return dict(entry, cached=False)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(run, samples))
+    elapsed = time.perf_counter() - started
+
+    done = [(result, sample) for result, sample in zip(results, samples)
+            if 'error' not in result]
+    live = [result for result, _ in done if not result['cached']]
+    latencies = [result['latency'] for result, _ in done]
+    predictions = [result['text'] for result, _ in done]
+    references = [sample[1] for _, sample in done]
+    return {
+        'engine': engine,
+        'images': len(done),
+        'errors': len(results) - len(done),
+        'cached': len(done) - len(live),
+        'cer': cer(predictions, references) if done else None,
+        'wer': wer(predictions, references) if done else None,
+        'p50_ms': percentile(latencies, 50) * 1000 if latencies else None,
+        'p95_ms': percentile(latencies, 95) * 1000 if latencies else None,
+        # only calls made in this run count towards throughput
+        'throughput': len(live) / elapsed if live and elapsed else None,
+        'peak_rss_mb': None,
+        'failures': [
+            {'image': sample[0], 'error': result['error']}
+            for result, sample in zip(results, samples) if 'error' in result
+        ],
+    }
+
+
+def evaluate_isolated(engine, samples, workers=4, cache=None, offline=False):
+    """Like :func:`evaluate_engine`, in a forked process.
+
+    A process's peak RSS only ever grows, so engines run one after the
+    other in the same process would each report the largest so far.
+    The child's peak covers just the one engine.
+    """
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        return evaluate_engine(engine, samples, workers, cache, offline)
+    context = multiprocessing.get_context('fork')
+    receive, send = context.Pipe(duplex=False)
+
+    def run():
+        # forked from this thread, so the app context comes along
+        try:
+            row = evaluate_engine(engine, samples, workers, cache, offline)
+            send.send((dict(row, peak_rss_mb=peak_rss() / 2 ** 20), None))
+        except Exception as e:
+            send.send((None, f'{type(e).__name__}: {e}'))
+
+    process = context.Process(target=run, daemon=True)
+    process.start()
+    send.close()
+    try:
+        row, error = receive.recv()
+    except EOFError:
+        row, error = None, 'worker died'
+    process.join()
+    if error is not None:
+        raise click.ClickException(f'{engine} failed: {error}')
+    return row
+
+
+def format_report(rows, dataset_size):
+    def cell(value, fmt):
+        return '-' if value is None else format(value, fmt)
+
+    lines = [
+        f'OCR evaluation over {dataset_size} labelled images',
+        '',
+        '| engine | images | CER | WER | p50 ms | p95 ms | img/s | peak RSS MB | cached | errors |',
+        '|---|---:|---:|---:|---:|---:|---:|---:|---:|---:|',
+    ]
+    for row in rows:
+        lines.append(
+            f"| {row['engine']} | {row['images']} | {cell(row['cer'], '.3f')}"
+            f" | {cell(row['wer'], '.3f')} | {cell(row['p50_ms'], '.0f')}"
+            f" | {cell(row['p95_ms'], '.0f')} | {cell(row['throughput'], '.2f')}"
+            f" | {cell(row['peak_rss_mb'], '.0f')} | {row['cached']} | {row['errors']} |"
+        )
+    return '\n'.join(lines) + '\n'
+
+
+@click.command('evaluate-ocr')
+@click.argument('dataset', type=click.Path(exists=True, file_okay=False))
+@click.option('--engine', 'engines', multiple=True,
+              help='Engine to evaluate, e.g. gcp, hybrid or trocr:MODEL.'
+                   ' Repeat for several (default: OCR_ENGINE).')
+@click.option('--workers', default=4, show_default=True,
+              help='Images read at once per engine.')
+@click.option('--cache', 'cache_folder', default=None,
+              help='Response cache folder (default: instance/ocr-eval-cache).')
+@click.option('--no-cache', is_flag=True, help='Neither read nor write the cache.')
+@click.option('--offline', is_flag=True,
+              help="Don't call online engines; use cached responses only.")
+@click.option('--report', type=click.Path(dir_okay=False),
+              help='Also write the Markdown report here.')
+@click.option('--json', 'json_path', type=click.Path(dir_okay=False),
+              help='Write the full results as JSON here.')
+@with_appcontext
+def evaluate_ocr_command(dataset, engines, workers, cache_folder, no_cache,
+                         offline, report, json_path):
+    """Measure accuracy, latency and memory of OCR engines."""
+    samples = load_dataset(dataset)
+    if not samples:
+        raise click.ClickException(
+            f'No labelled images in {dataset}; add a .txt transcript'
+            ' next to each image.'
+        )
+    cache = None if no_cache else ResponseCache(
+        cache_folder or os.path.join(current_app.instance_path, 'ocr-eval-cache')
+    )
+    rows = []
+    for engine in engines or (current_app.config['OCR_ENGINE'],):
+        row = evaluate_isolated(engine, samples, workers, cache, offline)
+        for failure in row['failures']:
+            click.echo(f"{engine}: {failure['image']}: {failure['error']}", err=True)
+        rows.append(row)
+
+    text = format_report(rows, len(samples))
+    click.echo(text)
+    if report:
+        with open(report, 'w', encoding='utf-8') as f:
+            f.write(text)
+    if json_path:
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(rows, f, indent=2)
+
+
+def init_app(app):
+    app.cli.add_command(evaluate_ocr_command)
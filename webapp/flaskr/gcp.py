@@ -1,25 +1,136 @@
+import bisect
+import hashlib
+import io
+import json
+from collections import namedtuple
+
 from flask import (
-    Blueprint, flash, g, redirect, render_template, request, url_for
+    Blueprint, current_app, flash, g, make_response, redirect,
+    render_template, request, send_file, send_from_directory, session, url_for
 )
+from markupsafe import Markup
 from werkzeug.exceptions import abort
-from werkzeug.utils import secure_filename  
+from flaskr import (
+    blobstore, governor, harvest, httpcache, layout, ocr, overlay, search
+)
+from flaskr.cache import LRUCache
 from flaskr.auth import login_required
 from flaskr.db import get_db
-from google.cloud import vision
 import os
 
+# Reads call Vision over the network (see ocr.is_online).
+ONLINE = True
 
-def detect_document(path):
-    """Detects document features in an image."""
-    
-    os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = ".creds/farmdocs-7e1092c19709.json"
-    client = vision.ImageAnnotatorClient()
+# A recognised word in reading order. ``box`` is (left, top, right,
+# bottom) in image pixels; ``line`` identifies the paragraph it came from.
+Word = namedtuple('Word', 'text confidence box line')
+
+
+def annotate(path):
+    """Runs Vision document text detection and returns the annotation.
+
+    The boxes are saved for :mod:`flaskr.overlay`, so reviewing them
+    later doesn't need another Vision call.
+    """
     with open(path, "rb") as image_file:
         content = image_file.read()
+    document = annotate_content(content)
+    overlay.save_bounds(hashlib.sha256(content).hexdigest(), document)
+    return document
+
+
+def annotate_content(content):
+    """Like :func:`annotate`, for image bytes already in memory.
+
+    The request goes through the app's OCR governor, which rate-limits
+    it and retries quota and availability errors.
+    """
+    return governor.current().call(
+        document_text_detection, content, current_app.config['OCR_TIMEOUT']
+    )
+
+
+def document_text_detection(content, timeout=None):
+    """Makes one Vision request; raises :class:`~flaskr.ocr.OCRError`."""
+    from google.cloud import vision
+
+    os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = ".creds/farmdocs-7e1092c19709.json"
+    client = vision.ImageAnnotatorClient()
     image = vision.Image(content=content)
-    response = client.document_text_detection(image=image)
+    response = client.document_text_detection(image=image, timeout=timeout)
+    if response.error.message:
+        raise ocr.OCRError(
+            "{}\nFor more info on error messages, check: "
+            "https://cloud.google.com/apis/design/errors".format(response.error.message),
+            code=response.error.code,
+        )
+    return response.full_text_annotation
+
+
+def warm_up():
+    """Imports the Vision client library ahead of the first request."""
+    from google.cloud import vision  # noqa: F401
+
+
+def bounding_rect(bounding_box):
+    xs = [vertex.x for vertex in bounding_box.vertices]
+    ys = [vertex.y for vertex in bounding_box.vertices]
+    return (min(xs), min(ys), max(xs), max(ys))
+
+
+def document_words(document):
+    """Yields every word of an annotation as a :class:`Word`."""
+    for page_index, page in enumerate(document.pages):
+        for block_index, block in enumerate(page.blocks):
+            for paragraph_index, paragraph in enumerate(block.paragraphs):
+                line = (page_index, block_index, paragraph_index)
+                for word in paragraph.words:
+                    yield Word(
+                        "".join([symbol.text for symbol in word.symbols]),
+                        word.confidence,
+                        bounding_rect(word.bounding_box),
+                        line,
+                    )
+
+
+# White space between crops in a mosaic, so Vision doesn't merge lines.
+MOSAIC_GAP = 24
+
+
+def recognize_crops(images):
+    """Reads a batch of PIL crops with a single Vision request.
+
+    The crops are stacked into one mosaic and each recognised word is
+    assigned back to the crop its centre falls in.
+    """
+    if not images:
+        return []
+    from PIL import Image
+
+    width = max(image.width for image in images)
+    height = sum(image.height for image in images) + MOSAIC_GAP * (len(images) - 1)
+    mosaic = Image.new('L', (width, height), 255)
+    tops = []
+    top = 0
+    for image in images:
+        mosaic.paste(image.convert('L'), (0, top))
+        tops.append(top)
+        top += image.height + MOSAIC_GAP
+
+    content = io.BytesIO()
+    mosaic.save(content, 'PNG')
+    texts = [[] for _ in images]
+    for word in document_words(annotate_content(content.getvalue())):
+        centre = (word.box[1] + word.box[3]) / 2
+        texts[max(bisect.bisect_right(tops, centre) - 1, 0)].append(word.text)
+    return [" ".join(words) for words in texts]
+
+
+def detect_document(path):
+    """Detects document features in an image."""
+    document = annotate(path)
     words = "" # in string format
-    for page in response.full_text_annotation.pages:
+    for page in document.pages:
         for block in page.blocks:
             print(f"\nBlock confidence: {block.confidence}\n")
             for paragraph in block.paragraphs:
@@ -38,88 +149,247 @@ def detect_document(path):
                                 symbol.text, symbol.confidence
                             )
                         )
-    if response.error.message:
-        raise Exception(
-            "{}\nFor more info on error messages, check: "
-            "https://cloud.google.com/apis/design/errors".format(response.error.message)
-        )
     return words
 
 
 bp = Blueprint('gcp', __name__)
-UPLOAD_FOLDER = 'flaskr/static/uploads/images'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 
+# SQLite caps the number of ? placeholders in one statement.
+QUERY_BATCH_SIZE = 500
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+@bp.record_once
+def init_fragment_cache(state):
+    state.app.extensions['fragment_cache'] = LRUCache(
+        state.app.config['FRAGMENT_CACHE_SIZE']
+    )
+
+def fragment_cache():
+    return current_app.extensions['fragment_cache']
+
+def invalidate_post_fragments(id):
+    """Drop the rendered fragments of a post; call after changing it."""
+    cache = fragment_cache()
+    cache.invalidate((id, True))
+    cache.invalidate((id, False))
+
+def render_post_fragments(db, posts):
+    """Render each post's ``<article>``, reusing cached fragments.
+
+    ``posts`` only needs ``id``, ``modified`` and ``author_id``; the full
+    rows are fetched, in one query per batch, just for posts whose
+    fragment is missing or older than the post. Fragments are keyed by
+    post id and by whether the viewer may edit it, since that decides
+    the Edit link.
+    """
+    cache = fragment_cache()
+    user_id = g.user['id'] if g.user else None
+    fragments = {}
+    stale = []
+
+    for post in posts:
+        entry = cache.get((post['id'], post['author_id'] == user_id))
+        if entry is not None and entry[0] == post['modified']:
+            fragments[post['id']] = entry[1]
+        else:
+            stale.append(post['id'])
+
+    for start in range(0, len(stale), QUERY_BATCH_SIZE):
+        ids = stale[start:start + QUERY_BATCH_SIZE]
+        rows = db.execute(
+            'SELECT p.id, title, img_path, gcp_output, created, modified,'
+            ' author_id, username'
+            ' FROM post p JOIN user u ON p.author_id = u.id'
+            f' WHERE p.id IN ({", ".join("?" * len(ids))})',
+            ids
+        ).fetchall()
+        for row in rows:
+            html = Markup(render_template('gcp/_post.html', post=row))
+            cache.set((row['id'], row['author_id'] == user_id),
+                      (row['modified'], html))
+            fragments[row['id']] = html
+
+    return [fragments[post['id']] for post in posts if post['id'] in fragments]
+
+def listing_etag(db):
+    """Return the ETag for the post listing.
+
+    The ETag follows ``post_generation``, which every insert, update and
+    delete bumps, and the viewer, since edit links depend on who is
+    logged in. No Last-Modified is sent: the newest ``modified`` doesn't
+    move when an older post is deleted or another user logs in, so
+    ``If-Modified-Since`` alone would get stale pages.
+    """
+    generation = db.execute('SELECT value FROM post_generation').fetchone()[0]
+    user_id = g.user['id'] if g.user else ''
+    return hashlib.sha256(f"{generation}:{user_id}".encode()).hexdigest()[:32]
+
+
 # @bp.route('/', methods=['GET', 'POST'])
 @bp.route('/' , methods=['GET', 'POST'])
 def index():
-    search = request.form.get('search', '')
+    query = request.form.get('search', '')
     db = get_db()
-    if not search:
+    # Search results and pages carrying flashed messages aren't cached.
+    etag = None
+    if request.method == 'GET' and '_flashes' not in session:
+        etag = listing_etag(db)
+        if httpcache.is_fresh(etag):
+            return httpcache.not_modified(etag)
+
+    if not query:
         posts = db.execute(
-            'SELECT p.id, title, img_path, gcp_output, created, author_id, username'
-            ' FROM post p JOIN user u ON p.author_id = u.id'
-            ' ORDER BY created DESC'
+            'SELECT id, modified, author_id FROM post ORDER BY created DESC'
         ).fetchall()
 
+    elif request.form.get('fuzzy'):
+        ids = search.fuzzy_search(db, query)
+        rows = {row['id']: row for row in db.execute(
+            'SELECT id, modified, author_id FROM post'
+            ' WHERE id IN (SELECT value FROM json_each(?))',
+            (json.dumps(ids),)
+        )}
+        posts = [rows[id] for id in ids if id in rows]
+
     else:
-        query = """
-            SELECT p.id, title, img_path, gcp_output, created, author_id, username
-            FROM post p 
-            JOIN user u ON p.author_id = u.id
+        sql = """
+            SELECT id, modified, author_id
+            FROM post
             WHERE title LIKE :search OR gcp_output LIKE :search
             OR img_path LIKE :file_search
             ORDER BY created DESC
         """
         # Handle file search for various extensions
-        if search.startswith("*."):
-            file_extension = search[2:]  # Extract file extension (e.g., "jpg", "png")
+        if query.startswith("*."):
+            file_extension = query[2:]  # Extract file extension (e.g., "jpg", "png")
             file_search = f'%.{file_extension}'
         else:
-            file_search = f'%{search}%'
-        posts = db.execute(query, {'search': f'%{search}%', 'file_search': file_search}).fetchall()  
+            file_search = f'%{query}%'
+        posts = db.execute(sql, {'search': f'%{query}%', 'file_search': file_search}).fetchall()  
         
-    return render_template('gcp/index.html', posts=posts)
+    fragments = render_post_fragments(db, posts)
+    response = make_response(render_template('gcp/index.html', fragments=fragments))
+    if etag is not None:
+        httpcache.add_validators(response, etag)
+    return response
+
+@bp.route('/uploads/<path:img_path>')
+def upload(img_path):
+    """Serve an uploaded image.
+
+    Content-addressed files never change, so they get the hash as a
+    strong ETag and may be cached for a year without revalidation.
+    """
+    digest = blobstore.digest_of(img_path)
+    if digest is None:
+        return send_from_directory(blobstore.upload_folder(), img_path)
+
+    response = send_from_directory(
+        blobstore.upload_folder(), img_path, etag=digest,
+        max_age=httpcache.IMMUTABLE_MAX_AGE,
+    )
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+@bp.route('/<int:id>/overlay/<level>.jpg')
+@login_required
+def post_overlay(id, level):
+    """Serve the post's image with its upload-time OCR boxes drawn on top.
+
+    Any signed-in reviewer may see them; drawing never calls Vision.
+    """
+    if level != 'all' and level not in overlay.LEVELS:
+        abort(404)
+    post = get_post(id, check_author=False)
+    path = overlay.render(post, level)
+    if path is None:
+        abort(404, f"Post id {id} has no OCR boxes.")
+    return send_file(path, max_age=3600)
+
+def recognize_image(db, path, template=None):
+    """OCRs a new image; returns ``(text, cells)``.
+
+    With a layout ``template`` the image is read cell by cell, and only
+    the cells that changed since the layout's last post; otherwise
+    ``cells`` is ``None``.
+    """
+    if template is None:
+        return ocr.recognize(path), None
+    previous = layout.previous_reading(db, template.id, blobstore.upload_folder())
+    return layout.process(path, template, ocr.get_batch_engine(), previous)
+
+def add_post(db, title, img_path, gcp_output, author_id, template=None,
+             cells=None, created=None):
+    """Inserts a post for a stored image and indexes its text.
+
+    Runs in the caller's transaction. Returns the new post's id.
+    """
+    cursor = db.execute(
+        'INSERT INTO post (title, img_path, gcp_output, author_id, layout_id, created)'
+        ' VALUES (?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))',
+        (title, img_path, gcp_output, author_id,
+         template.id if template else None, created)
+    )
+    if cells is not None:
+        layout.save_cells(db, cursor.lastrowid, cells)
+    search.index_post(db, cursor.lastrowid, title, gcp_output)
+    harvest.update_post(db, cursor.lastrowid)
+    return cursor.lastrowid
 
 @bp.route('/create', methods=('GET', 'POST'))
 @login_required
 def create():
+    db = get_db()
     if request.method == 'POST':
         title = request.form['title']
-        file = request.files['image']
+        file = request.files.get('image')
+        template = None
         error = None
 
+        if request.form.get('layout'):
+            template = layout.get_template(db, request.form.get('layout', type=int))
+
         if not title:
             error = 'Title is required.'
-        elif file.filename == '':
+        elif request.form.get('layout') and template is None:
+            error = 'Unknown layout.'
+        elif file is None or file.filename == '':
             error = 'No selected file.'
         elif not allowed_file(file.filename):
             error = 'Invalid file type.'
+        elif not file.stream.finish():
+            error = file.stream.error
 
         if error is not None:
             flash(error)
 
         else:
-            filename = secure_filename(file.filename)
-            img_path = filename
-            os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-            root_img_path = os.path.join(UPLOAD_FOLDER, filename)
-            file.save(root_img_path)  # Save the file in the flaskr/static/uploads/images directory
-            gcp_output = detect_document(root_img_path)
+            upload = file.stream
+            try:
+                gcp_output, cells = recognize_image(db, upload.path, template)
+            except ocr.OCRError:
+                # keep the upload; `flask reprocess` can read it later
+                current_app.logger.exception('OCR failed for %r', title)
+                gcp_output = ''
+                cells = None
+                flash('Text recognition is unavailable right now;'
+                      ' the image was saved without its text.')
 
-            db = get_db()
-            db.execute( 
-                'INSERT INTO post (title, img_path, gcp_output, author_id)'
-                ' VALUES (?, ?, ?, ?)',
-                (title, img_path, gcp_output, g.user['id'])
+            img_path = blobstore.add(
+                db, upload.path, upload.digest, upload.extension, upload.size
+            )
+            post_id = add_post(
+                db, title, img_path, gcp_output, g.user['id'], template, cells
             )
             db.commit()
+            invalidate_post_fragments(post_id)
             return redirect(url_for('gcp.index'))
 
-    return render_template('gcp/create.html')
+    return render_template('gcp/create.html', layouts=layout.list_templates(db))
 
 def get_post(id, check_author=True):
     post = get_db().execute(
@@ -158,7 +428,14 @@ def update(id):
                 ' WHERE id = ?',
                 (title, gcp_output, id)
             )
+            if gcp_output != post['gcp_output']:
+                # the cells no longer match the text; the next post of
+                # its layout must read the board again, not copy them
+                db.execute('DELETE FROM post_cell WHERE post_id = ?', (id,))
+            search.index_post(db, id, title, gcp_output)
+            harvest.update_post(db, id)
             db.commit()
+            invalidate_post_fragments(id)
             return redirect(url_for('gcp.index'))
 
     return render_template('gcp/update.html', post=post)
@@ -166,8 +443,17 @@ def update(id):
 @bp.route('/<int:id>/delete', methods=('POST',))
 @login_required
 def delete(id):
-    get_post(id)
+    post = get_post(id)
     db = get_db()
     db.execute('DELETE FROM post WHERE id = ?', (id,))
+    unused = blobstore.release(db, post['img_path'])
     db.commit()
+    if unused:
+        blobstore.remove_unused(db, post['img_path'])
+    invalidate_post_fragments(id)
+    overlay.remove(id)
+    if db.execute(
+        'SELECT 1 FROM post WHERE img_path = ?', (post['img_path'],)
+    ).fetchone() is None:
+        overlay.remove_bounds(post['img_path'])
     return redirect(url_for('gcp.index'))
\ No newline at end of file
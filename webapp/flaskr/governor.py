@@ -0,0 +1,242 @@
+"""One gate for every call to the OCR service.
+
+Each app has a :class:`Governor` in ``app.extensions['ocr_governor']``.
+Calls made through it, from any thread, pass three controls in turn:
+
+* a token bucket caps the request rate at ``OCR_RATE_LIMIT`` per second,
+  with bursts of up to ``OCR_BURST``;
+* an AIMD limit on calls in flight grows by one for each window of
+  calls that succeed within ``OCR_LATENCY_TARGET`` seconds, and halves
+  on an error or a slow call, between ``OCR_MIN_CONCURRENCY`` and
+  ``OCR_MAX_CONCURRENCY``;
+* retryable errors (quota, unavailable, deadline) are retried up to
+  ``OCR_MAX_RETRIES`` times after a full-jitter exponential backoff.
+
+The clock, sleep and random source are injectable so the whole thing can
+be driven deterministically in tests.
+"""
+import random
+import threading
+import time
+
+from flask import current_app
+
+from flaskr.ocr import OCRError
+
+# google.rpc.Code values worth retrying: DEADLINE_EXCEEDED,
+# RESOURCE_EXHAUSTED, ABORTED, INTERNAL and UNAVAILABLE.
+RETRYABLE_CODES = {4, 8, 10, 13, 14}
+# HTTP statuses carried by google.api_core exceptions.
+RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+# Weight of the newest call in the latency average.
+LATENCY_SMOOTHING = 0.2
+
+
+def is_retryable(error):
+    if isinstance(error, OCRError):
+        return error.code in RETRYABLE_CODES
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    status = getattr(error, 'code', None)
+    return isinstance(status, int) and status in RETRYABLE_STATUSES
+
+
+def is_service_error(error):
+    """True for errors raised by the OCR service or the network to it."""
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    try:
+        from google.api_core import exceptions
+    except ImportError:
+        return False
+    return isinstance(error, (exceptions.GoogleAPICallError, exceptions.RetryError))
+
+
+def as_ocr_error(error):
+    """Wraps a client-library error as :class:`OCRError`."""
+    status = getattr(error, 'grpc_status_code', None)
+    code = status.value[0] if status is not None else None
+    return OCRError(f'{type(error).__name__}: {error}', code=code)
+
+
+class TokenBucket(object):
+    """Blocks callers so no more than ``rate`` get through per second.
+
+    Up to ``burst`` tokens accumulate while idle. A ``rate`` of ``None``
+    lets everything through.
+    """
+
+    def __init__(self, rate, burst=1, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = float(self.burst)
+        self.waited = 0.0
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self._clock()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        if self.rate is None:
+            return
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+                self.waited += wait
+            self._sleep(wait)
+
+
+class AdaptiveLimit(object):
+    """An AIMD limit on the number of calls in flight.
+
+    Each call that succeeds within ``latency_target`` seconds raises the
+    limit by ``1 / limit``, about one per window of calls; an error or a
+    slow call multiplies it by ``backoff``.
+    """
+
+    def __init__(self, initial, minimum=1, maximum=64, latency_target=None,
+                 backoff=0.5):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self.in_flight = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, latency=None, error=False):
+        with self._cond:
+            self.in_flight -= 1
+            slow = (self.latency_target is not None and latency is not None
+                    and latency > self.latency_target)
+            if error or slow:
+                self.limit = max(self.minimum, self.limit * self.backoff)
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+
+class Governor(object):
+    """Rate-limits, bounds and retries calls to the OCR service."""
+
+    def __init__(self, rate=None, burst=1, concurrency=4, min_concurrency=1,
+                 max_concurrency=16, latency_target=None, max_retries=4,
+                 backoff_base=0.5, backoff_max=30.0, clock=time.monotonic,
+                 sleep=time.sleep, random=random.random):
+        self.bucket = TokenBucket(rate, burst, clock, sleep)
+        self.limit = AdaptiveLimit(
+            concurrency, min_concurrency, max_concurrency, latency_target
+        )
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._clock = clock
+        self._sleep = sleep
+        self._random = random
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.failures = 0
+        self.latency = None
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            rate=config['OCR_RATE_LIMIT'],
+            burst=config['OCR_BURST'],
+            concurrency=config['OCR_MIN_CONCURRENCY'],
+            min_concurrency=config['OCR_MIN_CONCURRENCY'],
+            max_concurrency=config['OCR_MAX_CONCURRENCY'],
+            latency_target=config['OCR_LATENCY_TARGET'],
+            max_retries=config['OCR_MAX_RETRIES'],
+            backoff_base=config['OCR_BACKOFF_BASE'],
+            backoff_max=config['OCR_BACKOFF_MAX'],
+        )
+
+    def backoff(self, attempt):
+        """Full jitter: anywhere up to the exponential delay."""
+        ceiling = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+        return self._random() * ceiling
+
+    def _record(self, latency=None, error=False):
+        with self._lock:
+            self.calls += 1
+            if error:
+                self.errors += 1
+            if latency is not None:
+                self.latency = latency if self.latency is None else (
+                    LATENCY_SMOOTHING * latency
+                    + (1 - LATENCY_SMOOTHING) * self.latency
+                )
+
+    def call(self, fn, *args, **kwargs):
+        """Calls ``fn(*args, **kwargs)``, retrying retryable errors.
+
+        The last error is re-raised once the retries run out; errors that
+        aren't retryable are raised straight away. Either way, errors from
+        the client library or the network come out as :class:`OCRError`,
+        so callers can keep the upload and move on.
+        """
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            self.limit.acquire()
+            started = self._clock()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                self.limit.release(error=True)
+                self._record(error=True)
+                if not is_retryable(e) or attempt >= self.max_retries:
+                    with self._lock:
+                        self.failures += 1
+                    if not isinstance(e, OCRError) and is_service_error(e):
+                        raise as_ocr_error(e) from e
+                    raise
+            else:
+                latency = self._clock() - started
+                self.limit.release(latency)
+                self._record(latency)
+                return result
+
+            with self._lock:
+                self.retries += 1
+            self._sleep(self.backoff(attempt))
+            attempt += 1
+
+    def stats(self):
+        return {
+            'limit': int(self.limit.limit),
+            'in_flight': self.limit.in_flight,
+            'tokens': self.bucket.tokens,
+            'throttled_seconds': self.bucket.waited,
+            'calls': self.calls,
+            'errors': self.errors,
+            'retries': self.retries,
+            'failures': self.failures,
+            'latency': self.latency,
+        }
+
+
+def current():
+    return current_app.extensions['ocr_governor']
+
+
+def init_app(app):
+    app.extensions['ocr_governor'] = Governor.from_config(app.config)
@@ -0,0 +1,199 @@
+"""Harvest totals per crop, week and season.
+
+Posts read with a layout template hold one tab-separated line per board
+row, in the template's column order. When the template has a crop column
+and a quantity column, each row with a number in it becomes a
+``harvest_entry``. Triggers on that table add and subtract the entry
+from ``harvest_weekly`` and ``harvest_season``, so the summaries served
+here read a handful of pre-aggregated rows however large the archive
+gets.
+
+:func:`update_post` must be called whenever a post's text changes;
+deleting a post clears its entries through a trigger.
+"""
+import re
+from datetime import date, timedelta
+
+import click
+from flask import Blueprint, jsonify, render_template, request
+from flask.cli import with_appcontext
+
+from flaskr import layout
+from flaskr.db import get_db
+
+bp = Blueprint('harvest', __name__, url_prefix='/harvest')
+
+# Template column names, lower-cased, that hold each field.
+CROP_COLUMNS = {'crop', 'crops', 'item', 'produce', 'variety'}
+QUANTITY_COLUMNS = {'qty', 'quantity', 'amount', 'total', 'weight', 'count'}
+UNIT_COLUMNS = {'unit', 'units', 'uom'}
+
+# A number, optionally followed by its unit ("12", "3.5 lbs", "4,5kg").
+QUANTITY = re.compile(r'^\s*(\d+(?:[.,]\d+)?)\s*(.*?)\s*$')
+
+
+def normalize(value):
+    return ' '.join(value.lower().split())
+
+
+def find_column(columns, names):
+    for index, column in enumerate(columns):
+        if normalize(column) in names:
+            return index
+    return None
+
+
+def parse_entries(text, columns):
+    """Yields ``(line, crop, unit, quantity)`` for each harvest row.
+
+    Rows without a crop or a leading number in the quantity column,
+    such as the header row, are skipped.
+    """
+    crop_col = find_column(columns, CROP_COLUMNS)
+    quantity_col = find_column(columns, QUANTITY_COLUMNS)
+    unit_col = find_column(columns, UNIT_COLUMNS)
+    if crop_col is None or quantity_col is None or not text:
+        return
+
+    for line, row in enumerate(text.splitlines()):
+        values = row.split('\t')
+
+        def value(index):
+            return values[index] if index is not None and index < len(values) else ''
+
+        crop = normalize(value(crop_col))
+        match = QUANTITY.match(value(quantity_col))
+        if not crop or match is None:
+            continue
+        unit = normalize(value(unit_col)) or normalize(match.group(2))
+        yield line, crop, unit, float(match.group(1).replace(',', '.'))
+
+
+def week_of(created):
+    """Returns ``(week, season)``: the week's Monday and that Monday's year.
+
+    Taking the season from the Monday keeps every week in one season.
+    """
+    day = created.date() if hasattr(created, 'date') else date.fromisoformat(
+        str(created)[:10]
+    )
+    monday = day - timedelta(days=day.weekday())
+    return monday.isoformat(), monday.year
+
+
+def update_post(db, post_id):
+    """Replaces a post's harvest entries with those in its current text.
+
+    Runs in the caller's transaction.
+    """
+    db.execute('DELETE FROM harvest_entry WHERE post_id = ?', (post_id,))
+    post = db.execute(
+        'SELECT gcp_output, created, layout_id FROM post WHERE id = ?', (post_id,)
+    ).fetchone()
+    if post is None or post['layout_id'] is None:
+        return
+    template = layout.get_template(db, post['layout_id'])
+    if template is None:
+        return
+    week, season = week_of(post['created'])
+    db.executemany(
+        'INSERT INTO harvest_entry'
+        ' (post_id, line, crop, unit, quantity, week, season)'
+        ' VALUES (?, ?, ?, ?, ?, ?, ?)',
+        [(post_id, line, crop, unit, quantity, week, season)
+         for line, crop, unit, quantity in parse_entries(
+             post['gcp_output'], template.columns
+         )]
+    )
+
+
+def rebuild(db):
+    """Recomputes every entry and aggregate from the posts table."""
+    db.execute('DELETE FROM harvest_entry')
+    db.execute('DELETE FROM harvest_weekly')
+    db.execute('DELETE FROM harvest_season')
+    posts = db.execute(
+        'SELECT id FROM post WHERE layout_id IS NOT NULL'
+    ).fetchall()
+    for post in posts:
+        update_post(db, post['id'])
+    db.commit()
+    return len(posts)
+
+
+def seasons(db):
+    return [row['season'] for row in db.execute(
+        'SELECT DISTINCT season FROM harvest_season ORDER BY season DESC'
+    )]
+
+
+def season_totals(db, season):
+    return [dict(row) for row in db.execute(
+        'SELECT crop, unit, total, entries FROM harvest_season'
+        ' WHERE season = ? ORDER BY total DESC, crop',
+        (season,)
+    )]
+
+
+def weekly_totals(db, season, crop=None):
+    sql = (
+        'SELECT crop, unit, week, total, entries FROM harvest_weekly'
+        ' WHERE week >= ? AND week < ?'
+    )
+    args = [f'{season:04d}-01-01', f'{season + 1:04d}-01-01']
+    if crop is not None:
+        sql += ' AND crop = ?'
+        args.append(normalize(crop))
+    return [dict(row) for row in db.execute(sql + ' ORDER BY week, crop', args)]
+
+
+def selected_season(db):
+    season = request.args.get('season', type=int)
+    if season is None:
+        available = seasons(db)
+        season = available[0] if available else date.today().year
+    return season
+
+
+@bp.route('/')
+def dashboard():
+    db = get_db()
+    season = selected_season(db)
+    weekly = weekly_totals(db, season)
+    weeks = sorted({row['week'] for row in weekly})
+    grid = {}
+    for row in weekly:
+        grid.setdefault((row['crop'], row['unit']), {})[row['week']] = row['total']
+    return render_template(
+        'harvest/dashboard.html', season=season, seasons=seasons(db),
+        totals=season_totals(db, season), weeks=weeks, grid=grid,
+    )
+
+
+@bp.route('/seasons.json')
+def seasons_json():
+    db = get_db()
+    season = selected_season(db)
+    return jsonify(season=season, seasons=seasons(db), totals=season_totals(db, season))
+
+
+@bp.route('/weekly.json')
+def weekly_json():
+    db = get_db()
+    season = selected_season(db)
+    return jsonify(
+        season=season, weeks=weekly_totals(db, season, request.args.get('crop'))
+    )
+
+
+@click.command('rebuild-harvest')
+@with_appcontext
+def rebuild_harvest_command():
+    """Recompute harvest entries and totals from all layout posts."""
+    count = rebuild(get_db())
+    click.echo(f'Rebuilt harvest totals from {count} posts.')
+
+
+def init_app(app):
+    app.register_blueprint(bp)
+    app.cli.add_command(rebuild_harvest_command)
@@ -0,0 +1,31 @@
+"""Helpers for conditional GETs on pages built from the database.
+
+Views compute a cheap ETag before doing any real work, return
+:func:`not_modified` when the client's copy is still current, and
+otherwise attach the same ETag to the full response with
+:func:`add_validators`. There is no Last-Modified: deleting a post moves
+no timestamp, so a date alone can't tell that a page changed.
+"""
+from flask import current_app, request
+from werkzeug.http import is_resource_modified
+
+# Long enough that browsers never revalidate content-addressed files.
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def is_fresh(etag):
+    """Return ``True`` if the client already has this representation."""
+    return not is_resource_modified(request.environ, etag=etag)
+
+
+def add_validators(response, etag):
+    """Mark a per-user page as cacheable only after revalidation."""
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    return response
+
+
+def not_modified(etag):
+    return add_validators(current_app.response_class(status=304), etag)
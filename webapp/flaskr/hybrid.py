@@ -0,0 +1,116 @@
+"""Confidence-gated hybrid OCR.
+
+Vision reads the whole page and reports a confidence for every word.
+Words at or above ``HYBRID_CONFIDENCE_THRESHOLD`` are kept as they are.
+Runs of low-confidence words on the same line are cropped as one region
+and re-read by the local TrOCR model in a single batch, and the new text
+is put back in place of the run, so reading order is unchanged. The slow
+model only ever sees the few regions that need it. If the second pass
+fails, because TrOCR isn't installed or its server is down, Vision's
+own reading is returned.
+"""
+from flask import current_app
+
+from flaskr import gcp
+
+# The first pass is a Vision call.
+ONLINE = True
+# Pixels of context kept around each crop.
+CROP_PADDING = 4
+
+
+def same_line(a, b):
+    """True if two words share a paragraph and overlap vertically."""
+    if a.line != b.line:
+        return False
+    overlap = min(a.box[3], b.box[3]) - max(a.box[1], b.box[1])
+    height = min(a.box[3] - a.box[1], b.box[3] - b.box[1])
+    return height > 0 and overlap >= height / 2
+
+
+def low_confidence_regions(words, threshold):
+    """Group low-confidence words into ``(start, end)`` index ranges.
+
+    Adjacent low-confidence words on the same line form one region, so
+    the recogniser sees a line fragment rather than isolated words.
+    """
+    regions = []
+    for index, word in enumerate(words):
+        if word.confidence >= threshold:
+            continue
+        if regions and regions[-1][1] == index and same_line(words[index - 1], word):
+            regions[-1][1] = index + 1
+        else:
+            regions.append([index, index + 1])
+    return [tuple(region) for region in regions]
+
+
+def region_box(words, region, size):
+    start, end = region
+    boxes = [word.box for word in words[start:end]]
+    width, height = size
+    return (
+        max(min(box[0] for box in boxes) - CROP_PADDING, 0),
+        max(min(box[1] for box in boxes) - CROP_PADDING, 0),
+        min(max(box[2] for box in boxes) + CROP_PADDING, width),
+        min(max(box[3] for box in boxes) + CROP_PADDING, height),
+    )
+
+
+def merge(words, regions, texts):
+    """Return the page text with each region replaced by its new reading.
+
+    A region whose second reading comes back empty keeps Vision's words.
+    """
+    replacements = dict(zip((start for start, _ in regions), zip(regions, texts)))
+    tokens = []
+    index = 0
+    while index < len(words):
+        if index in replacements:
+            (start, end), text = replacements[index]
+            text = text.strip()
+            tokens.extend([text] if text else [w.text for w in words[start:end]])
+            index = end
+        else:
+            tokens.append(words[index].text)
+            index += 1
+    return "".join(token + " " for token in tokens)
+
+
+def recognize_words(image, words, threshold, recognize_batch):
+    regions = low_confidence_regions(words, threshold)
+    crops = [image.crop(region_box(words, region, image.size)) for region in regions]
+    texts = recognize_batch(crops)
+    return merge(words, regions, texts), len(regions)
+
+
+def warm_up():
+    from flaskr import trocr
+
+    gcp.warm_up()
+    trocr.warm_up()
+
+
+def recognize(path, recognize_batch=None):
+    """Detects document text, re-reading low-confidence regions locally."""
+    from PIL import Image
+
+    if recognize_batch is None:
+        from flaskr.trocr import recognize_batch
+
+    threshold = current_app.config['HYBRID_CONFIDENCE_THRESHOLD']
+    words = list(gcp.document_words(gcp.annotate(path)))
+    with Image.open(path) as image:
+        image.load()
+        try:
+            text, regions = recognize_words(image, words, threshold, recognize_batch)
+        except Exception:
+            # the Vision read is paid for and good enough; don't lose it
+            current_app.logger.exception('hybrid OCR: second pass failed for %r', path)
+            text, regions = merge(words, [], []), 0
+    current_app.logger.info(
+        'hybrid OCR: %d of %d words below %.2f, re-read as %d regions',
+        sum(1 for word in words if word.confidence < threshold),
+        len(words), threshold, regions,
+    )
+    return text
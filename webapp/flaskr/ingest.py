@@ -0,0 +1,226 @@
+"""Single-pass ingestion of uploaded images.
+
+Werkzeug hands each uploaded file part to the stream returned by
+``Request._get_file_stream``. :class:`UploadStream` writes those chunks
+straight to a temp file next to the blob store while hashing them and
+sniffing the image header, so by the time the view runs the upload is on
+disk, its content hash is known and its real format and dimensions have
+been checked without decoding any pixels. Uploads that turn out not to be
+images, or that declare more than ``MAX_IMAGE_PIXELS``, stop being written
+as soon as the header is read.
+"""
+import hashlib
+import os
+import struct
+
+from flask import Request, current_app
+
+from flaskr import blobstore
+
+# Give up on finding the dimensions after this many header bytes.
+MAX_HEADER_BYTES = 1024 * 1024
+
+EXTENSIONS = {'png': 'png', 'gif': 'gif', 'jpeg': 'jpg'}
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+GIF_SIGNATURES = (b'GIF87a', b'GIF89a')
+JPEG_SOI = b'\xff\xd8\xff'
+# start-of-frame markers carry the image size; DHT/JPG/DAC share the range
+JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7,
+            0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+JPEG_STANDALONE = {0x01} | set(range(0xD0, 0xD8))
+
+
+class ImageSniffer(object):
+    """Incrementally reads the format and size from an image header.
+
+    Feed it the file in chunks of any size. ``done`` becomes true once
+    the size is known or the data is recognised as something else, in
+    which case ``format`` stays ``None``. Only the few bytes around the
+    next header field are ever buffered.
+    """
+
+    def __init__(self):
+        self.format = None
+        self.width = None
+        self.height = None
+        self.done = False
+        self._buf = bytearray()
+        self._skip = 0
+        self._seen = 0
+
+    def feed(self, data):
+        if self.done:
+            return
+        self._seen += len(data)
+        if self._skip:
+            skipped = min(self._skip, len(data))
+            self._skip -= skipped
+            data = data[skipped:]
+        self._buf += data
+        self._parse()
+        if not self.done and self._seen > MAX_HEADER_BYTES:
+            self._finish(None)
+
+    def _finish(self, size):
+        if size is None:
+            self.format = None
+        else:
+            self.width, self.height = size
+        self.done = True
+        self._buf.clear()
+
+    def _parse(self):
+        buf = self._buf
+        if self.format is None:
+            if buf.startswith(PNG_SIGNATURE):
+                self.format = 'png'
+            elif bytes(buf[:6]) in GIF_SIGNATURES:
+                self.format = 'gif'
+            elif buf.startswith(JPEG_SOI):
+                self.format = 'jpeg'
+                del buf[:2]
+            elif len(buf) >= len(PNG_SIGNATURE):
+                return self._finish(None)
+            else:
+                return
+
+        if self.format == 'png':
+            if len(buf) >= 24:
+                if buf[12:16] != b'IHDR':
+                    return self._finish(None)
+                self._finish(struct.unpack('>II', buf[16:24]))
+        elif self.format == 'gif':
+            if len(buf) >= 10:
+                self._finish(struct.unpack('<HH', buf[6:10]))
+        else:
+            self._parse_jpeg()
+
+    def _parse_jpeg(self):
+        buf = self._buf
+        while True:
+            # markers may be padded with any number of 0xFF fill bytes
+            while len(buf) >= 2 and buf[0] == 0xFF and buf[1] == 0xFF:
+                del buf[0]
+            if len(buf) < 2:
+                return
+            if buf[0] != 0xFF:
+                return self._finish(None)
+            marker = buf[1]
+            if marker in JPEG_STANDALONE:
+                del buf[:2]
+                continue
+            if marker in (0xD9, 0xDA):
+                # end of image or start of scan before any frame header
+                return self._finish(None)
+            if len(buf) < 4:
+                return
+            length = struct.unpack('>H', buf[2:4])[0]
+            if marker in JPEG_SOF:
+                if len(buf) < 9:
+                    return
+                height, width = struct.unpack('>HH', buf[5:9])
+                return self._finish((width, height))
+            segment = 2 + length
+            if len(buf) >= segment:
+                del buf[:segment]
+            else:
+                self._skip = segment - len(buf)
+                buf.clear()
+                return
+
+
+class UploadStream(object):
+    """Writable file stream that hashes and sniffs an upload as it lands.
+
+    After parsing, ``path``, ``digest``, ``size``, ``format``, ``width``
+    and ``height`` describe the upload and ``error`` is set if it was
+    rejected. The temp file is removed on close unless it was moved into
+    the blob store first.
+    """
+
+    def __init__(self, max_pixels):
+        self.max_pixels = max_pixels
+        self.sniffer = ImageSniffer()
+        self._sha = hashlib.sha256()
+        self._file, self.path = blobstore.temp_file()
+        self.size = 0
+        self.error = None
+
+    @property
+    def format(self):
+        return self.sniffer.format
+
+    @property
+    def width(self):
+        return self.sniffer.width
+
+    @property
+    def height(self):
+        return self.sniffer.height
+
+    @property
+    def digest(self):
+        return self._sha.hexdigest()
+
+    @property
+    def extension(self):
+        return EXTENSIONS.get(self.format)
+
+    def write(self, data):
+        if self.error is not None:
+            return len(data)
+
+        sniffer = self.sniffer
+        if not sniffer.done:
+            sniffer.feed(data)
+            if sniffer.done:
+                self._check_header()
+                if self.error is not None:
+                    self._file.truncate(0)
+                    return len(data)
+
+        self._sha.update(data)
+        self._file.write(data)
+        self.size += len(data)
+        return len(data)
+
+    def _check_header(self):
+        if self.format is None:
+            self.error = 'Unsupported image format.'
+        elif self.width * self.height > self.max_pixels:
+            self.error = (
+                f'Image is too large ({self.width}x{self.height} pixels).'
+            )
+
+    def finish(self):
+        """Flush the upload to disk and validate what was received."""
+        if not self._file.closed:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+        if self.error is None and not self.sniffer.done:
+            self.error = 'Unsupported image format.'
+        return self.error is None
+
+    def seek(self, offset, whence=0):
+        # Werkzeug rewinds the stream once the part is complete.
+        if not self._file.closed:
+            self._file.flush()
+        return 0
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class UploadRequest(Request):
+    """Request class that streams file uploads through UploadStream."""
+
+    def _get_file_stream(self, total_content_length, content_type,
+                         filename=None, content_length=None):
+        return UploadStream(current_app.config['MAX_IMAGE_PIXELS'])
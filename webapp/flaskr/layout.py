@@ -0,0 +1,668 @@
+"""Layout templates for boards that are ruled the same way every time.
+
+A template is registered once from a reference photo: the board is found
+and rectified, its ruled lines are detected, and the cells between them
+are stored as fractions of the board's width and height, along with the
+spreadsheet column each cell's column maps to. Where the table covers
+only part of the board, its box is given at registration and lines are
+looked for inside it alone.
+
+New photos of the same board are rectified to the template's size using
+AprilTag fiducials (tags 0-3 on the top-left, top-right, bottom-right and
+bottom-left corners) when they are present, or the board's outline
+otherwise. Cells with no ink are skipped and the rest are read together by
+a batch OCR engine, so each result lands directly in its row and column.
+When the board has been photographed before, the new photo is registered
+onto the last one and only the cells whose fingerprint changed are read;
+the others keep the text they had.
+
+numpy and OpenCV are imported on first use.
+"""
+import json
+import os
+import sqlite3
+from collections import namedtuple
+
+import click
+from flask.cli import with_appcontext
+
+from flaskr.db import get_db
+
+Template = namedtuple('Template', 'id name width height columns cells')
+
+# A cell as stored in a template: grid position plus (x0, y0, x1, y1) as
+# fractions of the rectified board.
+Cell = namedtuple('Cell', 'row col x0 y0 x1 y1')
+
+# Width of a rectified reference board; height follows its aspect ratio.
+REFERENCE_WIDTH = 1600
+# Longest side used when looking for the board outline.
+DETECT_SIZE = 1000
+# A ruled line must cover this fraction of the board.
+MIN_LINE_FRACTION = 0.3
+# Lines closer than this fraction of the board are one line.
+MIN_CELL_FRACTION = 0.02
+# Strokes are widened by this fraction of the board before looking for
+# lines, so hand-ruled lines that wobble or slant stay continuous.
+LINE_SLACK_FRACTION = 0.005
+# Fraction of each cell trimmed off every side to stay clear of the rules.
+CELL_MARGIN = 0.08
+# Share of dark pixels above which a cell counts as written in.
+INK_RATIO = 0.015
+# Cells are fingerprinted on a HASH_SIZE x HASH_SIZE grid of blocks.
+HASH_SIZE = 16
+# Fingerprints further apart than this many bits mean the cell changed.
+HASH_DISTANCE = 12
+# Share of a cell's ink that may move before the cell counts as changed.
+DENSITY_CHANGE = 0.12
+# Width boards are shrunk to when registering one photo onto another.
+MATCH_WIDTH = 400
+
+
+def load_gray(path):
+    """Returns an image as a 2-D uint8 array."""
+    import numpy as np
+    from PIL import Image, ImageOps
+
+    with Image.open(path) as image:
+        return np.asarray(ImageOps.exif_transpose(image).convert('L'))
+
+
+def order_corners(points):
+    """Orders four points as top-left, top-right, bottom-right, bottom-left."""
+    import numpy as np
+
+    points = np.asarray(points, dtype='float32').reshape(4, 2)
+    total = points.sum(axis=1)
+    diff = np.diff(points, axis=1).ravel()
+    return np.array([
+        points[np.argmin(total)], points[np.argmin(diff)],
+        points[np.argmax(total)], points[np.argmax(diff)],
+    ], dtype='float32')
+
+
+def find_fiducials(gray):
+    """Returns board corners from AprilTags 0-3, or ``None``."""
+    import numpy as np
+    try:
+        import pyapriltags
+    except ImportError:
+        return None
+
+    detector = pyapriltags.Detector(families='tag36h11')
+    centres = {tag.tag_id: tag.center for tag in detector.detect(gray)}
+    if not all(tag_id in centres for tag_id in range(4)):
+        return None
+    return np.array([centres[tag_id] for tag_id in range(4)], dtype='float32')
+
+
+def find_outline(gray):
+    """Returns the corners of the board's four-sided outline, or ``None``.
+
+    The board is taken to be the largest bright region once its ruled
+    lines and writing are closed over; if that isn't a quadrilateral,
+    the largest closed edge contour is tried instead.
+    """
+    import cv2
+    import numpy as np
+
+    scale = min(DETECT_SIZE / max(gray.shape), 1.0)
+    small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    blurred = cv2.GaussianBlur(small, (5, 5), 0)
+
+    _, bright = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    kernel = np.ones((DETECT_SIZE // 50, DETECT_SIZE // 50), np.uint8)
+    bright = cv2.morphologyEx(bright, cv2.MORPH_CLOSE, kernel)
+    edges = cv2.dilate(cv2.Canny(blurred, 50, 150), np.ones((3, 3), np.uint8))
+
+    for mask in (bright, edges):
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        for contour in sorted(contours, key=cv2.contourArea, reverse=True)[:5]:
+            approx = cv2.approxPolyDP(contour, 0.02 * cv2.arcLength(contour, True), True)
+            if len(approx) == 4 and cv2.contourArea(approx) > 0.2 * small.size:
+                return order_corners(approx) / scale
+    return None
+
+
+def find_board(gray):
+    """Returns the board's corners, falling back to the whole image."""
+    import numpy as np
+
+    corners = find_fiducials(gray)
+    if corners is None:
+        corners = find_outline(gray)
+    if corners is None:
+        height, width = gray.shape
+        corners = np.array(
+            [(0, 0), (width, 0), (width, height), (0, height)], dtype='float32'
+        )
+    return corners
+
+
+def board_size(corners, table=(0, 0, 1, 1)):
+    """Returns a rectified (width, height) matching the board's aspect.
+
+    The board is made wide enough for ``table``, a region given as
+    fractions of the board, to be ``REFERENCE_WIDTH`` across, but no
+    wider than it is in the photo.
+    """
+    import numpy as np
+
+    tl, tr, br, bl = corners
+    width = (np.linalg.norm(tr - tl) + np.linalg.norm(br - bl)) / 2
+    height = (np.linalg.norm(bl - tl) + np.linalg.norm(br - tr)) / 2
+    target = max(min(REFERENCE_WIDTH / (table[2] - table[0]), width), REFERENCE_WIDTH)
+    target = int(round(target))
+    return target, max(int(round(target * height / width)), 1)
+
+
+def table_region(corners, box):
+    """Maps a ``(left, top, right, bottom)`` box in the photo onto the board.
+
+    Returns the box's bounds as fractions of the rectified board.
+    """
+    import cv2
+    import numpy as np
+
+    unit = np.array([(0, 0), (1, 0), (1, 1), (0, 1)], dtype='float32')
+    matrix = cv2.getPerspectiveTransform(corners, unit)
+    left, top, right, bottom = box
+    points = np.array([[(left, top), (right, top), (right, bottom), (left, bottom)]],
+                      dtype='float32')
+    points = cv2.perspectiveTransform(points, matrix)[0].clip(0, 1)
+    x0, y0 = points.min(axis=0)
+    x1, y1 = points.max(axis=0)
+    if x1 - x0 < MIN_CELL_FRACTION or y1 - y0 < MIN_CELL_FRACTION:
+        raise ValueError('The table region is outside the board.')
+    return float(x0), float(y0), float(x1), float(y1)
+
+
+def rectify(gray, corners, size):
+    """Warps the board onto a ``size`` (width, height) rectangle."""
+    import cv2
+    import numpy as np
+
+    width, height = size
+    target = np.array(
+        [(0, 0), (width, 0), (width, height), (0, height)], dtype='float32'
+    )
+    matrix = cv2.getPerspectiveTransform(corners, target)
+    return cv2.warpPerspective(
+        gray, matrix, (width, height), flags=cv2.INTER_LINEAR,
+        borderMode=cv2.BORDER_REPLICATE,
+    )
+
+
+def ink_mask(board):
+    """Marks dark strokes (ink and ruled lines) as 1, background as 0."""
+    import cv2
+
+    binary = cv2.adaptiveThreshold(
+        board, 1, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV, 31, 15
+    )
+    return binary
+
+
+def line_positions(profile, min_count, min_gap):
+    """Centres of runs where ``profile`` reaches ``min_count``."""
+    import numpy as np
+
+    hits = np.flatnonzero(profile >= min_count)
+    positions = []
+    run = []
+    for index in hits:
+        if run and index - run[-1] > 1:
+            positions.append(sum(run) / len(run))
+            run = []
+        run.append(index)
+    if run:
+        positions.append(sum(run) / len(run))
+
+    merged = []
+    for position in positions:
+        if merged and position - merged[-1] < min_gap:
+            merged[-1] = (merged[-1] + position) / 2
+        else:
+            merged.append(position)
+    return merged
+
+
+def detect_grid(board):
+    """Finds ruled lines on a rectified board; returns ``(xs, ys)``."""
+    import cv2
+    import numpy as np
+
+    height, width = board.shape
+    mask = ink_mask(board)
+    slack_x = max(int(width * LINE_SLACK_FRACTION), 1)
+    slack_y = max(int(height * LINE_SLACK_FRACTION), 1)
+    horizontal = cv2.morphologyEx(
+        cv2.dilate(mask, np.ones((slack_y, 1), np.uint8)), cv2.MORPH_OPEN,
+        cv2.getStructuringElement(cv2.MORPH_RECT, (max(width // 10, 1), 1)),
+    )
+    vertical = cv2.morphologyEx(
+        cv2.dilate(mask, np.ones((1, slack_x), np.uint8)), cv2.MORPH_OPEN,
+        cv2.getStructuringElement(cv2.MORPH_RECT, (1, max(height // 10, 1))),
+    )
+    ys = line_positions(horizontal.sum(axis=1), MIN_LINE_FRACTION * width,
+                        MIN_CELL_FRACTION * height)
+    xs = line_positions(vertical.sum(axis=0), MIN_LINE_FRACTION * height,
+                        MIN_CELL_FRACTION * width)
+    return with_edges(xs, width), with_edges(ys, height)
+
+
+def with_edges(positions, length):
+    """Treats the board's own edges as the outermost rules.
+
+    Rules drawn along the edge of the board are usually cropped away by
+    rectification, so they are added back unless a detected line is
+    already close to the edge.
+    """
+    min_gap = MIN_CELL_FRACTION * length
+    if not positions or positions[0] > min_gap:
+        positions = [0] + positions
+    if positions[-1] < length - min_gap:
+        positions = positions + [length]
+    return positions
+
+
+def grid_cells(xs, ys, size):
+    """Turns line positions into template cells."""
+    width, height = size
+    return [
+        Cell(row, col, x0 / width, y0 / height, x1 / width, y1 / height)
+        for row, (y0, y1) in enumerate(zip(ys, ys[1:]))
+        for col, (x0, x1) in enumerate(zip(xs, xs[1:]))
+    ]
+
+
+def uniform_cells(rows, cols):
+    return [
+        Cell(row, col, col / cols, row / rows, (col + 1) / cols, (row + 1) / rows)
+        for row in range(rows)
+        for col in range(cols)
+    ]
+
+
+def within(cells, table):
+    """Moves cells laid out over a whole region into ``table``."""
+    x0, y0, x1, y1 = table
+    width, height = x1 - x0, y1 - y0
+    return [
+        cell._replace(x0=x0 + cell.x0 * width, y0=y0 + cell.y0 * height,
+                      x1=x0 + cell.x1 * width, y1=y0 + cell.y1 * height)
+        for cell in cells
+    ]
+
+
+def cell_slices(cells, size, margin=CELL_MARGIN):
+    """Pixel ``(rows, cols)`` slices for each cell's interior."""
+    width, height = size
+    slices = []
+    for cell in cells:
+        dx = (cell.x1 - cell.x0) * margin
+        dy = (cell.y1 - cell.y0) * margin
+        slices.append((
+            slice(int((cell.y0 + dy) * height), max(int((cell.y1 - dy) * height), 1)),
+            slice(int((cell.x0 + dx) * width), max(int((cell.x1 - dx) * width), 1)),
+        ))
+    return slices
+
+
+def cell_blocks(board, cells, size, blocks=HASH_SIZE, margin=CELL_MARGIN):
+    """Ink density of every cell, split into ``blocks`` x ``blocks``.
+
+    All cells are summed at once from the ink mask's integral image.
+    Returns ``(sums, areas)``, each shaped ``(len(cells), blocks, blocks)``.
+    """
+    import cv2
+    import numpy as np
+
+    width, height = size
+    integral = cv2.integral(ink_mask(board))
+    x0, y0, x1, y1 = np.array([cell[2:] for cell in cells], dtype='float64').reshape(-1, 4).T
+    dx = (x1 - x0) * margin
+    dy = (y1 - y0) * margin
+    steps = np.linspace(0, 1, blocks + 1)
+    xs = np.clip(np.rint(
+        ((x0 + dx)[:, None] + (x1 - x0 - 2 * dx)[:, None] * steps) * width
+    ).astype(int), 0, width)
+    ys = np.clip(np.rint(
+        ((y0 + dy)[:, None] + (y1 - y0 - 2 * dy)[:, None] * steps) * height
+    ).astype(int), 0, height)
+
+    top, bottom = ys[:, :-1, None], ys[:, 1:, None]
+    left, right = xs[:, None, :-1], xs[:, None, 1:]
+    sums = (integral[bottom, right] - integral[top, right]
+            - integral[bottom, left] + integral[top, left])
+    areas = (bottom - top) * (right - left)
+    return sums, areas
+
+
+def fingerprint(board, cells, size):
+    """Returns ``(ink, hashes, density)`` for every cell.
+
+    ``ink`` flags cells with writing in them. ``hashes`` holds a
+    perceptual hash per cell, one bit per block set where the block has
+    more ink than the cell's average, so it follows the shape of the
+    writing rather than the lighting. ``density`` is the ink share of
+    each block.
+    """
+    import numpy as np
+
+    sums, areas = cell_blocks(board, cells, size)
+    ink = sums.sum(axis=(1, 2)) > INK_RATIO * np.maximum(areas.sum(axis=(1, 2)), 1)
+    density = sums / np.maximum(areas, 1)
+    bits = density > density.mean(axis=(1, 2), keepdims=True)
+    return ink, np.packbits(bits.reshape(len(cells), -1), axis=1), density
+
+
+def hash_distance(hashes, others):
+    """Number of differing bits between two arrays of packed hashes."""
+    import numpy as np
+
+    return np.unpackbits(hashes ^ others, axis=1).sum(axis=1)
+
+
+def density_change(density, other):
+    """Block-by-block ink difference of each cell, relative to its ink."""
+    import numpy as np
+
+    moved = np.abs(density - other).sum(axis=(1, 2))
+    total = np.maximum(density.sum(axis=(1, 2)), other.sum(axis=(1, 2)))
+    return moved / np.maximum(total, 1e-9)
+
+
+def populated(board, cells, size):
+    """Returns a flag per cell: does it contain any writing?"""
+    return fingerprint(board, cells, size)[0].tolist()
+
+
+def align(path, template):
+    """Rectifies a photo onto the template's board."""
+    gray = load_gray(path)
+    return rectify(gray, find_board(gray), (template.width, template.height))
+
+
+def match_board(board, reference):
+    """Registers ``board`` onto ``reference``, both rectified the same way.
+
+    Two photos of one board never have their corners found at quite the
+    same spot; an affine ECC fit on shrunken copies takes out the few
+    pixels of drift so cells can be compared block for block. The board
+    is returned unchanged if the fit doesn't converge.
+    """
+    import cv2
+    import numpy as np
+
+    height, width = board.shape
+    scale = min(MATCH_WIDTH / width, 1.0)
+    small, small_reference = (
+        cv2.resize(image, None, fx=scale, fy=scale,
+                   interpolation=cv2.INTER_AREA).astype('float32')
+        for image in (board, reference)
+    )
+    warp = np.eye(2, 3, dtype='float32')
+    criteria = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 50, 1e-4)
+    try:
+        _, warp = cv2.findTransformECC(
+            small_reference, small, warp, cv2.MOTION_AFFINE, criteria, None, 5
+        )
+    except cv2.error:
+        return board
+    warp[:, 2] /= scale
+    return cv2.warpAffine(
+        board, warp, (width, height),
+        flags=cv2.INTER_LINEAR + cv2.WARP_INVERSE_MAP,
+        borderMode=cv2.BORDER_REPLICATE,
+    )
+
+
+def changed_cells(board, reference, cells, size):
+    """Compares two registered boards cell by cell.
+
+    Returns ``(ink, changed)`` flag arrays: whether each cell is written
+    in on ``board``, and whether it differs from ``reference``. A cell
+    changed if it gained or lost writing, if its hash moved more than
+    ``HASH_DISTANCE`` bits, or if its ink moved by more than
+    ``DENSITY_CHANGE``; the hash alone misses a digit rewritten in place.
+    """
+    ink, hashes, density = fingerprint(board, cells, size)
+    old_ink, old_hashes, old_density = fingerprint(reference, cells, size)
+    rewritten = ((hash_distance(hashes, old_hashes) > HASH_DISTANCE)
+                 | (density_change(density, old_density) > DENSITY_CHANGE))
+    return ink, (ink != old_ink) | (ink & rewritten)
+
+
+def recognize_cells(board, template, cells, recognize_batch):
+    """OCRs the given cells of a rectified board in one batch.
+
+    Returns ``{(row, col): text}``.
+    """
+    from PIL import Image
+
+    size = (template.width, template.height)
+    crops = [
+        Image.fromarray(board[rows, cols])
+        for rows, cols in cell_slices(cells, size, margin=CELL_MARGIN / 2)
+    ]
+    texts = recognize_batch(crops) if crops else []
+    return {(cell.row, cell.col): text.strip() for cell, text in zip(cells, texts)}
+
+
+def read_cells(board, template, recognize_batch, cells=None):
+    """OCRs the populated cells of a rectified board.
+
+    Returns ``{(row, col): text}`` for the cells that were read.
+    """
+    cells = template.cells if cells is None else cells
+    size = (template.width, template.height)
+    written = [cell for cell, ink in zip(cells, populated(board, cells, size)) if ink]
+    return recognize_cells(board, template, written, recognize_batch)
+
+
+def read_changes(board, template, recognize_batch, previous):
+    """OCRs only the cells that differ from the previous photo.
+
+    ``previous`` is ``(path, cells)`` for the last photo of the same
+    board and the texts read from it. Unchanged cells keep their old
+    text; cells that were wiped are dropped. Returns ``(cells, read)``,
+    the merged texts and how many cells went to the OCR engine.
+    """
+    path, old_texts = previous
+    reference = align(path, template)
+    board = match_board(board, reference)
+    size = (template.width, template.height)
+    ink, changed = changed_cells(board, reference, template.cells, size)
+
+    texts = {}
+    unread = []
+    for cell, written, differs in zip(template.cells, ink, changed):
+        key = (cell.row, cell.col)
+        if not written:
+            continue
+        if differs or key not in old_texts:
+            unread.append(cell)
+        else:
+            texts[key] = old_texts[key]
+    texts.update(recognize_cells(board, template, unread, recognize_batch))
+    return texts, len(unread)
+
+
+def to_text(template, cells):
+    """Lays cell texts out as tab-separated rows, one line per board row."""
+    rows = max((cell.row for cell in template.cells), default=-1) + 1
+    cols = max((cell.col for cell in template.cells), default=-1) + 1
+    lines = []
+    for row in range(rows):
+        values = [cells.get((row, col), '') for col in range(cols)]
+        if any(values):
+            lines.append('\t'.join(values))
+    return '\n'.join(lines)
+
+
+def process(path, template, recognize_batch, previous=None):
+    """Aligns a photo to ``template`` and OCRs only its written cells.
+
+    With ``previous`` (see :func:`previous_reading`), only cells that
+    changed since that photo are read. Returns ``(text, cells)``; see
+    :func:`read_cells` and :func:`to_text`.
+    """
+    board = align(path, template)
+    if previous is None:
+        cells = read_cells(board, template, recognize_batch)
+    else:
+        cells, _ = read_changes(board, template, recognize_batch, previous)
+    return to_text(template, cells), cells
+
+
+def previous_reading(db, template_id, folder):
+    """Returns ``(path, cells)`` for the newest post of a layout, or ``None``.
+
+    ``folder`` is where post images live; posts whose image is gone
+    can't be compared against and are skipped.
+    """
+    post = db.execute(
+        'SELECT id, img_path FROM post WHERE layout_id = ?'
+        ' ORDER BY created DESC, id DESC LIMIT 1',
+        (template_id,)
+    ).fetchone()
+    if post is None:
+        return None
+    path = os.path.join(folder, post['img_path'])
+    if not os.path.exists(path):
+        return None
+    cells = {
+        (row['row'], row['col']): row['text'] for row in db.execute(
+            'SELECT row, col, text FROM post_cell WHERE post_id = ?', (post['id'],)
+        )
+    }
+    return path, cells
+
+
+def register(db, name, path, columns=(), grid=None, table=None):
+    """Creates a template from a reference photo and returns its id.
+
+    ``grid`` is an optional ``(rows, cols)`` to use instead of the
+    detected ruled lines. ``table`` is an optional ``(left, top, right,
+    bottom)`` box around the ruled table, in the photo's pixels; cells
+    are then looked for inside it only, so writing elsewhere on the
+    board isn't mistaken for rules.
+    """
+    gray = load_gray(path)
+    corners = find_board(gray)
+    region = (0, 0, 1, 1) if table is None else table_region(corners, table)
+    size = board_size(corners, region)
+    if grid is not None:
+        cells = uniform_cells(*grid)
+    else:
+        board = rectify(gray, corners, size)
+        x0, y0, x1, y1 = (round(value * length) for value, length in zip(region, size * 2))
+        crop = board[y0:y1, x0:x1]
+        cells = grid_cells(*detect_grid(crop), crop.shape[::-1])
+    cells = within(cells, region)
+    if not cells:
+        raise ValueError('No ruled cells found on the reference image.')
+
+    cursor = db.execute(
+        'INSERT INTO layout_template (name, width, height, columns, cells)'
+        ' VALUES (?, ?, ?, ?, ?)',
+        (name, size[0], size[1], json.dumps(list(columns)),
+         json.dumps([list(cell) for cell in cells]))
+    )
+    db.commit()
+    return cursor.lastrowid
+
+
+def from_row(row):
+    return Template(
+        row['id'], row['name'], row['width'], row['height'],
+        json.loads(row['columns']),
+        [Cell(*cell) for cell in json.loads(row['cells'])],
+    )
+
+
+def get_template(db, id):
+    row = db.execute('SELECT * FROM layout_template WHERE id = ?', (id,)).fetchone()
+    return None if row is None else from_row(row)
+
+
+def list_templates(db):
+    return [from_row(row) for row in db.execute(
+        'SELECT * FROM layout_template ORDER BY name'
+    )]
+
+
+def save_cells(db, post_id, cells):
+    db.executemany(
+        'INSERT OR REPLACE INTO post_cell (post_id, row, col, text)'
+        ' VALUES (?, ?, ?, ?)',
+        [(post_id, row, col, text) for (row, col), text in cells.items()]
+    )
+
+
+def parse_grid(ctx, param, value):
+    """Click callback turning ``ROWSxCOLS`` into ``(rows, cols)``."""
+    if value is None:
+        return None
+    try:
+        rows, cols = (int(n) for n in value.lower().split('x'))
+    except ValueError:
+        raise click.BadParameter(f'{value!r} is not ROWSxCOLS, e.g. 10x3.')
+    if rows < 1 or cols < 1:
+        raise click.BadParameter('Rows and columns must be at least 1.')
+    return rows, cols
+
+
+def parse_box(ctx, param, value):
+    """Click callback turning ``LEFT,TOP,RIGHT,BOTTOM`` into a tuple."""
+    if value is None:
+        return None
+    try:
+        left, top, right, bottom = (int(n) for n in value.split(','))
+    except ValueError:
+        raise click.BadParameter(
+            f'{value!r} is not LEFT,TOP,RIGHT,BOTTOM, e.g. 470,555,1590,2430.'
+        )
+    if right <= left or bottom <= top:
+        raise click.BadParameter('RIGHT and BOTTOM must be beyond LEFT and TOP.')
+    return left, top, right, bottom
+
+
+@click.command('register-layout')
+@click.argument('name')
+@click.argument('image', type=click.Path(exists=True, dir_okay=False))
+@click.option('--columns', default='',
+              help='Comma-separated spreadsheet column names, left to right.')
+@click.option('--grid', default=None, metavar='ROWSxCOLS', callback=parse_grid,
+              help='Use an even grid instead of detecting ruled lines.')
+@click.option('--table', default=None, metavar='LEFT,TOP,RIGHT,BOTTOM', callback=parse_box,
+              help='Pixel box around the ruled table in IMAGE (default: whole board).')
+@with_appcontext
+def register_layout_command(name, image, columns, grid, table):
+    """Register a layout template from a reference board photo."""
+    columns = [column.strip() for column in columns.split(',') if column.strip()]
+    try:
+        template_id = register(get_db(), name, image, columns, grid, table)
+    except sqlite3.IntegrityError:
+        raise click.ClickException(f'Layout {name!r} already exists.')
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    template = get_template(get_db(), template_id)
+    rows = len({cell.row for cell in template.cells})
+    cols = len({cell.col for cell in template.cells})
+    click.echo(f'Registered layout {name!r} (id {template_id}): {rows} rows x {cols} columns.')
+
+
+@click.command('list-layouts')
+@with_appcontext
+def list_layouts_command():
+    """List registered layout templates."""
+    for template in list_templates(get_db()):
+        columns = ', '.join(template.columns) or '-'
+        click.echo(f'{template.id}\t{template.name}\t{len(template.cells)} cells\t{columns}')
+
+
+def init_app(app):
+    app.cli.add_command(register_layout_command)
+    app.cli.add_command(list_layouts_command)
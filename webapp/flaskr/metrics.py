@@ -0,0 +1,31 @@
+"""Counters for scraping: OCR governor state and cache hit rates.
+
+If a TrOCR server is configured its batching histograms are included,
+or ``null`` when it can't be reached.
+"""
+from flask import Blueprint, current_app, jsonify
+
+from flaskr import ocr, trocr_server
+
+bp = Blueprint('metrics', __name__)
+
+
+@bp.route('/metrics')
+def index():
+    extensions = current_app.extensions
+    socket_path = current_app.config['TROCR_SOCKET']
+    trocr = None
+    if socket_path:
+        try:
+            trocr = trocr_server.stats(socket_path)
+        except ocr.OCRError:
+            pass
+    return jsonify(
+        ocr=extensions['ocr_governor'].stats(),
+        caches={
+            name: extensions[name].stats()
+            for name in ('user_cache', 'fragment_cache')
+            if name in extensions
+        },
+        trocr=trocr,
+    )
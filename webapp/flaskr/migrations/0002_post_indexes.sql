@@ -0,0 +1,2 @@
+CREATE INDEX IF NOT EXISTS post_author_id ON post (author_id);
+CREATE INDEX IF NOT EXISTS post_created ON post (created);
@@ -0,0 +1,6 @@
+CREATE TABLE IF NOT EXISTS blob (
+  hash TEXT PRIMARY KEY,
+  img_path TEXT UNIQUE NOT NULL,
+  size INTEGER NOT NULL,
+  refcount INTEGER NOT NULL DEFAULT 0
+);
@@ -0,0 +1,44 @@
+-- post.modified records the last change to a post; post_generation is
+-- bumped on every insert, update and delete so listings can be validated
+-- with a single read.
+ALTER TABLE post ADD COLUMN modified TIMESTAMP;
+
+UPDATE post SET modified = created;
+
+CREATE INDEX IF NOT EXISTS post_modified ON post (modified);
+
+CREATE TABLE IF NOT EXISTS post_generation (
+  id INTEGER PRIMARY KEY CHECK (id = 1),
+  value INTEGER NOT NULL
+);
+
+INSERT OR IGNORE INTO post_generation (id, value) VALUES (1, 0);
+
+CREATE TRIGGER IF NOT EXISTS post_insert_modified AFTER INSERT ON post
+WHEN NEW.modified IS NULL
+BEGIN
+  UPDATE post SET modified = strftime('%Y-%m-%d %H:%M:%f', 'now')
+  WHERE id = NEW.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS post_update_modified
+AFTER UPDATE OF title, img_path, gcp_output ON post
+BEGIN
+  UPDATE post SET modified = strftime('%Y-%m-%d %H:%M:%f', 'now')
+  WHERE id = NEW.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS post_insert_generation AFTER INSERT ON post
+BEGIN
+  UPDATE post_generation SET value = value + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS post_update_generation AFTER UPDATE ON post
+BEGIN
+  UPDATE post_generation SET value = value + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS post_delete_generation AFTER DELETE ON post
+BEGIN
+  UPDATE post_generation SET value = value + 1;
+END;
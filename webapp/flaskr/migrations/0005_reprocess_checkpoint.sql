@@ -0,0 +1,5 @@
+CREATE TABLE IF NOT EXISTS reprocess_checkpoint (
+  name TEXT PRIMARY KEY,
+  last_id INTEGER NOT NULL,
+  updated TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
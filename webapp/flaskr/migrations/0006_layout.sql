@@ -0,0 +1,25 @@
+CREATE TABLE IF NOT EXISTS layout_template (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  name TEXT UNIQUE NOT NULL,
+  width INTEGER NOT NULL,
+  height INTEGER NOT NULL,
+  columns TEXT NOT NULL,
+  cells TEXT NOT NULL,
+  created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+ALTER TABLE post ADD COLUMN layout_id INTEGER REFERENCES layout_template (id);
+
+CREATE TABLE IF NOT EXISTS post_cell (
+  post_id INTEGER NOT NULL,
+  row INTEGER NOT NULL,
+  col INTEGER NOT NULL,
+  text TEXT NOT NULL,
+  PRIMARY KEY (post_id, row, col),
+  FOREIGN KEY (post_id) REFERENCES post (id)
+);
+
+CREATE TRIGGER IF NOT EXISTS post_delete_cells AFTER DELETE ON post
+BEGIN
+  DELETE FROM post_cell WHERE post_id = OLD.id;
+END;
@@ -0,0 +1,29 @@
+-- Fuzzy search: every distinct word in a post's title or text is kept
+-- once in search_word, with its character trigrams in search_trigram,
+-- and post_word lists the words each post contains. See search.py.
+CREATE TABLE IF NOT EXISTS search_word (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  text TEXT UNIQUE NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS search_trigram (
+  trigram TEXT NOT NULL,
+  word_id INTEGER NOT NULL,
+  PRIMARY KEY (trigram, word_id),
+  FOREIGN KEY (word_id) REFERENCES search_word (id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS post_word (
+  word_id INTEGER NOT NULL,
+  post_id INTEGER NOT NULL,
+  PRIMARY KEY (word_id, post_id),
+  FOREIGN KEY (word_id) REFERENCES search_word (id),
+  FOREIGN KEY (post_id) REFERENCES post (id)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS post_word_post ON post_word (post_id);
+
+CREATE TRIGGER IF NOT EXISTS post_delete_words AFTER DELETE ON post
+BEGIN
+  DELETE FROM post_word WHERE post_id = OLD.id;
+END;
@@ -0,0 +1,65 @@
+-- Harvest figures read from layout posts (see harvest.py). Each post's
+-- rows land in harvest_entry; the triggers below keep per-week and
+-- per-season totals in step, so summaries never scan the posts.
+CREATE TABLE IF NOT EXISTS harvest_entry (
+  post_id INTEGER NOT NULL,
+  line INTEGER NOT NULL,
+  crop TEXT NOT NULL,
+  unit TEXT NOT NULL,
+  quantity REAL NOT NULL,
+  week TEXT NOT NULL,
+  season INTEGER NOT NULL,
+  PRIMARY KEY (post_id, line),
+  FOREIGN KEY (post_id) REFERENCES post (id)
+);
+
+CREATE TABLE IF NOT EXISTS harvest_weekly (
+  crop TEXT NOT NULL,
+  unit TEXT NOT NULL,
+  week TEXT NOT NULL,
+  total REAL NOT NULL,
+  entries INTEGER NOT NULL,
+  PRIMARY KEY (crop, unit, week)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS harvest_weekly_week ON harvest_weekly (week);
+
+CREATE TABLE IF NOT EXISTS harvest_season (
+  crop TEXT NOT NULL,
+  unit TEXT NOT NULL,
+  season INTEGER NOT NULL,
+  total REAL NOT NULL,
+  entries INTEGER NOT NULL,
+  PRIMARY KEY (season, crop, unit)
+) WITHOUT ROWID;
+
+CREATE TRIGGER IF NOT EXISTS harvest_entry_insert AFTER INSERT ON harvest_entry
+BEGIN
+  INSERT INTO harvest_weekly (crop, unit, week, total, entries)
+  VALUES (NEW.crop, NEW.unit, NEW.week, NEW.quantity, 1)
+  ON CONFLICT (crop, unit, week) DO UPDATE
+  SET total = total + excluded.total, entries = entries + 1;
+
+  INSERT INTO harvest_season (crop, unit, season, total, entries)
+  VALUES (NEW.crop, NEW.unit, NEW.season, NEW.quantity, 1)
+  ON CONFLICT (season, crop, unit) DO UPDATE
+  SET total = total + excluded.total, entries = entries + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS harvest_entry_delete AFTER DELETE ON harvest_entry
+BEGIN
+  UPDATE harvest_weekly SET total = total - OLD.quantity, entries = entries - 1
+  WHERE crop = OLD.crop AND unit = OLD.unit AND week = OLD.week;
+  DELETE FROM harvest_weekly
+  WHERE crop = OLD.crop AND unit = OLD.unit AND week = OLD.week AND entries <= 0;
+
+  UPDATE harvest_season SET total = total - OLD.quantity, entries = entries - 1
+  WHERE season = OLD.season AND crop = OLD.crop AND unit = OLD.unit;
+  DELETE FROM harvest_season
+  WHERE season = OLD.season AND crop = OLD.crop AND unit = OLD.unit AND entries <= 0;
+END;
+
+CREATE TRIGGER IF NOT EXISTS post_delete_harvest AFTER DELETE ON post
+BEGIN
+  DELETE FROM harvest_entry WHERE post_id = OLD.id;
+END;
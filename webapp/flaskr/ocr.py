@@ -0,0 +1,85 @@
+"""Chooses the OCR engines used for uploads and reprocessing.
+
+``OCR_ENGINE`` names one of :data:`ENGINES`, which read a whole page.
+``CELL_OCR_ENGINE`` names one of :data:`BATCH_ENGINES`, which read a
+list of small PIL crops (such as layout cells) in one go. Engines are
+imported only when first used, so an app configured for Vision never
+loads the local models and vice versa. :func:`warm_up` does that work
+ahead of time for the engines that are configured.
+"""
+import importlib
+
+from flask import current_app
+
+
+class OCRError(Exception):
+    """The OCR service refused or failed a request.
+
+    ``code`` is the service's status code (a ``google.rpc.Code`` value
+    for Vision), which decides whether the call is worth retrying.
+    """
+
+    def __init__(self, message, code=None):
+        super().__init__(message)
+        self.code = code
+
+
+ENGINES = {
+    'gcp': 'flaskr.gcp:detect_document',
+    'hybrid': 'flaskr.hybrid:recognize',
+    'tiled': 'flaskr.tiling:recognize',
+}
+
+BATCH_ENGINES = {
+    'gcp': 'flaskr.gcp:recognize_crops',
+    'trocr': 'flaskr.trocr:recognize_batch',
+}
+
+
+def _target(engines, name):
+    """Returns ``(module, attribute)`` for an engine."""
+    try:
+        module, attr = engines[name].split(':')
+    except KeyError:
+        raise ValueError(f'Unknown OCR engine {name!r}.') from None
+    return importlib.import_module(module), attr
+
+
+def _load(engines, name):
+    module, attr = _target(engines, name)
+    return getattr(module, attr)
+
+
+def is_online(name):
+    """True if the engine ``name`` calls a remote service.
+
+    Engine modules say so with a module-level ``ONLINE`` flag; one that
+    doesn't is taken to be online, so offline runs never reach the
+    network by accident.
+    """
+    module, _ = _target(ENGINES if name in ENGINES else BATCH_ENGINES, name)
+    return getattr(module, 'ONLINE', True)
+
+
+def get_engine(name=None):
+    return _load(ENGINES, name or current_app.config['OCR_ENGINE'])
+
+
+def get_batch_engine(name=None):
+    return _load(BATCH_ENGINES, name or current_app.config['CELL_OCR_ENGINE'])
+
+
+def warm_up():
+    """Imports the configured engines and runs their ``warm_up`` hooks."""
+    config = current_app.config
+    for engines, name in ((ENGINES, config['OCR_ENGINE']),
+                          (BATCH_ENGINES, config['CELL_OCR_ENGINE'])):
+        module = importlib.import_module(_load(engines, name).__module__)
+        hook = getattr(module, 'warm_up', None)
+        if hook is not None:
+            hook()
+
+
+def recognize(path):
+    """Return the text in the image at ``path`` using the configured engine."""
+    return get_engine()(path)
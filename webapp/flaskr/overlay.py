@@ -0,0 +1,150 @@
+"""OCR bounding-box overlays for reviewing posts.
+
+Overlays never call Vision themselves. When an image is annotated at
+upload, :func:`save_bounds` walks the annotation once, collects the boxes
+for every feature level and stores them under
+``OVERLAY_FOLDER/bounds/``, keyed by the image's content hash. Overlays
+are drawn from those boxes into ``OVERLAY_FOLDER/<post id>/``, each
+level at most once; posts whose image was never annotated as a page
+have no overlay.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+from flask import current_app
+
+from flaskr import blobstore
+
+# Feature levels in drawing order, with the colours test-gcp-bounds.py uses.
+LEVELS = {
+    'block': 'blue',
+    'para': 'red',
+    'word': 'yellow',
+    'symbol': 'green',
+}
+# 'all' matches render_doc_text: blocks, paragraphs and words together.
+COMBINED = ('block', 'para', 'word')
+
+
+def polygon(bounding_box):
+    return [(vertex.x, vertex.y) for vertex in bounding_box.vertices]
+
+
+def collect_bounds(document):
+    """Returns the polygons of every feature level from one traversal."""
+    bounds = {level: [] for level in LEVELS}
+    for page in document.pages:
+        for block in page.blocks:
+            for paragraph in block.paragraphs:
+                for word in paragraph.words:
+                    for symbol in word.symbols:
+                        bounds['symbol'].append(polygon(symbol.bounding_box))
+                    bounds['word'].append(polygon(word.bounding_box))
+                bounds['para'].append(polygon(paragraph.bounding_box))
+            bounds['block'].append(polygon(block.bounding_box))
+    return bounds
+
+
+def draw_boxes(image, bounds, color):
+    """Draws a border around each polygon in ``bounds``."""
+    from PIL import ImageDraw
+
+    draw = ImageDraw.Draw(image)
+    for bound in bounds:
+        draw.polygon([coord for vertex in bound for coord in vertex], None, color)
+    return image
+
+
+def post_folder(post_id):
+    return os.path.join(current_app.config['OVERLAY_FOLDER'], str(post_id))
+
+
+def write_atomic(path, write):
+    folder = os.path.dirname(path)
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=folder)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def bounds_path(digest):
+    return os.path.join(
+        current_app.config['OVERLAY_FOLDER'], 'bounds', digest[:2], f'{digest}.json'
+    )
+
+
+def image_digest(img_path):
+    """Content hash of a stored image, read from its name when possible."""
+    digest = blobstore.digest_of(img_path)
+    if digest is None:
+        path = os.path.join(blobstore.upload_folder(), img_path)
+        try:
+            with open(path, 'rb') as f:
+                digest = hashlib.file_digest(f, 'sha256').hexdigest()
+        except FileNotFoundError:
+            return None
+    return digest
+
+
+def save_bounds(digest, document):
+    """Stores the boxes of an annotation for the image with ``digest``."""
+    bounds = collect_bounds(document)
+    write_atomic(bounds_path(digest), lambda f: f.write(json.dumps(bounds).encode()))
+
+
+def get_bounds(post):
+    """Returns the boxes saved when the post's image was annotated, or ``None``."""
+    digest = image_digest(post['img_path'])
+    if digest is None:
+        return None
+    try:
+        with open(bounds_path(digest)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def render(post, level):
+    """Returns the path of the post's overlay for ``level``, drawing it once.
+
+    Returns ``None`` if no boxes were saved for the post's image.
+    """
+    from PIL import Image
+
+    path = os.path.join(post_folder(post['id']), f'{level}.jpg')
+    if os.path.exists(path):
+        return path
+
+    bounds = get_bounds(post)
+    if bounds is None:
+        return None
+    image_path = os.path.join(blobstore.upload_folder(), post['img_path'])
+    with Image.open(image_path) as image:
+        image = image.convert('RGB')
+    for name in (COMBINED if level == 'all' else (level,)):
+        draw_boxes(image, bounds[name], LEVELS[name])
+    write_atomic(path, lambda f: image.save(f, 'JPEG', quality=85))
+    return path
+
+
+def remove(post_id):
+    """Deletes every cached overlay of a post."""
+    shutil.rmtree(post_folder(post_id), ignore_errors=True)
+
+
+def remove_bounds(img_path):
+    """Deletes the saved boxes of an image no post uses any more."""
+    digest = blobstore.digest_of(img_path)
+    if digest is not None:
+        try:
+            os.unlink(bounds_path(digest))
+        except FileNotFoundError:
+            pass
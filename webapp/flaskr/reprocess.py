@@ -0,0 +1,160 @@
+"""``flask reprocess``: re-run OCR over posts that are already stored.
+
+Posts are walked in id order, a batch at a time. Each batch is recognised
+by a bounded thread pool and written back in a single transaction that
+also records the last id of the batch as the run's checkpoint, so an
+interrupted run resumes after the last batch that was committed. Posts
+read with a layout template are read again through that template, so
+their cells and harvest entries are rebuilt rather than lost.
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from flaskr import blobstore, harvest, layout, ocr, search
+from flaskr.db import get_db
+
+
+def recognize(app, path, template=None):
+    """Returns ``(text, cells)``; layout posts are read cell by cell."""
+    with app.app_context():
+        if template is None:
+            return ocr.recognize(path), None
+        return layout.process(path, template, ocr.get_batch_engine())
+
+
+def get_checkpoint(db, name):
+    row = db.execute(
+        'SELECT last_id FROM reprocess_checkpoint WHERE name = ?', (name,)
+    ).fetchone()
+    return 0 if row is None else row['last_id']
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours:d}:{minutes:02d}:{seconds:02d}'
+
+
+def reprocess(start_id=1, end_id=None, workers=4, batch_size=20,
+              name='default', echo=click.echo):
+    """Re-run OCR on posts with ``start_id <= id <= end_id``.
+
+    Returns ``(processed, failed_ids)``.
+    """
+    app = current_app._get_current_object()
+    db = get_db()
+    last_id = max(get_checkpoint(db, name), start_id - 1)
+    end_id = end_id if end_id is not None else (
+        db.execute('SELECT MAX(id) FROM post').fetchone()[0] or 0
+    )
+    total = db.execute(
+        'SELECT COUNT(*) FROM post WHERE id > ? AND id <= ?',
+        (last_id, end_id)
+    ).fetchone()[0]
+    if last_id >= start_id:
+        echo(f'Resuming {name!r} after post {last_id}.')
+
+    processed = 0
+    failed = []
+    # layout_id -> template; ``None`` for posts read as a whole page
+    templates = {None: None}
+    started = time.monotonic()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            batch = db.execute(
+                'SELECT id, title, img_path, layout_id FROM post'
+                ' WHERE id > ? AND id <= ?'
+                ' ORDER BY id LIMIT ?',
+                (last_id, end_id, batch_size)
+            ).fetchall()
+            if not batch:
+                break
+
+            for post in batch:
+                if post['layout_id'] not in templates:
+                    templates[post['layout_id']] = layout.get_template(
+                        db, post['layout_id']
+                    )
+            futures = [
+                pool.submit(recognize, app, os.path.join(
+                    blobstore.upload_folder(), post['img_path']
+                ), templates[post['layout_id']])
+                for post in batch
+            ]
+            results = []
+            cells = {}
+            for post, future in zip(batch, futures):
+                try:
+                    text, cells[post['id']] = future.result()
+                    results.append((text, post['id']))
+                except Exception as e:
+                    failed.append(post['id'])
+                    echo(f'Post {post["id"]} failed: {e}', err=True)
+
+            last_id = batch[-1]['id']
+            db.executemany(
+                'UPDATE post SET gcp_output = ? WHERE id = ?', results
+            )
+            titles = {post['id']: post['title'] for post in batch}
+            for text, id in results:
+                if cells[id] is not None:
+                    db.execute('DELETE FROM post_cell WHERE post_id = ?', (id,))
+                    layout.save_cells(db, id, cells[id])
+                search.index_post(db, id, titles[id], text)
+                harvest.update_post(db, id)
+            db.execute(
+                'INSERT INTO reprocess_checkpoint (name, last_id) VALUES (?, ?)'
+                ' ON CONFLICT (name) DO UPDATE SET last_id = excluded.last_id,'
+                ' updated = CURRENT_TIMESTAMP',
+                (name, last_id)
+            )
+            db.commit()
+
+            processed += len(batch)
+            elapsed = time.monotonic() - started
+            rate = processed / elapsed if elapsed else 0.0
+            eta = (total - processed) / rate if rate else 0.0
+            echo(
+                f'{processed}/{total} posts, {rate:.2f} posts/s,'
+                f' ETA {format_duration(eta)}'
+            )
+
+    db.execute('DELETE FROM reprocess_checkpoint WHERE name = ?', (name,))
+    db.commit()
+    return processed, failed
+
+
+@click.command('reprocess')
+@click.option('--start-id', default=1, show_default=True,
+              help='First post id to process.')
+@click.option('--end-id', type=int, default=None,
+              help='Last post id to process (default: newest post).')
+@click.option('--workers', default=4, show_default=True,
+              help='Number of OCR calls in flight at once.')
+@click.option('--batch-size', default=20, show_default=True,
+              help='Posts written per transaction and checkpoint.')
+@click.option('--name', default='default', show_default=True,
+              help='Checkpoint name; reuse it to resume an interrupted run.')
+@click.option('--restart', is_flag=True,
+              help='Ignore any saved checkpoint for this name.')
+@with_appcontext
+def reprocess_command(start_id, end_id, workers, batch_size, name, restart):
+    """Re-run OCR over stored posts and replace their gcp_output."""
+    if restart:
+        db = get_db()
+        db.execute('DELETE FROM reprocess_checkpoint WHERE name = ?', (name,))
+        db.commit()
+    processed, failed = reprocess(start_id, end_id, workers, batch_size, name)
+    click.echo(f'Reprocessed {processed - len(failed)} posts, {len(failed)} failed.')
+    if failed:
+        click.echo(f'Failed post ids: {", ".join(map(str, failed))}')
+
+
+def init_app(app):
+    app.cli.add_command(reprocess_command)
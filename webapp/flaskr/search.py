@@ -0,0 +1,194 @@
+"""Typo-tolerant search over post titles and OCR text.
+
+Handwriting OCR misreads letters ("tomatues"), so exact ``LIKE`` search
+misses posts. Every distinct word is stored once with its character
+trigrams, and ``post_word`` records which posts contain it. A query
+word is matched in two steps:
+
+1. Words sharing enough trigrams with it are fetched through the
+   trigram index. An edit touches at most three trigrams, so a word
+   within ``k`` edits shares all but ``3 * k`` of the query's trigrams.
+2. Those candidates are checked with a Levenshtein distance that stops
+   as soon as it exceeds ``k``.
+
+Posts must match every query word and are ranked by the total distance.
+The vocabulary grows far more slowly than the archive, so queries touch
+a few hundred index rows rather than every post.
+
+The index is updated by :func:`index_post` whenever a post's text
+changes; posts stored before it existed are added with
+``flask reindex-search``.
+"""
+import json
+import re
+
+import click
+from flask.cli import with_appcontext
+
+from flaskr.db import get_db
+
+WORD = re.compile(r'\w+')
+# Posts scored and returned by one query.
+MAX_RESULTS = 200
+
+
+def tokenize(text):
+    return WORD.findall(text.lower()) if text else []
+
+
+def trigrams(word):
+    """Distinct trigrams of ``word``, padded so its ends count twice."""
+    padded = f'  {word} '
+    return sorted({padded[i:i + 3] for i in range(len(padded) - 2)})
+
+
+def max_distance(word):
+    """Edits allowed for a query word: none for short words."""
+    if len(word) <= 3:
+        return 0
+    if len(word) <= 6:
+        return 1
+    return 2
+
+
+def bounded_distance(a, b, limit):
+    """Levenshtein distance between ``a`` and ``b``, or ``None`` if it
+    exceeds ``limit``.
+
+    Only the diagonal band ``limit`` wide is filled in, and the loop
+    stops once a whole row is over the limit.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return None
+    if len(a) > len(b):
+        a, b = b, a
+    over = limit + 1
+    previous = [j if j <= limit else over for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        current = [over] * (len(b) + 1)
+        if i <= limit:
+            current[0] = i
+        for j in range(max(1, i - limit), min(len(b), i + limit) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(
+                previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost, over
+            )
+        if min(current) > limit:
+            return None
+        previous = current
+    return previous[-1] if previous[-1] <= limit else None
+
+
+def index_post(db, post_id, *texts):
+    """Replaces the words indexed for a post with those in ``texts``.
+
+    Runs in the caller's transaction.
+    """
+    words = set()
+    for text in texts:
+        words.update(tokenize(text))
+    db.execute('DELETE FROM post_word WHERE post_id = ?', (post_id,))
+    if not words:
+        return
+
+    known = dict(db.execute(
+        'SELECT text, id FROM search_word'
+        ' WHERE text IN (SELECT value FROM json_each(?))',
+        (json.dumps(sorted(words)),)
+    ).fetchall())
+    for word in sorted(words - known.keys()):
+        known[word] = db.execute(
+            'INSERT INTO search_word (text) VALUES (?)', (word,)
+        ).lastrowid
+        db.executemany(
+            'INSERT INTO search_trigram (trigram, word_id) VALUES (?, ?)',
+            [(trigram, known[word]) for trigram in trigrams(word)]
+        )
+    db.executemany(
+        'INSERT INTO post_word (word_id, post_id) VALUES (?, ?)',
+        [(known[word], post_id) for word in words]
+    )
+
+
+def similar_words(db, word):
+    """Returns ``{word_id: distance}`` for indexed words close to ``word``."""
+    limit = max_distance(word)
+    if limit == 0:
+        row = db.execute(
+            'SELECT id FROM search_word WHERE text = ?', (word,)
+        ).fetchone()
+        return {} if row is None else {row['id']: 0}
+
+    grams = trigrams(word)
+    rows = db.execute(
+        'SELECT w.id, w.text FROM search_trigram t'
+        ' JOIN search_word w ON w.id = t.word_id'
+        ' WHERE t.trigram IN (SELECT value FROM json_each(?))'
+        ' AND length(w.text) BETWEEN ? AND ?'
+        ' GROUP BY t.word_id HAVING COUNT(*) >= ?',
+        (json.dumps(grams), len(word) - limit, len(word) + limit,
+         max(len(grams) - 3 * limit, 1))
+    ).fetchall()
+    matches = {}
+    for row in rows:
+        distance = bounded_distance(word, row['text'], limit)
+        if distance is not None:
+            matches[row['id']] = distance
+    return matches
+
+
+def fuzzy_search(db, query, limit=MAX_RESULTS):
+    """Returns ids of posts matching every word of ``query``, best first.
+
+    Posts are ordered by their summed edit distance to the query words,
+    then newest first.
+    """
+    best = None
+    for word in dict.fromkeys(tokenize(query)):
+        matches = similar_words(db, word)
+        distances = {}
+        for row in db.execute(
+            'SELECT post_id, word_id FROM post_word'
+            ' WHERE word_id IN (SELECT value FROM json_each(?))',
+            (json.dumps(list(matches)),)
+        ):
+            distance = matches[row['word_id']]
+            if distance < distances.get(row['post_id'], distance + 1):
+                distances[row['post_id']] = distance
+        if best is None:
+            best = distances
+        else:
+            best = {
+                post_id: total + distances[post_id]
+                for post_id, total in best.items() if post_id in distances
+            }
+        if not best:
+            return []
+    if best is None:
+        return []
+    return sorted(best, key=lambda post_id: (best[post_id], -post_id))[:limit]
+
+
+def reindex(db):
+    """Rebuilds the whole index from the posts table."""
+    db.execute('DELETE FROM post_word')
+    db.execute('DELETE FROM search_trigram')
+    db.execute('DELETE FROM search_word')
+    count = 0
+    for post in db.execute('SELECT id, title, gcp_output FROM post').fetchall():
+        index_post(db, post['id'], post['title'], post['gcp_output'])
+        count += 1
+    db.commit()
+    return count
+
+
+@click.command('reindex-search')
+@with_appcontext
+def reindex_search_command():
+    """Rebuild the fuzzy search index from all posts."""
+    count = reindex(get_db())
+    click.echo(f'Indexed {count} posts.')
+
+
+def init_app(app):
+    app.cli.add_command(reindex_search_command)
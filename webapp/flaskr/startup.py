@@ -0,0 +1,144 @@
+"""Time to first request: OCR warm-up and a startup import profile.
+
+Heavy OCR dependencies (the Vision client, torch, OpenCV) are imported on
+first use, so starting an instance only pays for Flask. To move that cost
+off the first upload, App Engine's warm-up request (``/_ah/warmup``)
+imports and loads the configured engines, and ``OCR_WARMUP = True`` does
+the same in a background thread as soon as the app is created.
+
+``flask profile-startup`` starts a fresh interpreter under
+``-X importtime``, creates the app and serves one request, then reports
+the slowest imports and how long each phase took.
+"""
+import json
+import os
+import subprocess
+import sys
+import threading
+from collections import defaultdict, namedtuple
+
+import click
+from flask import Blueprint, current_app
+from flask.cli import with_appcontext
+
+from flaskr import ocr
+
+bp = Blueprint('startup', __name__)
+
+# One line of ``-X importtime`` output; times are in microseconds.
+Import = namedtuple('Import', 'module self cumulative depth')
+
+PROFILE_SCRIPT = '''
+import json, sys, time
+started = time.perf_counter()
+from flaskr import create_app
+imported = time.perf_counter()
+app = create_app()
+created = time.perf_counter()
+response = app.test_client().get(sys.argv[1])
+served = time.perf_counter()
+print(json.dumps({
+    'import': imported - started,
+    'create_app': created - imported,
+    'first_request': served - created,
+    'status': response.status_code,
+}))
+'''
+
+
+@bp.route('/_ah/warmup')
+def warmup():
+    ocr.warm_up()
+    return '', 204
+
+
+def warm_up_in_background(app):
+    def run():
+        with app.app_context():
+            try:
+                ocr.warm_up()
+            except Exception:
+                app.logger.exception('OCR warm-up failed')
+
+    threading.Thread(target=run, name='ocr-warmup', daemon=True).start()
+
+
+def parse_importtime(lines):
+    """Parses ``-X importtime`` lines into :class:`Import` records."""
+    imports = []
+    for line in lines:
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        name = fields[2].rstrip()
+        module = name.lstrip()
+        imports.append(Import(
+            module, int(fields[0]), int(fields[1]),
+            (len(name) - len(module) - 1) // 2,
+        ))
+    return imports
+
+
+def by_package(imports):
+    """Sums self times by top-level package, slowest first."""
+    totals = defaultdict(int)
+    for record in imports:
+        totals[record.module.split('.')[0]] += record.self
+    return sorted(totals.items(), key=lambda item: item[1], reverse=True)
+
+
+def profile(path='/auth/login', root=None):
+    """Profiles a cold start in a subprocess.
+
+    Returns ``(imports, timings)``, where ``timings`` holds seconds spent
+    importing ``flaskr``, in ``create_app`` and serving ``path``.
+    """
+    root = root or os.path.dirname(current_app.root_path)
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        filter(None, [root, env.get('PYTHONPATH')])
+    )
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', PROFILE_SCRIPT, path],
+        capture_output=True, text=True, cwd=root, env=env,
+    )
+    if result.returncode != 0:
+        raise click.ClickException(result.stderr.strip().splitlines()[-1])
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    return parse_importtime(result.stderr.splitlines()), timings
+
+
+@click.command('profile-startup')
+@click.option('--path', default='/auth/login', show_default=True,
+              help='Page to request once the app is created.')
+@click.option('--top', default=20, show_default=True,
+              help='Number of modules to list.')
+@click.option('--sort', type=click.Choice(['cumulative', 'self']),
+              default='cumulative', show_default=True)
+@with_appcontext
+def profile_startup_command(path, top, sort):
+    """Report where a cold start spends its time."""
+    imports, timings = profile(path)
+    for label, seconds in (('import flaskr', timings['import']),
+                           ('create_app', timings['create_app']),
+                           (f'GET {path}', timings['first_request'])):
+        click.echo(f'{label:<20} {seconds * 1000:8.1f} ms')
+    click.echo(f"(status {timings['status']})\n")
+    click.echo(f"{'self ms':>9} {'cumul ms':>9}  module")
+    for record in sorted(imports, key=lambda r: getattr(r, sort), reverse=True)[:top]:
+        click.echo(
+            f'{record.self / 1000:9.1f} {record.cumulative / 1000:9.1f}'
+            f"  {'  ' * record.depth}{record.module}"
+        )
+    click.echo(f"\n{'self ms':>9}  package")
+    for package, total in by_package(imports)[:top]:
+        click.echo(f'{total / 1000:9.1f}  {package}')
+
+
+def init_app(app):
+    app.register_blueprint(bp)
+    app.cli.add_command(profile_startup_command)
+    if app.config['OCR_WARMUP']:
+        warm_up_in_background(app)
@@ -0,0 +1,145 @@
+"""Tiled OCR for photos too large to read in one piece.
+
+Vision scales big images down before reading them, and a whole
+chalkboard shrunk that far loses its handwriting. The ``tiled`` engine
+cuts the photo into ``OCR_TILE_SIZE`` squares that overlap by
+``OCR_TILE_OVERLAP`` pixels, reads every tile at full resolution on a
+thread pool, and moves each word back into page coordinates.
+
+A word near a tile boundary is read by both tiles, once whole and once
+cut off. Words are kept in order of how far they sit from the edge of
+their own tile, and a word whose box mostly covers one already kept from
+another tile is dropped, so the complete reading wins. The rest are put
+back into reading order line by line.
+
+Tiles are independent requests, so latency depends on how many run at
+once (``OCR_TILE_WORKERS``, within the OCR governor's limit) rather than
+on the size of the photo.
+"""
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+from flaskr import gcp
+
+# Every tile is a Vision call.
+ONLINE = True
+# Share of the smaller box two words must have in common to be one word.
+DUPLICATE_OVERLAP = 0.5
+
+
+def tile_starts(length, size, overlap):
+    """Offsets of tiles ``size`` long covering ``length`` with ``overlap``."""
+    if length <= size:
+        return [0]
+    step = size - overlap
+    count = -(-(length - overlap) // step)
+    # spread the tiles evenly so the last one isn't a thin sliver
+    return [round(i * (length - size) / (count - 1)) for i in range(count)]
+
+
+def tile_boxes(width, height, size, overlap):
+    """``(left, top, right, bottom)`` of every tile, row by row."""
+    return [
+        (left, top, min(left + size, width), min(top + size, height))
+        for top in tile_starts(height, size, overlap)
+        for left in tile_starts(width, size, overlap)
+    ]
+
+
+def intersection(a, b):
+    width = min(a[2], b[2]) - max(a[0], b[0])
+    height = min(a[3], b[3]) - max(a[1], b[1])
+    return max(width, 0) * max(height, 0)
+
+
+def area(box):
+    return max(box[2] - box[0], 0) * max(box[3] - box[1], 0)
+
+
+def edge_distance(box, tile):
+    """How far a word sits inside its tile, in pixels."""
+    return min(box[0] - tile[0], box[1] - tile[1], tile[2] - box[2], tile[3] - box[3])
+
+
+def merge_tiles(tiles):
+    """Combines ``[(tile_box, words)]`` into one list of page words.
+
+    Word boxes are in page coordinates. Where readings from different
+    tiles overlap, the one furthest inside its tile is kept.
+    """
+    candidates = sorted(
+        ((edge_distance(word.box, tile), index, word)
+         for index, (tile, words) in enumerate(tiles) for word in words),
+        key=lambda item: item[0], reverse=True,
+    )
+    kept = []
+    for _, index, word in candidates:
+        if not any(
+            other_index != index and intersection(word.box, other.box)
+            >= DUPLICATE_OVERLAP * min(area(word.box), area(other.box))
+            for other_index, other in kept
+        ):
+            kept.append((index, word))
+    return [word for _, word in kept]
+
+
+def reading_order(words):
+    """Groups words into lines top to bottom, each read left to right."""
+    lines = []
+    for word in sorted(words, key=lambda w: (w.box[1] + w.box[3]) / 2):
+        centre = (word.box[1] + word.box[3]) / 2
+        # a word centred above the bottom of the current line is on it
+        if lines and centre <= max(w.box[3] for w in lines[-1]):
+            lines[-1].append(word)
+        else:
+            lines.append([word])
+    return [sorted(line, key=lambda w: w.box[0]) for line in lines]
+
+
+def read_tile(image):
+    """Reads one PIL tile with Vision; boxes are in tile coordinates."""
+    content = io.BytesIO()
+    image.convert('RGB').save(content, 'JPEG', quality=95)
+    return list(gcp.document_words(gcp.annotate_content(content.getvalue())))
+
+
+def recognize_image(image, read_tile=read_tile, size=2048, overlap=256, workers=None):
+    """Returns the page words of a PIL image read tile by tile."""
+    boxes = tile_boxes(image.width, image.height, size, overlap)
+    app = current_app._get_current_object()
+
+    def read(box):
+        with app.app_context():
+            words = read_tile(image.crop(box))
+        left, top = box[:2]
+        return box, [
+            word._replace(box=(word.box[0] + left, word.box[1] + top,
+                               word.box[2] + left, word.box[3] + top))
+            for word in words
+        ]
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        tiles = list(pool.map(read, boxes))
+    return merge_tiles(tiles)
+
+
+def recognize(path, read_tile=read_tile):
+    """Detects the text of a large photo, one tile at a time."""
+    from PIL import Image, ImageOps
+
+    config = current_app.config
+    with Image.open(path) as image:
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    words = recognize_image(
+        image, read_tile, config['OCR_TILE_SIZE'], config['OCR_TILE_OVERLAP'],
+        config['OCR_TILE_WORKERS'],
+    )
+    return '\n'.join(' '.join(word.text for word in line)
+                     for line in reading_order(words))
+
+
+def warm_up():
+    gcp.warm_up()
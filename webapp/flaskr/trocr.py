@@ -0,0 +1,66 @@
+"""Local TrOCR line recognition.
+
+``transformers`` and ``torch`` are optional; they are only imported when
+a model is first needed. Models are loaded once per process and shared by
+every thread; to share one between processes too, run the
+:mod:`flaskr.trocr_server` sidecar and set ``TROCR_SOCKET``.
+"""
+import threading
+
+from flask import current_app
+
+# Runs locally, or on a local sidecar.
+ONLINE = False
+
+_models = {}
+_lock = threading.Lock()
+
+
+def load(name):
+    """Return ``(processor, model)`` for a pretrained or fine-tuned model."""
+    with _lock:
+        if name not in _models:
+            from transformers import TrOCRProcessor, VisionEncoderDecoderModel
+
+            processor = TrOCRProcessor.from_pretrained(name)
+            model = VisionEncoderDecoderModel.from_pretrained(name)
+            model.eval()
+            _models[name] = (processor, model)
+        return _models[name]
+
+
+def warm_up():
+    """Loads the configured model, unless a TrOCR server holds it."""
+    if not current_app.config['TROCR_SOCKET']:
+        load(current_app.config['TROCR_MODEL'])
+
+
+def generate(images, model_name):
+    """Recognise a list of PIL line images in a single ``generate`` call."""
+    if not images:
+        return []
+    import torch
+
+    processor, model = load(model_name)
+    pixel_values = processor(
+        images=[image.convert('RGB') for image in images], return_tensors='pt'
+    ).pixel_values
+    with torch.no_grad():
+        generated_ids = model.generate(pixel_values)
+    return processor.batch_decode(generated_ids, skip_special_tokens=True)
+
+
+def recognize_batch(images, model_name=None):
+    """Recognise a list of PIL line images.
+
+    With ``TROCR_SOCKET`` set, the images go to the shared
+    ``flask trocr-server`` process instead of a model in this one.
+    """
+    if not images:
+        return []
+    socket_path = current_app.config['TROCR_SOCKET']
+    if socket_path and model_name is None:
+        from flaskr import trocr_server
+
+        return trocr_server.request(socket_path, images)
+    return generate(images, model_name or current_app.config['TROCR_MODEL'])
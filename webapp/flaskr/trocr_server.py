@@ -0,0 +1,287 @@
+"""``flask trocr-server``: one TrOCR model shared by every web worker.
+
+The server owns the only copy of the model and listens on a Unix socket.
+Line images sent by concurrent clients are queued one by one and gathered
+into micro-batches: a batch closes when it holds ``max_batch_size``
+images or ``max_wait`` seconds after its first image arrived, whichever
+comes first, and runs as a single ``generate`` call. Each caller gets
+back the texts for its own images.
+
+Messages are length-prefixed JSON; images travel as base64 PNG. Set
+``TROCR_SOCKET`` to make :func:`flaskr.trocr.recognize_batch` use the
+server instead of loading the model in-process.
+"""
+import base64
+import bisect
+import io
+import json
+import os
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import time
+from concurrent.futures import Future
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from flaskr.ocr import OCRError
+
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+# Seconds a client waits for its texts before giving up.
+REQUEST_TIMEOUT = 60
+
+_STOP = object()
+
+
+class Histogram(object):
+    """Counts observations into cumulative ``<= bucket`` bins."""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+
+    def snapshot(self):
+        with self._lock:
+            cumulative = []
+            total = 0
+            for count in self.counts[:-1]:
+                total += count
+                cumulative.append(total)
+            return {
+                'buckets': dict(zip(map(str, self.buckets), cumulative)),
+                'count': self.count,
+                'sum': self.sum,
+            }
+
+
+class Batcher(object):
+    """Gathers single images from many threads into batched calls.
+
+    ``recognize_batch`` takes a list of PIL images and returns their
+    texts. It always runs on the batcher's own thread.
+    """
+
+    def __init__(self, recognize_batch, max_batch_size=16, max_wait=0.01,
+                 clock=time.monotonic):
+        self.recognize_batch = recognize_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._clock = clock
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self.batch_sizes = Histogram(BATCH_BUCKETS)
+        self.queue_depths = Histogram(BATCH_BUCKETS)
+        self.waits = Histogram(WAIT_BUCKETS)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def submit(self, images):
+        """Queues ``images`` and returns a future for each one."""
+        futures = []
+        for image in images:
+            future = Future()
+            self._queue.put((image, future, self._clock()))
+            futures.append(future)
+        return futures
+
+    def recognize(self, images, timeout=None):
+        return [future.result(timeout) for future in self.submit(images)]
+
+    def _collect(self, first):
+        batch = [first]
+        deadline = self._clock() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - self._clock()
+            try:
+                item = (self._queue.get_nowait() if remaining <= 0
+                        else self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+            if item is _STOP:
+                self._queue.put(_STOP)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is _STOP:
+                return
+            batch = self._collect(first)
+            started = self._clock()
+            self.queue_depths.observe(self._queue.qsize())
+            self.batch_sizes.observe(len(batch))
+            for _, _, queued in batch:
+                self.waits.observe(started - queued)
+            try:
+                texts = self.recognize_batch([image for image, _, _ in batch])
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+            else:
+                for (_, future, _), text in zip(batch, texts):
+                    future.set_result(text)
+
+    def stats(self):
+        return {
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000,
+            'queue_depth': self._queue.qsize(),
+            'batch_size': self.batch_sizes.snapshot(),
+            'queue_depth_at_batch': self.queue_depths.snapshot(),
+            'wait_seconds': self.waits.snapshot(),
+        }
+
+
+def send_message(sock, message):
+    data = json.dumps(message).encode()
+    sock.sendall(struct.pack('>I', len(data)) + data)
+
+
+def _recv_exactly(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return bytes(data)
+
+
+def recv_message(sock):
+    """Reads one message, or returns ``None`` if the peer hung up."""
+    header = _recv_exactly(sock, 4)
+    if header is None:
+        return None
+    data = _recv_exactly(sock, struct.unpack('>I', header)[0])
+    return None if data is None else json.loads(data)
+
+
+def encode_image(image):
+    data = io.BytesIO()
+    image.save(data, 'PNG')
+    return base64.b64encode(data.getvalue()).decode('ascii')
+
+
+def decode_image(data):
+    from PIL import Image
+
+    image = Image.open(io.BytesIO(base64.b64decode(data)))
+    image.load()
+    return image
+
+
+class Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        batcher = self.server.batcher
+        while True:
+            message = recv_message(self.request)
+            if message is None:
+                return
+            if message.get('op') == 'stats':
+                send_message(self.request, batcher.stats())
+                continue
+            try:
+                texts = batcher.recognize(
+                    [decode_image(image) for image in message['images']]
+                )
+            except Exception as e:
+                send_message(self.request, {'error': f'{type(e).__name__}: {e}'})
+            else:
+                send_message(self.request, {'texts': texts})
+
+
+class Server(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, batcher):
+        if os.path.exists(path):
+            os.unlink(path)
+        self.batcher = batcher
+        super().__init__(path, Handler)
+
+
+def call(path, message, timeout=REQUEST_TIMEOUT):
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(path)
+            send_message(sock, message)
+            reply = recv_message(sock)
+    except OSError as e:
+        # not running, refused, or timed out
+        raise OCRError(f'TrOCR server at {path}: {e}') from e
+    if reply is None:
+        raise OCRError('TrOCR server closed the connection.')
+    if 'error' in reply:
+        raise OCRError(f"TrOCR server: {reply['error']}")
+    return reply
+
+
+def request(path, images, timeout=REQUEST_TIMEOUT):
+    """Recognises PIL line images on the server at ``path``."""
+    if not images:
+        return []
+    reply = call(path, {'images': [encode_image(image) for image in images]}, timeout)
+    return reply['texts']
+
+
+def stats(path, timeout=5):
+    return call(path, {'op': 'stats'}, timeout)
+
+
+@click.command('trocr-server')
+@click.option('--socket', 'path', default=None,
+              help='Unix socket to listen on (default: TROCR_SOCKET).')
+@click.option('--max-batch-size', type=int, default=None,
+              help='Most images per generate call (default: TROCR_MAX_BATCH_SIZE).')
+@click.option('--max-wait-ms', type=float, default=None,
+              help='How long a batch waits to fill (default: TROCR_MAX_WAIT_MS).')
+@with_appcontext
+def trocr_server_command(path, max_batch_size, max_wait_ms):
+    """Serve the TrOCR model to all workers over a Unix socket."""
+    from flaskr import trocr
+
+    config = current_app.config
+    path = path or config['TROCR_SOCKET'] or os.path.join(
+        current_app.instance_path, 'trocr.sock'
+    )
+    model_name = config['TROCR_MODEL']
+    trocr.load(model_name)
+    batcher = Batcher(
+        lambda images: trocr.generate(images, model_name),
+        max_batch_size or config['TROCR_MAX_BATCH_SIZE'],
+        (max_wait_ms if max_wait_ms is not None else config['TROCR_MAX_WAIT_MS']) / 1000,
+    ).start()
+    with Server(path, batcher) as server:
+        click.echo(f'Serving {model_name} on {path}')
+        try:
+            server.serve_forever()
+        finally:
+            batcher.stop()
+            os.unlink(path)
+
+
+def init_app(app):
+    app.cli.add_command(trocr_server_command)
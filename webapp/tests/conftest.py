@@ -1,9 +1,11 @@
 import os
+import shutil
+import struct
 import tempfile
 
 import pytest
 from flaskr import create_app
-from flaskr.db import get_db, init_db
+from flaskr.db import close_thread_connections, get_db, init_db
 
 with open(os.path.join(os.path.dirname(__file__), 'data.sql'), 'rb') as f:
     _data_sql = f.read().decode('utf8')
@@ -12,10 +14,15 @@ with open(os.path.join(os.path.dirname(__file__), 'data.sql'), 'rb') as f:
 @pytest.fixture
 def app():
     db_fd, db_path = tempfile.mkstemp()
+    data_folder = tempfile.mkdtemp()
+    upload_folder = os.path.join(data_folder, 'uploads')
+    os.makedirs(upload_folder)
 
     app = create_app({
         'TESTING': True,
         'DATABASE': db_path,
+        'UPLOAD_FOLDER': upload_folder,
+        'OVERLAY_FOLDER': os.path.join(data_folder, 'overlays'),
     })
 
     with app.app_context():
@@ -24,8 +31,37 @@ def app():
 
     yield app
 
+    close_thread_connections()
     os.close(db_fd)
     os.unlink(db_path)
+    shutil.rmtree(data_folder)
+
+
+def png_bytes(width=4, height=3, payload=b''):
+    """Just enough of a PNG for the upload sniffer, plus ``payload``."""
+    ihdr = struct.pack('>II', width, height) + b'\x08\x02\x00\x00\x00'
+    return (
+        b'\x89PNG\r\n\x1a\n' + struct.pack('>I', len(ihdr)) + b'IHDR'
+        + ihdr + b'\x00\x00\x00\x00' + payload
+    )
+
+
+@pytest.fixture
+def image():
+    return png_bytes
+
+
+@pytest.fixture
+def ocr(monkeypatch):
+    """Replace the Vision call with a fake that records the paths it saw."""
+    calls = []
+
+    def fake_detect_document(path):
+        calls.append(path)
+        return 'ocr text'
+
+    monkeypatch.setattr('flaskr.gcp.detect_document', fake_detect_document)
+    return calls
 
 
 @pytest.fixture
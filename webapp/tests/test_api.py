@@ -0,0 +1,115 @@
+import pytest
+from flaskr.db import get_db
+
+
+@pytest.fixture
+def posts(app):
+    """Posts 2-6, two of them created at the same second."""
+    with app.app_context():
+        db = get_db()
+        db.executemany(
+            'INSERT INTO post (title, img_path, gcp_output, author_id, created)'
+            ' VALUES (?, ?, ?, 2, ?)',
+            [(f'post {n}', f'{n}.jpg', 'x' * 1000, created) for n, created in (
+                (2, '2019-01-01 00:00:00'), (3, '2020-01-01 00:00:00'),
+                (4, '2020-01-01 00:00:00'), (5, '2021-01-01 00:00:00'),
+                (6, '2022-01-01 00:00:00'),
+            )]
+        )
+        db.commit()
+
+
+def test_post(client):
+    post = client.get('/api/v1/posts/1').get_json()
+    assert post['title'] == 'test title'
+    assert post['gcp_output'] == 'test\nbody'
+    assert post['author'] == 'test'
+    assert post['created'] == '2018-01-01T00:00:00'
+    assert post['image_url'] == 'http://localhost/uploads/test.jpg'
+
+
+def test_missing_post(client):
+    response = client.get('/api/v1/posts/9')
+    assert response.status_code == 404
+    assert response.get_json() == {'error': 'Post 9 does not exist.'}
+
+
+def test_listing_pages_with_keyset_cursor(client, posts):
+    seen = []
+    url = '/api/v1/posts?limit=2&fields=title'
+    while url:
+        page = client.get(url).get_json()
+        seen += [post['id'] for post in page['posts']]
+        url = page['next_url']
+    # newest first; posts 3 and 4 share a timestamp and are split by id
+    assert seen == [6, 5, 4, 3, 2, 1]
+
+
+def test_cursor_is_stable_when_posts_are_added(app, client, posts):
+    page = client.get('/api/v1/posts?limit=2').get_json()
+    with app.app_context():
+        db = get_db()
+        db.execute(
+            "INSERT INTO post (title, img_path, gcp_output, author_id)"
+            " VALUES ('new', 'new.jpg', '', 1)"
+        )
+        db.commit()
+    following = client.get(f"/api/v1/posts?limit=2&after={page['next']}").get_json()
+    assert [post['id'] for post in following['posts']] == [4, 3]
+
+
+def test_fields(client, posts):
+    page = client.get('/api/v1/posts?fields=title,created&limit=1').get_json()
+    assert page['posts'] == [{'id': 6, 'title': 'post 6', 'created': '2022-01-01T00:00:00'}]
+
+
+@pytest.mark.parametrize(('query', 'message'), (
+    ('fields=title,secret', 'Unknown fields: secret.'),
+    ('limit=0', 'limit must be between 1 and 500.'),
+    ('after=bogus', 'Invalid cursor.'),
+    ('ids=1,x', 'ids must be comma-separated integers.'),
+))
+def test_bad_requests(client, query, message):
+    response = client.get(f'/api/v1/posts?{query}')
+    assert response.status_code == 400
+    assert response.get_json() == {'error': message}
+
+
+def test_bulk_fetch(client, posts):
+    data = client.get('/api/v1/posts?ids=5,1,42,5&fields=title').get_json()
+    assert data['posts'] == [{'id': 5, 'title': 'post 5'}, {'id': 1, 'title': 'test title'}]
+    assert data['missing'] == [42]
+
+
+def test_conditional_requests(app, client, posts):
+    response = client.get('/api/v1/posts?fields=title')
+    etag = response.headers['ETag']
+    again = client.get('/api/v1/posts?fields=title', headers={'If-None-Match': etag})
+    assert again.status_code == 304
+    assert again.data == b''
+
+    # another query is another representation
+    other = client.get('/api/v1/posts?fields=id', headers={'If-None-Match': etag})
+    assert other.status_code == 200
+
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE post SET title = 'renamed' WHERE id = 6")
+        db.commit()
+    changed = client.get('/api/v1/posts?fields=title', headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.get_json()['posts'][0]['title'] == 'renamed'
+
+
+def test_polls_see_deletions(client, auth, posts):
+    response = client.get('/api/v1/posts?fields=title')
+    etag = response.headers['ETag']
+    assert 'Last-Modified' not in response.headers
+
+    auth.login('other', 'other')
+    client.post('/3/delete')
+    for headers in ({'If-None-Match': etag},
+                    {'If-Modified-Since': 'Wed, 01 Jan 2100 00:00:00 GMT'}):
+        polled = client.get('/api/v1/posts?fields=title', headers=headers)
+        assert polled.status_code == 200
+        assert 3 not in [post['id'] for post in polled.get_json()['posts']]
@@ -1,5 +1,6 @@
 import pytest
 from flask import g, session
+from flaskr.auth import invalidate_user
 from flaskr.db import get_db
 
 
@@ -52,4 +53,33 @@ def test_logout(client, auth):
 
     with client:
         auth.logout()
-        assert 'user_id' not in session
\ No newline at end of file
+        assert 'user_id' not in session
+
+def test_user_cache(client, auth, app):
+    auth.login()
+    client.get('/hello')
+    stats = app.extensions['user_cache'].stats()
+
+    # the cached row keeps serving requests without touching the db
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE user SET username = 'renamed' WHERE id = 1")
+        db.commit()
+
+    with client:
+        client.get('/hello')
+        assert g.user['username'] == 'test'
+    assert app.extensions['user_cache'].stats()['hits'] == stats['hits'] + 1
+
+    with app.app_context():
+        invalidate_user(1)
+
+    with client:
+        client.get('/hello')
+        assert g.user['username'] == 'renamed'
+
+
+def test_register_invalidates_user_cache(client, app):
+    app.extensions['user_cache'].set(3, 'stale')
+    client.post('/auth/register', data={'username': 'a', 'password': 'a'})
+    assert 3 not in app.extensions['user_cache']
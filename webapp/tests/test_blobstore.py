@@ -0,0 +1,114 @@
+import hashlib
+import io
+import os
+
+import pytest
+from flaskr import blobstore
+from flaskr.db import get_db
+
+
+def upload(client, content, filename='board.png', title='board'):
+    return client.post('/create', data={
+        'title': title,
+        'image': (io.BytesIO(content), filename),
+    })
+
+
+def test_blob_path():
+    digest = hashlib.sha256(b'x').hexdigest()
+    img_path = blobstore.blob_path(digest, 'jpg')
+    assert img_path == f'{digest[:2]}/{digest[2:4]}/{digest}.jpg'
+    assert blobstore.digest_of(img_path) == digest
+    assert blobstore.digest_of('IMG_0032.jpg') is None
+
+
+def test_create_stores_by_hash(client, auth, app, ocr, image):
+    auth.login()
+    upload(client, image(payload=b'photo one'))
+    digest = hashlib.sha256(image(payload=b'photo one')).hexdigest()
+
+    with app.app_context():
+        post = get_db().execute('SELECT * FROM post WHERE id = 2').fetchone()
+        assert post['img_path'] == blobstore.blob_path(digest, 'png')
+        path = os.path.join(app.config['UPLOAD_FOLDER'], post['img_path'])
+        with open(path, 'rb') as f:
+            assert f.read() == image(payload=b'photo one')
+
+    assert os.listdir(os.path.join(app.config['UPLOAD_FOLDER'], '.tmp')) == []
+
+
+def test_same_name_does_not_overwrite(client, auth, app, ocr, image):
+    auth.login()
+    upload(client, image(payload=b'farm a'))
+    upload(client, image(payload=b'farm b'))
+
+    with app.app_context():
+        paths = [row['img_path'] for row in get_db().execute(
+            'SELECT img_path FROM post WHERE id > 1 ORDER BY id'
+        )]
+    assert len(set(paths)) == 2
+
+
+def test_duplicates_share_one_file(client, auth, app, ocr, image):
+    auth.login()
+    upload(client, image(payload=b'same photo'), 'IMG_0001.png')
+    upload(client, image(payload=b'same photo'), 'IMG_0002.png')
+
+    with app.app_context():
+        db = get_db()
+        paths = {row['img_path'] for row in db.execute(
+            'SELECT img_path FROM post WHERE id > 1'
+        )}
+        assert len(paths) == 1
+        blob = db.execute('SELECT * FROM blob').fetchone()
+        assert blob['refcount'] == 2
+        path = os.path.join(app.config['UPLOAD_FOLDER'], blob['img_path'])
+
+    client.post('/2/delete')
+    assert os.path.exists(path)
+    client.post('/3/delete')
+    assert not os.path.exists(path)
+
+    with app.app_context():
+        assert get_db().execute('SELECT COUNT(*) FROM blob').fetchone()[0] == 0
+
+
+def test_file_outlives_rolled_back_release(client, auth, app, ocr, image):
+    auth.login()
+    upload(client, image(payload=b'kept'))
+
+    with app.app_context():
+        db = get_db()
+        img_path = db.execute('SELECT img_path FROM post WHERE id = 2').fetchone()[0]
+        path = os.path.join(app.config['UPLOAD_FOLDER'], img_path)
+        db.execute('DELETE FROM post WHERE id = 2')
+        assert blobstore.release(db, img_path)
+        assert os.path.exists(path)
+        db.rollback()
+
+        # the post is back, so its file must still be there
+        blobstore.remove_unused(db, img_path)
+        assert os.path.exists(path)
+        assert db.execute('SELECT refcount FROM blob').fetchone()[0] == 1
+
+
+def test_delete_legacy_post(client, auth, app):
+    auth.login()
+    client.post('/1/delete')
+
+    with app.app_context():
+        assert get_db().execute('SELECT * FROM post WHERE id = 1').fetchone() is None
+
+
+def test_failed_ocr_leaves_nothing(client, auth, app, monkeypatch, image):
+    def broken(path):
+        raise RuntimeError('quota')
+
+    monkeypatch.setattr('flaskr.gcp.detect_document', broken)
+    auth.login()
+    with pytest.raises(RuntimeError):
+        upload(client, image())
+
+    with app.app_context():
+        assert get_db().execute('SELECT COUNT(*) FROM blob').fetchone()[0] == 0
+    assert os.listdir(os.path.join(app.config['UPLOAD_FOLDER'], '.tmp')) == []
@@ -1,3 +1,5 @@
+import io
+
 import pytest
 from flaskr.db import get_db
 
@@ -49,10 +51,13 @@ def test_exists_required(client, auth, path):
     auth.login()
     assert client.post(path).status_code == 404
 
-def test_create(client, auth, app):
+def test_create(client, auth, app, ocr, image):
     auth.login()
     assert client.get('/create').status_code == 200
-    client.post('/create', data={'title': 'created', 'body': ''})
+    client.post('/create', data={
+        'title': 'created',
+        'image': (io.BytesIO(image()), 'board.png'),
+    })
 
     with app.app_context():
         db = get_db()
@@ -63,7 +68,7 @@ def test_create(client, auth, app):
 def test_update(client, auth, app):
     auth.login()
     assert client.get('/1/update').status_code == 200
-    client.post('/1/update', data={'title': 'updated', 'body': ''})
+    client.post('/1/update', data={'title': 'updated', 'gcp_output': ''})
 
     with app.app_context():
         db = get_db()
@@ -77,7 +82,7 @@ def test_update(client, auth, app):
 ))
 def test_create_update_validate(client, auth, path):
     auth.login()
-    response = client.post(path, data={'title': '', 'body': ''})
+    response = client.post(path, data={'title': '', 'gcp_output': ''})
     assert b'Title is required.' in response.data
 
 def test_delete(client, auth, app):
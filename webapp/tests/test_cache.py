@@ -0,0 +1,53 @@
+from flaskr.cache import LRUCache
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_lru_eviction():
+    cache = LRUCache(maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+
+    assert 'b' not in cache
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert cache.evictions == 1
+
+
+def test_ttl_expiry():
+    clock = FakeClock()
+    cache = LRUCache(maxsize=4, ttl=10, clock=clock)
+    cache.set('a', 1)
+    clock.now = 9
+    assert cache.get('a') == 1
+    clock.now = 11
+    assert cache.get('a') is None
+    assert len(cache) == 0
+
+
+def test_invalidate_and_stats():
+    cache = LRUCache(maxsize=4)
+    cache.set('a', 1)
+    cache.get('a')
+    cache.invalidate('a')
+    cache.get('a')
+
+    stats = cache.stats()
+    assert stats['hits'] == 1
+    assert stats['misses'] == 1
+    assert stats['hit_rate'] == 0.5
+    assert stats['size'] == 0
+
+
+def test_zero_size_disables():
+    cache = LRUCache(maxsize=0)
+    cache.set('a', 1)
+    assert cache.get('a') is None
@@ -0,0 +1,185 @@
+import os
+import time
+from datetime import datetime
+
+import cv2
+import numpy as np
+import pytest
+from flaskr import blobstore, capture
+from flaskr.db import get_db
+from flaskr.governor import Governor
+
+FPS = 5
+
+
+def board(text='Kale', person=None):
+    frame = np.full((480, 640, 3), 210, np.uint8)
+    cv2.putText(frame, text, (60, 200), cv2.FONT_HERSHEY_SIMPLEX, 2, (30, 30, 30), 4)
+    if person is not None:
+        cv2.rectangle(frame, (person, 100), (person + 160, 480), (60, 40, 90), -1)
+    return frame
+
+
+# (seconds, frame for each of them)
+SCRIPT = [
+    (4, lambda i: board()),
+    # someone walks up to the board...
+    (4, lambda i: board(person=100 + 20 * i)),
+    # ...stands in front of it while writing...
+    (4, lambda i: board(person=300)),
+    # ...and leaves
+    (8, lambda i: board('Kale 12')),
+]
+
+
+@pytest.fixture
+def video(tmp_path):
+    path = str(tmp_path / 'board.avi')
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), FPS, (640, 480))
+    for seconds, make in SCRIPT:
+        for i in range(seconds * FPS):
+            writer.write(make(i))
+    writer.release()
+    return path
+
+
+def small(frame):
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    height, width = gray.shape
+    corners = np.array([(0, 0), (width, 0), (width, height), (0, height)], 'float32')
+    return capture.small_board(gray, corners)
+
+
+def test_change_detector():
+    detector = capture.ChangeDetector(stable=2)
+    states = [detector.update(small(frame)) for frame in (
+        board(), board(), board(),
+        board(person=100), board(person=300), board(person=300),
+        board('Kale 12'), board('Kale 12'), board('Kale 12'), board('Kale 12'),
+    )]
+    assert states == [
+        capture.MOVING, capture.SETTLING, capture.CHANGED,
+        capture.MOVING, capture.MOVING, capture.BLOCKED,
+        capture.MOVING, capture.SETTLING, capture.CHANGED, capture.UNCHANGED,
+    ]
+
+
+def test_lighting_alone_is_not_a_change():
+    detector = capture.ChangeDetector(stable=1)
+    first = board()
+    darker = cv2.convertScaleAbs(first, alpha=0.8)
+    states = [detector.update(small(frame)) for frame in (first, first, darker, darker)]
+    assert states[-1] == capture.UNCHANGED
+
+
+def run(detector, frames):
+    return [detector.update(small(frame)) for frame in frames]
+
+
+def test_someone_standing_still_is_not_posted():
+    detector = capture.ChangeDetector(stable=1)
+    patience = capture.BLOCKED_PATIENCE
+    # a passer-by shows the reference has nobody in it
+    run(detector, [board(), board(), board(person=300), board(), board()])
+    standing = run(detector, [board(person=300)] * (2 * patience))
+    assert set(standing) == {capture.MOVING, capture.BLOCKED}
+    assert run(detector, [board('Kale 12')] * 3)[1:] == [
+        capture.CHANGED, capture.UNCHANGED,
+    ]
+
+
+def test_reference_with_someone_in_it_is_replaced():
+    detector = capture.ChangeDetector(stable=1)
+    patience = capture.BLOCKED_PATIENCE
+    # they were in front of the board when capture started
+    assert run(detector, [board(person=300)] * 2)[-1] == capture.CHANGED
+    states = run(detector, [board()] * (patience + 2))
+    assert states.count(capture.CHANGED) == 1
+    assert states[-1] == capture.UNCHANGED
+
+
+def test_blocked_frames_reset_stability():
+    detector = capture.ChangeDetector(stable=1)
+    detector.update(small(board()))
+    assert detector.blocked() == capture.BLOCKED
+    assert detector.update(small(board())) == capture.MOVING
+
+
+def test_capture_posts_only_stable_changes(app, runner, ocr, video):
+    result = runner.invoke(args=[
+        'capture', video, '--author', 'test', '--title', 'Harvest board',
+        '--start', '2024-06-03 07:00:00',
+    ])
+    assert result.exit_code == 0, result.output
+    assert '20 frames sampled' in result.output
+    assert '2 posts' in result.output
+    assert len(ocr) == 2
+
+    with app.app_context():
+        posts = get_db().execute(
+            'SELECT title, gcp_output, created, img_path FROM post'
+            ' WHERE id > 1 ORDER BY id'
+        ).fetchall()
+    assert [post['title'] for post in posts] == [
+        'Harvest board 2024-06-03 07:00', 'Harvest board 2024-06-03 07:00',
+    ]
+    assert posts[1]['created'].second > posts[0]['created'].second
+    assert all(post['gcp_output'] == 'ocr text' for post in posts)
+    assert posts[0]['img_path'].endswith('.jpg')
+
+
+def test_capture_needs_a_known_user(runner, video):
+    result = runner.invoke(args=['capture', video, '--author', 'nobody'])
+    assert result.exit_code != 0
+    assert 'Unknown user' in result.output
+
+
+def test_capture_posts_when_vision_raises(app, runner, video, monkeypatch):
+    from google.api_core.exceptions import ResourceExhausted
+
+    def exhausted(content, timeout=None):
+        raise ResourceExhausted('Quota exceeded')
+
+    monkeypatch.setattr('flaskr.gcp.document_text_detection', exhausted)
+    app.extensions['ocr_governor'] = Governor(max_retries=1, sleep=lambda seconds: None)
+    result = runner.invoke(args=['capture', video, '--author', 'test'])
+    assert result.exit_code == 0, result.output
+    assert '2 posts' in result.output
+    with app.app_context():
+        outputs = get_db().execute('SELECT gcp_output FROM post WHERE id > 1').fetchall()
+    assert [row[0] for row in outputs] == ['', '']
+
+
+def test_failed_post_leaves_no_temp_file(app, monkeypatch):
+    def fail(db, path, template):
+        raise MemoryError
+
+    monkeypatch.setattr('flaskr.gcp.recognize_image', fail)
+    with app.app_context():
+        with pytest.raises(MemoryError):
+            capture.post_frame(get_db(), board(), 'Board', 1, None, datetime.now())
+        temp = os.path.join(blobstore.upload_folder(), '.tmp')
+        assert os.listdir(temp) == []
+
+
+@pytest.fixture
+def new_york(monkeypatch):
+    monkeypatch.setenv('TZ', 'America/New_York')
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def test_capture_stores_utc(app, runner, ocr, video, new_york):
+    result = runner.invoke(args=[
+        'capture', video, '--author', 'test', '--start', '2024-06-03 07:00:00',
+    ])
+    assert result.exit_code == 0, result.output
+    with app.app_context():
+        post = get_db().execute(
+            'SELECT title, created FROM post WHERE id = 2'
+        ).fetchone()
+    # titled in local time, stored in UTC like CURRENT_TIMESTAMP
+    assert post['title'] == 'Board 2024-06-03 07:00'
+    assert post['created'].strftime('%Y-%m-%d %H:%M') == '2024-06-03 11:00'
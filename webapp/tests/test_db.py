@@ -1,7 +1,9 @@
 import sqlite3
+import threading
 
 import pytest
-from flaskr.db import get_db
+from flaskr import create_app
+from flaskr.db import close_thread_connections, get_db, migrate_db, migrations
 
 
 def test_get_close_db(app):
@@ -9,11 +11,109 @@ def test_get_close_db(app):
         db = get_db()
         assert db is get_db()
 
+    # the connection outlives the app context and is reused by the next one
+    with app.app_context():
+        assert get_db() is db
+
+    close_thread_connections()
     with pytest.raises(sqlite3.ProgrammingError) as e:
         db.execute('SELECT 1')
 
     assert 'closed' in str(e.value)
 
+
+def test_connection_per_thread(app):
+    with app.app_context():
+        db = get_db()
+
+    seen = []
+
+    def worker():
+        with app.app_context():
+            seen.append(get_db())
+        close_thread_connections()
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    thread.join()
+    assert seen[0] is not db
+
+
+def test_close_db_rolls_back(app):
+    with app.app_context():
+        get_db().execute("UPDATE post SET title = 'dirty' WHERE id = 1")
+
+    with app.app_context():
+        db = get_db()
+        assert not db.in_transaction
+        assert db.execute('SELECT title FROM post').fetchone()[0] == 'test title'
+
+
+def test_pragmas(app):
+    with app.app_context():
+        db = get_db()
+        assert db.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        assert db.execute('PRAGMA synchronous').fetchone()[0] == 1
+        assert db.execute('PRAGMA busy_timeout').fetchone()[0] == 5000
+
+
+def test_migrate_db(app):
+    with app.app_context():
+        db = get_db()
+        latest = migrations()[-1][0]
+        assert db.execute('PRAGMA user_version').fetchone()[0] == latest
+        indexes = {row['name'] for row in db.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index'"
+        )}
+        assert {'post_author_id', 'post_created'} <= indexes
+
+        # re-running is a no-op and keeps the data
+        assert migrate_db() == 0
+        assert db.execute('SELECT COUNT(*) FROM post').fetchone()[0] == 1
+
+
+OLD_SCHEMA = """
+CREATE TABLE user (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  username TEXT UNIQUE NOT NULL,
+  password TEXT NOT NULL
+);
+
+CREATE TABLE post (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  author_id INTEGER NOT NULL,
+  created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  title TEXT NOT NULL,
+  img_path TEXT NOT NULL,
+  gcp_output TEXT NOT NULL,
+  FOREIGN KEY (author_id) REFERENCES user (id)
+);
+
+INSERT INTO user (username, password) VALUES ('test', 'x');
+INSERT INTO post (title, img_path, gcp_output, author_id)
+VALUES ('kept', 'IMG_0032.jpg', 'tomatoes', 1);
+"""
+
+
+def test_migrate_db_from_old_schema(tmp_path):
+    # a database created by the schema.sql that predates migrations
+    database = str(tmp_path / 'old.sqlite')
+    old = sqlite3.connect(database)
+    old.executescript(OLD_SCHEMA)
+    old.close()
+
+    app = create_app({'TESTING': True, 'DATABASE': database})
+    with app.app_context():
+        assert migrate_db() == len(migrations())
+        db = get_db()
+        assert db.execute('SELECT title FROM post').fetchone()[0] == 'kept'
+        plan = db.execute(
+            'EXPLAIN QUERY PLAN SELECT * FROM post WHERE author_id = 1'
+        ).fetchall()
+        assert 'post_author_id' in ' '.join(row['detail'] for row in plan)
+    close_thread_connections()
+
+
 def test_init_db_command(runner, monkeypatch):
     class Recorder(object):
         called = False
@@ -24,4 +124,9 @@ def test_init_db_command(runner, monkeypatch):
     monkeypatch.setattr('flaskr.db.init_db', fake_init_db)
     result = runner.invoke(args=['init-db'])
     assert 'Initialized' in result.output
-    assert Recorder.called
\ No newline at end of file
+    assert Recorder.called
+
+
+def test_migrate_db_command(runner):
+    result = runner.invoke(args=['migrate-db'])
+    assert 'Applied 0 migration(s)' in result.output
@@ -0,0 +1,144 @@
+import json
+import os
+
+import pytest
+from flaskr import evaluate
+
+
+def test_levenshtein():
+    assert evaluate.levenshtein('kitten', 'sitting') == 3
+    assert evaluate.levenshtein('', 'abc') == 3
+    assert evaluate.levenshtein('abc', 'abc') == 0
+    assert evaluate.levenshtein('flaw', 'lawn') == 2
+    assert evaluate.levenshtein(['a', 'b', 'c'], ['a', 'c']) == 1
+
+
+def test_error_rates_are_over_the_whole_set():
+    # 1 edit in 3 characters and 1 in 9: 2 / 12, not the mean of the two
+    predictions = ['kale', 'beams  and']
+    references = ['kal ', 'beans and']
+    assert evaluate.cer(predictions, references) == pytest.approx(2 / 12)
+    assert evaluate.wer(predictions, references) == pytest.approx(2 / 3)
+    assert evaluate.cer([], []) == 0.0
+
+
+@pytest.fixture
+def dataset(tmp_path, image):
+    for name, text in (('a', 'ocr text'), ('b', 'other text')):
+        (tmp_path / f'{name}.png').write_bytes(image(payload=name.encode()))
+        (tmp_path / f'{name}.txt').write_text(text)
+    # no transcript, so not part of the set
+    (tmp_path / 'c.png').write_bytes(image(payload=b'c'))
+    return tmp_path
+
+
+def test_load_dataset(dataset):
+    samples = evaluate.load_dataset(str(dataset))
+    assert [os.path.basename(path) for path, _ in samples] == ['a.png', 'b.png']
+    assert samples[1][1] == 'other text'
+
+
+def test_evaluate_engine_caches_responses(app, ocr, dataset, tmp_path):
+    cache = evaluate.ResponseCache(str(tmp_path / 'cache'))
+    samples = evaluate.load_dataset(str(dataset))
+    with app.app_context():
+        row = evaluate.evaluate_engine('gcp', samples, workers=2, cache=cache)
+        assert len(ocr) == 2
+        assert row['images'] == 2 and row['errors'] == 0 and row['cached'] == 0
+        # 'other text' -> 'ocr text' is 3 edits in 18 characters
+        assert row['cer'] == pytest.approx(3 / 18)
+        assert row['wer'] == pytest.approx(1 / 4)
+        assert row['p50_ms'] is not None and row['throughput'] > 0
+
+        again = evaluate.evaluate_engine('gcp', samples, cache=cache)
+    assert len(ocr) == 2
+    assert again['cached'] == 2
+    assert again['cer'] == row['cer'] and again['throughput'] is None
+
+
+def test_offline_uses_only_cached_responses(app, ocr, dataset, tmp_path):
+    cache = evaluate.ResponseCache(str(tmp_path / 'cache'))
+    samples = evaluate.load_dataset(str(dataset))
+    with app.app_context():
+        evaluate.evaluate_engine('gcp', samples[:1], cache=cache)
+        row = evaluate.evaluate_engine('gcp', samples, cache=cache, offline=True)
+    assert len(ocr) == 1
+    assert row['images'] == 1 and row['errors'] == 1
+    assert row['failures'] == [{'image': samples[1][0], 'error': 'not cached'}]
+
+
+@pytest.mark.parametrize('engine', ('gcp', 'hybrid', 'tiled'))
+def test_offline_never_calls_online_engines(app, monkeypatch, dataset, engine):
+    calls = []
+    for target in ('flaskr.gcp.detect_document', 'flaskr.hybrid.recognize',
+                   'flaskr.tiling.recognize'):
+        monkeypatch.setattr(target, calls.append)
+    samples = evaluate.load_dataset(str(dataset))
+    with app.app_context():
+        row = evaluate.evaluate_engine(engine, samples, offline=True)
+    assert calls == []
+    assert row['errors'] == len(samples)
+
+
+def test_only_trocr_runs_offline():
+    from flaskr.ocr import is_online
+
+    assert [name for name in ('gcp', 'hybrid', 'tiled', 'trocr')
+            if not is_online(name)] == ['trocr']
+
+
+def test_engine_failures_are_reported(app, monkeypatch, dataset):
+    def fail(path):
+        raise RuntimeError('quota')
+
+    monkeypatch.setattr('flaskr.gcp.detect_document', fail)
+    samples = evaluate.load_dataset(str(dataset))
+    with app.app_context():
+        row = evaluate.evaluate_engine('gcp', samples)
+    assert row['images'] == 0 and row['errors'] == 2
+    assert row['cer'] is None
+    assert row['failures'][0]['error'] == 'RuntimeError: quota'
+
+
+def test_evaluate_ocr_command(runner, ocr, dataset, tmp_path):
+    report = tmp_path / 'report.md'
+    results = tmp_path / 'results.json'
+    result = runner.invoke(args=[
+        'evaluate-ocr', str(dataset), '--engine', 'gcp',
+        '--cache', str(tmp_path / 'cache'),
+        '--report', str(report), '--json', str(results),
+    ])
+    assert result.exit_code == 0, result.output
+    assert '| gcp | 2 | 0.167 | 0.250 |' in result.output
+    assert report.read_text() in result.output
+    assert json.loads(results.read_text())[0]['engine'] == 'gcp'
+
+    # engines run in a child process, so the calls are counted by the cache
+    result = runner.invoke(args=[
+        'evaluate-ocr', str(dataset), '--offline', '--cache', str(tmp_path / 'cache'),
+    ])
+    assert result.exit_code == 0, result.output
+    assert '| gcp | 2 |' in result.output and '| 2 | 0 |' in result.output
+
+
+def test_peak_memory_is_per_engine(app, dataset, monkeypatch):
+    ballast = []
+
+    def hungry(path):
+        ballast.append(bytearray(64 * 2 ** 20))
+        return 'ocr text'
+
+    samples = evaluate.load_dataset(dataset)
+    with app.app_context():
+        monkeypatch.setattr('flaskr.gcp.detect_document', hungry)
+        big = evaluate.evaluate_isolated('gcp', samples, workers=1)
+        monkeypatch.setattr('flaskr.gcp.detect_document', lambda path: 'ocr text')
+        small = evaluate.evaluate_isolated('gcp', samples, workers=1)
+    assert ballast == []
+    assert big['peak_rss_mb'] - small['peak_rss_mb'] > 100
+
+
+def test_evaluate_ocr_command_needs_labels(runner, tmp_path):
+    result = runner.invoke(args=['evaluate-ocr', str(tmp_path)])
+    assert result.exit_code != 0
+    assert 'No labelled images' in result.output
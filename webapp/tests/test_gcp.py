@@ -0,0 +1,152 @@
+import io
+import os
+
+from flask import template_rendered
+from flaskr.db import get_db
+
+
+def test_upload_is_immutable(client, auth, app, ocr, image):
+    auth.login()
+    client.post('/create', data={
+        'title': 'board', 'image': (io.BytesIO(image()), 'board.png'),
+    })
+    with app.app_context():
+        img_path = get_db().execute(
+            'SELECT img_path FROM post WHERE id = 2'
+        ).fetchone()['img_path']
+
+    response = client.get(f'/uploads/{img_path}')
+    assert response.status_code == 200
+    assert response.data == image()
+    digest = os.path.basename(img_path).split('.')[0]
+    assert response.headers['ETag'] == f'"{digest}"'
+    assert 'immutable' in response.headers['Cache-Control']
+    assert 'max-age=31536000' in response.headers['Cache-Control']
+
+    response = client.get(
+        f'/uploads/{img_path}', headers={'If-None-Match': f'"{digest}"'}
+    )
+    assert response.status_code == 304
+
+
+def test_legacy_upload(client, app):
+    with open(os.path.join(app.config['UPLOAD_FOLDER'], 'test.jpg'), 'wb') as f:
+        f.write(b'legacy')
+
+    response = client.get('/uploads/test.jpg')
+    assert response.data == b'legacy'
+    assert 'immutable' not in response.headers.get('Cache-Control', '')
+    assert client.get('/uploads/../test.jpg').status_code == 404
+
+
+def test_index_conditional_get(client, auth, app):
+    response = client.get('/')
+    etag = response.headers['ETag']
+    assert 'no-cache' in response.headers['Cache-Control']
+    assert 'Cookie' in response.headers['Vary']
+    # deletions and logins don't move any timestamp, so only the ETag counts
+    assert 'Last-Modified' not in response.headers
+
+    response = client.get('/', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+
+    response = client.get('/', headers={
+        'If-Modified-Since': 'Wed, 01 Jan 2100 00:00:00 GMT'
+    })
+    assert response.status_code == 200
+
+    # logging in changes the page, so it changes the ETag
+    auth.login()
+    response = client.get('/', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+
+    client.post('/1/update', data={'title': 'updated', 'gcp_output': ''})
+    response = client.get('/', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert b'updated' in response.data
+    etag = response.headers['ETag']
+
+    client.post('/1/delete')
+    response = client.get('/', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert b'updated' not in response.data
+
+
+def test_index_search_not_cached(client):
+    response = client.post('/', data={'search': 'test'})
+    assert 'ETag' not in response.headers
+
+
+def test_modified_tracks_updates(client, auth, app):
+    with app.app_context():
+        before = get_db().execute(
+            'SELECT modified FROM post WHERE id = 1'
+        ).fetchone()['modified']
+
+    auth.login()
+    client.post('/1/update', data={'title': 'updated', 'gcp_output': ''})
+
+    with app.app_context():
+        after = get_db().execute(
+            'SELECT modified FROM post WHERE id = 1'
+        ).fetchone()['modified']
+    assert after > before
+
+
+def rendered_posts(app, client, *args, **kwargs):
+    seen = []
+
+    def record(sender, template, context, **extra):
+        if template.name == 'gcp/_post.html':
+            seen.append(context['post']['id'])
+
+    with template_rendered.connected_to(record, app):
+        response = client.get(*args, **kwargs)
+    return response, seen
+
+
+def test_fragment_cache(client, auth, app):
+    response, seen = rendered_posts(app, client, '/')
+    assert seen == [1]
+    response, seen = rendered_posts(app, client, '/')
+    assert seen == []
+    assert b'test title' in response.data
+    assert app.extensions['fragment_cache'].stats()['hits'] == 1
+
+    # the author sees a different fragment, with an Edit link
+    auth.login()
+    response, seen = rendered_posts(app, client, '/')
+    assert seen == [1]
+    assert b'href="/1/update"' in response.data
+
+    client.post('/1/update', data={'title': 'updated', 'gcp_output': ''})
+    response, seen = rendered_posts(app, client, '/')
+    assert seen == [1]
+    assert b'updated' in response.data
+
+
+def test_fragment_cache_follows_modified(client, app):
+    rendered_posts(app, client, '/')
+
+    # a write that bypasses the views is still picked up through modified
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE post SET title = 'reprocessed' WHERE id = 1")
+        db.commit()
+
+    response, seen = rendered_posts(app, client, '/')
+    assert seen == [1]
+    assert b'reprocessed' in response.data
+
+
+def test_fragment_cache_search(client, app):
+    rendered_posts(app, client, '/')
+    response, seen = rendered_posts(app, client, '/', method='POST',
+                                    data={'search': 'body'})
+    assert seen == []
+    assert b'test title' in response.data
+
+    response = client.post('/', data={'search': 'nothing like this'})
+    assert b'test title' not in response.data
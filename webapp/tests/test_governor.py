@@ -0,0 +1,257 @@
+import io
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from flaskr import gcp
+from flaskr.db import get_db
+from flaskr.governor import AdaptiveLimit, Governor, TokenBucket, is_retryable
+from flaskr.ocr import OCRError
+
+QUOTA = 8
+INVALID_ARGUMENT = 3
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class FakeService(object):
+    """Stands in for Vision, following a script of ``(latency, code)``.
+
+    Each call takes ``latency`` seconds, on the fake clock if one is
+    given and really otherwise, then fails with ``code`` unless it is
+    ``None``. Once the script runs out every call succeeds instantly.
+    """
+
+    def __init__(self, script=(), clock=None):
+        self.script = list(script)
+        self.clock = clock
+        self.calls = 0
+        self.in_flight = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, content):
+        with self._lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+            latency, code = self.script.pop(0) if self.script else (0, None)
+        try:
+            if self.clock is not None:
+                self.clock.now += latency
+            else:
+                time.sleep(latency)
+            if code is not None:
+                raise OCRError(f'error {code}', code=code)
+            return f'text of {content}'
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+def governor(clock, **kwargs):
+    return Governor(clock=clock, sleep=clock.sleep, random=lambda: 1.0, **kwargs)
+
+
+def test_token_bucket():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2, burst=3, clock=clock, sleep=clock.sleep)
+    for _ in range(5):
+        bucket.acquire()
+    # three from the burst, then one every half second
+    assert clock.sleeps == [pytest.approx(0.5), pytest.approx(0.5)]
+    assert bucket.waited == pytest.approx(1.0)
+
+
+def test_adaptive_limit():
+    limit = AdaptiveLimit(4, minimum=1, maximum=5, latency_target=1.0)
+    for _ in range(4):
+        limit.acquire()
+        limit.release(latency=0.1)
+    assert limit.limit == pytest.approx(5, abs=0.1)
+
+    limit.acquire()
+    limit.release(latency=3.0)
+    assert limit.limit == pytest.approx(2.5, abs=0.1)
+
+    for _ in range(5):
+        limit.acquire()
+        limit.release(error=True)
+    assert limit.limit == 1
+
+
+def test_is_retryable():
+    assert is_retryable(OCRError('quota', code=QUOTA))
+    assert not is_retryable(OCRError('bad image', code=INVALID_ARGUMENT))
+    assert is_retryable(TimeoutError())
+    assert is_retryable(SimpleNamespace(code=503))
+    assert not is_retryable(ValueError())
+
+
+def test_retries_with_backoff():
+    clock = FakeClock()
+    service = FakeService([(0.2, QUOTA), (0.2, QUOTA), (0.3, None)], clock)
+    gov = governor(clock, backoff_base=0.5, backoff_max=0.8)
+
+    assert gov.call(service, 'board') == 'text of board'
+    assert service.calls == 3
+    # exponential, capped at backoff_max
+    assert clock.sleeps == [0.5, 0.8]
+    stats = gov.stats()
+    assert (stats['calls'], stats['errors'], stats['retries'], stats['failures']) == (3, 2, 2, 0)
+    assert stats['latency'] == pytest.approx(0.3)
+
+
+def test_gives_up_after_max_retries():
+    clock = FakeClock()
+    service = FakeService([(0, QUOTA)] * 5, clock)
+    gov = governor(clock, max_retries=2)
+
+    with pytest.raises(OCRError):
+        gov.call(service, 'board')
+    assert service.calls == 3
+    assert gov.stats()['failures'] == 1
+
+
+def test_client_library_errors_become_ocr_errors():
+    from google.api_core.exceptions import ResourceExhausted
+
+    clock = FakeClock()
+    gov = governor(clock, max_retries=1)
+    calls = []
+
+    def exhausted():
+        calls.append(1)
+        raise ResourceExhausted('Quota exceeded')
+
+    with pytest.raises(OCRError) as info:
+        gov.call(exhausted)
+    assert len(calls) == 2
+    assert info.value.code == QUOTA
+    assert isinstance(info.value.__cause__, ResourceExhausted)
+
+
+def test_does_not_retry_permanent_errors():
+    clock = FakeClock()
+    service = FakeService([(0, INVALID_ARGUMENT)], clock)
+    gov = governor(clock)
+
+    with pytest.raises(OCRError):
+        gov.call(service, 'board')
+    assert service.calls == 1
+    assert clock.sleeps == []
+
+
+def test_slow_calls_shrink_concurrency():
+    clock = FakeClock()
+    service = FakeService([(0.1, None)] * 10 + [(5.0, None)] * 3, clock)
+    gov = governor(clock, concurrency=4, max_concurrency=8, latency_target=1.0)
+
+    for n in range(10):
+        gov.call(service, n)
+    assert gov.stats()['limit'] == 6
+    for n in range(3):
+        gov.call(service, n)
+    assert gov.stats()['limit'] == 1
+
+
+def test_concurrency_is_bounded():
+    service = FakeService([(0.02, None)] * 40)
+    gov = Governor(concurrency=3, max_concurrency=3)
+    threads = [
+        threading.Thread(target=gov.call, args=(service, n)) for n in range(40)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert service.calls == 40
+    assert service.peak <= 3
+    assert gov.stats()['in_flight'] == 0
+
+
+def fake_vision(responses):
+    """An ImageAnnotatorClient that returns ``responses`` in turn."""
+    requests = []
+
+    class Client(object):
+        def document_text_detection(self, image, timeout=None):
+            requests.append(timeout)
+            message, code = responses.pop(0)
+            return SimpleNamespace(
+                error=SimpleNamespace(message=message, code=code),
+                full_text_annotation='document',
+            )
+
+    return Client, requests
+
+
+def test_annotate_retries_quota_errors(app, monkeypatch):
+    client, requests = fake_vision([('Quota exceeded', QUOTA), ('', 0)])
+    monkeypatch.setattr('google.cloud.vision.ImageAnnotatorClient', client)
+    monkeypatch.setattr('google.cloud.vision.Image', lambda content: content)
+    app.extensions['ocr_governor'] = Governor(sleep=lambda seconds: None)
+
+    with app.app_context():
+        assert gcp.annotate_content(b'image') == 'document'
+    assert requests == [app.config['OCR_TIMEOUT']] * 2
+    assert app.extensions['ocr_governor'].stats()['retries'] == 1
+
+
+def test_create_keeps_upload_when_ocr_fails(client, auth, app, monkeypatch, image):
+    def unavailable(path):
+        raise OCRError('Quota exceeded', code=QUOTA)
+
+    monkeypatch.setattr('flaskr.gcp.detect_document', unavailable)
+    auth.login()
+    response = client.post('/create', data={
+        'title': 'busy', 'image': (io.BytesIO(image()), 'board.png'),
+    }, follow_redirects=True)
+
+    assert b'saved without its text' in response.data
+    with app.app_context():
+        post = get_db().execute("SELECT * FROM post WHERE title = 'busy'").fetchone()
+        assert post['gcp_output'] == ''
+
+
+def test_create_keeps_upload_when_vision_raises(client, auth, app, monkeypatch, image):
+    from google.api_core.exceptions import ResourceExhausted
+
+    def exhausted(content, timeout=None):
+        raise ResourceExhausted('Quota exceeded')
+
+    monkeypatch.setattr('flaskr.gcp.document_text_detection', exhausted)
+    app.extensions['ocr_governor'] = Governor(max_retries=1, sleep=lambda seconds: None)
+    auth.login()
+    response = client.post('/create', data={
+        'title': 'exhausted', 'image': (io.BytesIO(image()), 'board.png'),
+    }, follow_redirects=True)
+
+    assert response.status_code == 200
+    assert b'saved without its text' in response.data
+    with app.app_context():
+        post = get_db().execute(
+            "SELECT * FROM post WHERE title = 'exhausted'"
+        ).fetchone()
+        assert post is not None and post['gcp_output'] == ''
+
+
+def test_metrics(client):
+    data = client.get('/metrics').get_json()
+    assert data['ocr']['calls'] == 0
+    assert data['ocr']['limit'] == 2
+    assert 'user_cache' in data['caches']
@@ -0,0 +1,140 @@
+from datetime import datetime
+
+import pytest
+
+from flaskr import harvest
+from flaskr.db import get_db
+
+COLUMNS = ['Crop', 'Qty', 'Unit']
+
+
+def test_parse_entries():
+    text = 'Crop\tQty\tUnit\nKale \t12\tlbs\ncherry  tomatoes\t3.5 lb\t\nbeets\t\tbunch\n\t4\tlbs'
+    assert list(harvest.parse_entries(text, COLUMNS)) == [
+        (1, 'kale', 'lbs', 12.0),
+        (2, 'cherry tomatoes', 'lb', 3.5),
+    ]
+    assert list(harvest.parse_entries(text, ['Name', 'Notes'])) == []
+
+
+@pytest.mark.parametrize(('created', 'expected'), (
+    (datetime(2023, 9, 6, 14, 0), ('2023-09-04', 2023)),
+    ('2023-09-04 08:00:00', ('2023-09-04', 2023)),
+    # the week starting Monday 2024-12-30 belongs to 2024
+    ('2025-01-01', ('2024-12-30', 2024)),
+))
+def test_week_of(created, expected):
+    assert harvest.week_of(created) == expected
+
+
+@pytest.fixture
+def harvest_layout(app):
+    with app.app_context():
+        db = get_db()
+        layout_id = db.execute(
+            "INSERT INTO layout_template (name, width, height, columns, cells)"
+            " VALUES ('harvest', 1600, 1000, '[\"Crop\", \"Qty\", \"Unit\"]', '[]')"
+        ).lastrowid
+        db.execute('UPDATE post SET layout_id = ? WHERE id = 1', (layout_id,))
+        db.commit()
+    return layout_id
+
+
+def add_post(db, layout_id, created, text):
+    id = db.execute(
+        'INSERT INTO post (title, img_path, gcp_output, author_id, layout_id, created)'
+        ' VALUES (?, ?, ?, 1, ?, ?)',
+        ('week', 'x.jpg', text, layout_id, created)
+    ).lastrowid
+    harvest.update_post(db, id)
+    return id
+
+
+def rows(db, table):
+    return [tuple(row) for row in db.execute(f'SELECT * FROM {table} ORDER BY 1, 2, 3')]
+
+
+def test_aggregates_follow_posts(app, client, auth, harvest_layout):
+    with app.app_context():
+        db = get_db()
+        add_post(db, harvest_layout, '2023-09-04 10:00:00', 'kale\t12\tlbs\nbeets\t6\tbunch')
+        add_post(db, harvest_layout, '2023-09-07 10:00:00', 'kale\t3\tlbs')
+        second = add_post(db, harvest_layout, '2023-09-12 10:00:00', 'kale\t5\tlbs')
+        db.commit()
+        assert rows(db, 'harvest_weekly') == [
+            ('beets', 'bunch', '2023-09-04', 6.0, 1),
+            ('kale', 'lbs', '2023-09-04', 15.0, 2),
+            ('kale', 'lbs', '2023-09-11', 5.0, 1),
+        ]
+        assert rows(db, 'harvest_season') == [
+            ('beets', 'bunch', 2023, 6.0, 1),
+            ('kale', 'lbs', 2023, 20.0, 3),
+        ]
+
+    auth.login()
+    client.post(f'/{second}/update', data={'title': 'week', 'gcp_output': 'kale\t7\tlbs'})
+    with app.app_context():
+        assert rows(get_db(), 'harvest_season')[1] == ('kale', 'lbs', 2023, 22.0, 3)
+
+    client.post(f'/{second}/delete')
+    with app.app_context():
+        db = get_db()
+        assert rows(db, 'harvest_season')[1] == ('kale', 'lbs', 2023, 15.0, 2)
+        assert [row[2] for row in rows(db, 'harvest_weekly')] == ['2023-09-04'] * 2
+
+
+def test_routes(app, client, harvest_layout):
+    with app.app_context():
+        db = get_db()
+        add_post(db, harvest_layout, '2022-07-04 10:00:00', 'kale\t2\tlbs')
+        add_post(db, harvest_layout, '2023-09-04 10:00:00', 'kale\t12\tlbs\nbeets\t6\tbunch')
+        db.commit()
+
+    data = client.get('/harvest/seasons.json').get_json()
+    assert data['season'] == 2023
+    assert data['seasons'] == [2023, 2022]
+    assert data['totals'][0] == {'crop': 'kale', 'unit': 'lbs', 'total': 12.0, 'entries': 1}
+
+    data = client.get('/harvest/weekly.json?season=2022&crop=Kale').get_json()
+    assert data['weeks'] == [
+        {'crop': 'kale', 'unit': 'lbs', 'week': '2022-07-04', 'total': 2.0, 'entries': 1}
+    ]
+
+    response = client.get('/harvest/')
+    assert response.status_code == 200
+    assert b'beets (bunch)' in response.data
+    assert b'09-04' in response.data
+
+
+def test_rebuild_harvest_command(runner, app, harvest_layout):
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE post SET gcp_output = 'kale\t4\tlbs' WHERE id = 1")
+        db.commit()
+
+    result = runner.invoke(args=['rebuild-harvest'])
+    assert 'Rebuilt harvest totals from 1 posts.' in result.output
+    with app.app_context():
+        assert rows(get_db(), 'harvest_season') == [('kale', 'lbs', 2018, 4.0, 1)]
+
+
+def test_totals_survive_reprocess(runner, app, harvest_layout, monkeypatch):
+    def process(path, template, recognize_batch, previous=None):
+        assert template.id == harvest_layout and previous is None
+        cells = {(0, 0): 'kale', (0, 1): '4', (0, 2): 'lbs'}
+        return 'kale\t4\tlbs', cells
+
+    def whole_page(path):
+        raise AssertionError('layout posts must be read through their template')
+
+    monkeypatch.setattr('flaskr.layout.process', process)
+    monkeypatch.setattr('flaskr.gcp.detect_document', whole_page)
+    result = runner.invoke(args=['reprocess'])
+    assert 'Reprocessed 1 posts, 0 failed.' in result.output
+
+    with app.app_context():
+        db = get_db()
+        assert rows(db, 'harvest_season') == [('kale', 'lbs', 2018, 4.0, 1)]
+        assert rows(db, 'post_cell') == [
+            (1, 0, 0, 'kale'), (1, 0, 1, '4'), (1, 0, 2, 'lbs'),
+        ]
@@ -0,0 +1,123 @@
+from types import SimpleNamespace
+
+import pytest
+from PIL import Image
+
+from flaskr import gcp, hybrid, ocr
+
+
+def vision_word(text, confidence, left, top, right, bottom):
+    vertices = [SimpleNamespace(x=x, y=y) for x, y in (
+        (left, top), (right, top), (right, bottom), (left, bottom)
+    )]
+    return SimpleNamespace(
+        symbols=[SimpleNamespace(text=c, confidence=confidence) for c in text],
+        confidence=confidence,
+        bounding_box=SimpleNamespace(vertices=vertices),
+    )
+
+
+def vision_document(*paragraphs):
+    return SimpleNamespace(pages=[SimpleNamespace(blocks=[SimpleNamespace(
+        paragraphs=[SimpleNamespace(words=words) for words in paragraphs],
+    )])])
+
+
+DOCUMENT = vision_document(
+    [
+        vision_word('Harvest', 0.98, 10, 10, 80, 30),
+        vision_word('tomatues', 0.41, 90, 10, 170, 30),
+        vision_word('l0', 0.52, 180, 10, 200, 30),
+        vision_word('lbs', 0.95, 210, 10, 240, 30),
+    ],
+    [
+        vision_word('kale', 0.30, 10, 50, 60, 70),
+        vision_word('6', 0.99, 70, 50, 80, 70),
+    ],
+)
+
+
+class FakeRecognizer(object):
+    def __init__(self, *texts):
+        self.texts = list(texts)
+        self.batches = []
+
+    def __call__(self, images):
+        self.batches.append([image.size for image in images])
+        return self.texts[:len(images)]
+
+
+def test_document_words():
+    words = list(gcp.document_words(DOCUMENT))
+    assert [word.text for word in words] == [
+        'Harvest', 'tomatues', 'l0', 'lbs', 'kale', '6'
+    ]
+    assert words[1].box == (90, 10, 170, 30)
+    assert words[0].line == words[3].line != words[4].line
+
+
+def test_low_confidence_regions():
+    words = list(gcp.document_words(DOCUMENT))
+    assert hybrid.low_confidence_regions(words, 0.8) == [(1, 3), (4, 5)]
+    assert hybrid.low_confidence_regions(words, 0.2) == []
+
+
+def test_recognize_words_single_batch():
+    words = list(gcp.document_words(DOCUMENT))
+    recognizer = FakeRecognizer('tomatoes 10', '')
+    image = Image.new('RGB', (250, 80), 'white')
+
+    text, regions = hybrid.recognize_words(image, words, 0.8, recognizer)
+
+    assert regions == 2
+    assert len(recognizer.batches) == 1
+    # padded crop of "tomatues l0", clamped to the image
+    assert recognizer.batches[0][0] == (204 - 86, 34 - 6)
+    # an empty second reading keeps Vision's word
+    assert text == 'Harvest tomatoes 10 lbs kale 6 '
+
+
+def test_recognize_words_all_confident():
+    words = list(gcp.document_words(DOCUMENT))
+    recognizer = FakeRecognizer()
+    text, regions = hybrid.recognize_words(
+        Image.new('RGB', (250, 80)), words, 0.1, recognizer
+    )
+    assert text == 'Harvest tomatues l0 lbs kale 6 '
+    assert regions == 0
+
+
+def test_hybrid_engine(app, monkeypatch, tmp_path):
+    path = tmp_path / 'board.png'
+    Image.new('RGB', (250, 80), 'white').save(path)
+    monkeypatch.setattr('flaskr.gcp.annotate', lambda path: DOCUMENT)
+    app.config['OCR_ENGINE'] = 'hybrid'
+
+    with app.app_context():
+        recognizer = FakeRecognizer('tomatoes 10', 'kale')
+        text = hybrid.recognize(str(path), recognizer)
+        assert ocr.get_engine() is hybrid.recognize
+
+    assert text == 'Harvest tomatoes 10 lbs kale 6 '
+
+
+def test_unknown_engine(app):
+    app.config['OCR_ENGINE'] = 'paddle'
+    with app.app_context():
+        with pytest.raises(ValueError):
+            ocr.get_engine()
+
+
+@pytest.mark.parametrize('error', (ocr.OCRError('TrOCR server closed the connection.'),
+                                   ImportError("No module named 'torch'")))
+def test_hybrid_keeps_vision_text_when_second_pass_fails(app, monkeypatch, tmp_path, error):
+    path = tmp_path / 'board.png'
+    Image.new('RGB', (250, 80), 'white').save(path)
+    monkeypatch.setattr('flaskr.gcp.annotate', lambda path: DOCUMENT)
+
+    def broken(images):
+        raise error
+
+    with app.app_context():
+        text = hybrid.recognize(str(path), broken)
+    assert text == 'Harvest tomatues l0 lbs kale 6 '
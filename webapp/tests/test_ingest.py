@@ -0,0 +1,110 @@
+import io
+import os
+import struct
+
+import pytest
+from flaskr.db import get_db
+from flaskr.ingest import ImageSniffer
+
+
+def gif_bytes(width, height):
+    return b'GIF89a' + struct.pack('<HH', width, height) + b'\x00' * 16
+
+
+def jpeg_bytes(width, height, app_segment_size=60000):
+    app1 = b'\xff\xe1' + struct.pack('>H', app_segment_size) + b'x' * (app_segment_size - 2)
+    sof = b'\xff\xc0' + struct.pack('>HBHHB', 11, 8, height, width, 1) + b'\x01\x11\x00'
+    return b'\xff\xd8' + app1 + b'\xff\xff' + sof + b'\xff\xda' + b'\x00' * 32
+
+
+def sniff(data, chunk_size):
+    sniffer = ImageSniffer()
+    for start in range(0, len(data), chunk_size):
+        sniffer.feed(data[start:start + chunk_size])
+    return sniffer
+
+
+@pytest.mark.parametrize('chunk_size', (1, 7, 4096, 1 << 20))
+def test_sniffer_formats(image, chunk_size):
+    sniffer = sniff(image(640, 480), chunk_size)
+    assert (sniffer.format, sniffer.width, sniffer.height) == ('png', 640, 480)
+
+    sniffer = sniff(gif_bytes(32, 16), chunk_size)
+    assert (sniffer.format, sniffer.width, sniffer.height) == ('gif', 32, 16)
+
+    sniffer = sniff(jpeg_bytes(4032, 3024), chunk_size)
+    assert (sniffer.format, sniffer.width, sniffer.height) == ('jpeg', 4032, 3024)
+    assert len(sniffer._buf) == 0
+
+
+@pytest.mark.parametrize('data', (
+    b'not an image at all',
+    b'\xff\xd8\xff\xda' + b'\x00' * 16,
+))
+def test_sniffer_rejects(data):
+    sniffer = sniff(data, 3)
+    assert sniffer.done
+    assert sniffer.format is None
+
+
+def upload(client, data, filename='board.png'):
+    return client.post('/create', data={
+        'title': 'board',
+        'image': (io.BytesIO(data), filename),
+    })
+
+
+def tmp_files(app):
+    return os.listdir(os.path.join(app.config['UPLOAD_FOLDER'], '.tmp'))
+
+
+def post_count(app):
+    with app.app_context():
+        return get_db().execute('SELECT COUNT(*) FROM post').fetchone()[0]
+
+
+def test_upload_uses_sniffed_format(client, auth, app, ocr):
+    auth.login()
+    upload(client, jpeg_bytes(100, 50), 'board.png')
+
+    with app.app_context():
+        post = get_db().execute('SELECT * FROM post WHERE id = 2').fetchone()
+    assert post['img_path'].endswith('.jpg')
+    assert len(ocr) == 1
+    assert tmp_files(app) == []
+
+
+@pytest.mark.parametrize(('data', 'message'), (
+    (b'#!/bin/sh\necho hi\n', b'Unsupported image format.'),
+    (b'\x89PNG\r\n\x1a\n', b'Unsupported image format.'),
+    (gif_bytes(65535, 65535), b'Image is too large (65535x65535 pixels).'),
+))
+def test_upload_rejected(client, auth, app, ocr, data, message):
+    auth.login()
+    response = upload(client, data)
+
+    assert message in response.data
+    assert ocr == []
+    assert post_count(app) == 1
+    assert tmp_files(app) == []
+
+
+def test_pixel_limit_stops_writing(app, image):
+    app.config['MAX_IMAGE_PIXELS'] = 100
+    data = image(11, 10, payload=b'\x00' * 100000)
+    with app.test_request_context(
+        '/create', method='POST',
+        data={'title': 'board', 'image': (io.BytesIO(data), 'board.png')},
+    ) as ctx:
+        stream = ctx.request.files['image'].stream
+        assert stream.error.startswith('Image is too large')
+        assert os.path.getsize(stream.path) == 0
+
+
+def test_max_content_length(client, auth, app, ocr, image):
+    app.config['MAX_CONTENT_LENGTH'] = 1024
+    auth.login()
+    response = upload(client, image(payload=b'\x00' * 4096))
+
+    assert response.status_code == 413
+    assert post_count(app) == 1
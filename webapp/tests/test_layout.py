@@ -0,0 +1,267 @@
+import io
+import os
+
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+
+from flaskr import layout
+from flaskr.db import get_db
+
+ROWS, COLS = 4, 3
+WRITTEN = {(0, 0): 'Crop', (1, 0): 'kale', (1, 1): '12', (3, 2): 'lbs'}
+
+
+def flat_board(written=WRITTEN, width=900, height=600):
+    board = np.full((height, width), 245, np.uint8)
+    for row in range(ROWS + 1):
+        y = int(row * (height - 1) / ROWS)
+        cv2.line(board, (0, y), (width - 1, y), 20, 4)
+    for col in range(COLS + 1):
+        x = int(col * (width - 1) / COLS)
+        cv2.line(board, (x, 0), (x, height - 1), 20, 4)
+    for (row, col), text in written.items():
+        x = int(col * width / COLS) + 40
+        y = int(row * height / ROWS) + 100
+        cv2.putText(board, text, (x, y), cv2.FONT_HERSHEY_SIMPLEX, 1.6, 30, 4)
+    return board
+
+
+def photo(board, corners, size=(1400, 1100)):
+    """Places a flat board onto a darker wall at the given corners."""
+    height, width = board.shape
+    source = np.array([(0, 0), (width, 0), (width, height), (0, height)], 'float32')
+    matrix = cv2.getPerspectiveTransform(source, np.array(corners, 'float32'))
+    wall = np.full((size[1], size[0]), 70, np.uint8)
+    mask = cv2.warpPerspective(np.full_like(board, 255), matrix, size)
+    warped = cv2.warpPerspective(board, matrix, size)
+    return np.where(mask > 0, warped, wall).astype(np.uint8)
+
+
+def save(tmp_path, name, gray):
+    path = tmp_path / name
+    Image.fromarray(gray).save(path)
+    return str(path)
+
+
+REFERENCE_CORNERS = [(200, 150), (1200, 150), (1200, 817), (200, 817)]
+SKEWED_CORNERS = [(260, 120), (1220, 200), (1150, 930), (180, 860)]
+NEXT_WEEK_CORNERS = [(250, 130), (1210, 190), (1160, 925), (190, 870)]
+
+
+class FakeBatch(object):
+    def __init__(self):
+        self.sizes = []
+
+    def __call__(self, images):
+        self.sizes.append(len(images))
+        return [f'cell {n}' for n in range(len(images))]
+
+
+@pytest.fixture
+def template(app, tmp_path):
+    reference = save(tmp_path, 'reference.png', photo(flat_board({}), REFERENCE_CORNERS))
+    with app.app_context():
+        template_id = layout.register(get_db(), 'harvest', reference, ['Crop', 'Qty', 'Unit'])
+        return layout.get_template(get_db(), template_id)
+
+
+def test_order_corners():
+    corners = layout.order_corners([(10, 90), (90, 10), (10, 10), (90, 90)])
+    assert corners.tolist() == [[10, 10], [90, 10], [90, 90], [10, 90]]
+
+
+def test_find_outline():
+    gray = photo(flat_board(), SKEWED_CORNERS)
+    corners = layout.find_outline(gray)
+    assert np.abs(corners - np.array(SKEWED_CORNERS)).max() < 12
+
+
+def test_register_detects_grid(template):
+    assert template.width == 1600
+    assert template.height == pytest.approx(1600 * 2 / 3, abs=10)
+    assert len({cell.row for cell in template.cells}) == ROWS
+    assert len({cell.col for cell in template.cells}) == COLS
+    assert template.columns == ['Crop', 'Qty', 'Unit']
+    first = template.cells[0]
+    assert first.x0 == pytest.approx(0, abs=0.02)
+    assert first.x1 == pytest.approx(1 / 3, abs=0.02)
+
+
+def test_process_reads_only_written_cells(template, tmp_path):
+    path = save(tmp_path, 'week.png', photo(flat_board(), SKEWED_CORNERS))
+    batch = FakeBatch()
+
+    text, cells = layout.process(path, template, batch)
+
+    assert batch.sizes == [len(WRITTEN)]
+    assert set(cells) == set(WRITTEN)
+    assert text.split('\n') == [
+        'cell 0\t\t', 'cell 1\tcell 2\t', '\t\tcell 3'
+    ]
+
+
+def test_process_reads_only_changed_cells(template, tmp_path):
+    last_week = save(tmp_path, 'last.png', photo(flat_board(), SKEWED_CORNERS))
+    # (0, 0) wiped, (1, 1) rewritten in place, (2, 1) new
+    written = {(1, 0): 'kale', (1, 1): '13', (2, 1): 'beets', (3, 2): 'lbs'}
+    path = save(tmp_path, 'week.png', photo(flat_board(written), NEXT_WEEK_CORNERS))
+    old_texts = {key: f'old {text}' for key, text in WRITTEN.items()}
+    batch = FakeBatch()
+
+    text, cells = layout.process(path, template, batch, (last_week, old_texts))
+
+    assert batch.sizes == [2]
+    assert cells == {
+        (1, 0): 'old kale', (1, 1): 'cell 0', (2, 1): 'cell 1', (3, 2): 'old lbs',
+    }
+
+
+def test_fingerprint_matches_ink(template, tmp_path):
+    board = layout.align(
+        save(tmp_path, 'week.png', photo(flat_board(), SKEWED_CORNERS)), template
+    )
+    size = (template.width, template.height)
+    ink, hashes, density = layout.fingerprint(board, template.cells, size)
+    assert {
+        (cell.row, cell.col) for cell, written in zip(template.cells, ink) if written
+    } == set(WRITTEN)
+    assert hashes.shape == (len(template.cells), layout.HASH_SIZE ** 2 // 8)
+    assert not layout.hash_distance(hashes, hashes).any()
+
+
+def test_uniform_grid(app, tmp_path):
+    reference = save(tmp_path, 'blank.png', np.full((300, 400), 240, np.uint8))
+    with app.app_context():
+        template = layout.get_template(
+            get_db(), layout.register(get_db(), 'blank', reference, grid=(2, 5))
+        )
+    assert len(template.cells) == 10
+    assert template.cells[-1] == layout.Cell(1, 4, 0.8, 0.5, 1.0, 1.0)
+
+
+HARVEST_PHOTO = os.path.join(
+    os.path.dirname(__file__), '..', '..', 'attachments', 'Powisset-Documents',
+    'POW-wb-harvest-week-090423.jpg',
+)
+# The ruled table on that photo; the rest of the board is free text.
+HARVEST_TABLE = (470, 555, 1590, 2430)
+
+
+@pytest.mark.skipif(not os.path.exists(HARVEST_PHOTO), reason='attachments missing')
+def test_register_real_board_table(app):
+    with app.app_context():
+        template_id = layout.register(
+            get_db(), 'harvest', HARVEST_PHOTO, table=HARVEST_TABLE
+        )
+        template = layout.get_template(get_db(), template_id)
+    # a header row and fourteen crops; crop, field, four dates, total
+    assert len({cell.row for cell in template.cells}) == 15
+    assert len({cell.col for cell in template.cells}) == 7
+    # the photo is the board here, so cells stay inside the table's box
+    width, height = 4032, 3024
+    assert min(cell.x0 for cell in template.cells) * width >= HARVEST_TABLE[0] - 1
+    assert max(cell.x1 for cell in template.cells) * width <= HARVEST_TABLE[2] + 1
+    assert max(cell.y1 for cell in template.cells) * height <= HARVEST_TABLE[3] + 1
+
+
+@pytest.mark.parametrize('table', ('1,2,3', '10,10,5,20', 'a,b,c,d'))
+def test_register_layout_command_rejects_bad_table(runner, tmp_path, table):
+    reference = save(tmp_path, 'reference.png', photo(flat_board({}), REFERENCE_CORNERS))
+    result = runner.invoke(args=['register-layout', 'harvest', reference, '--table', table])
+    assert result.exit_code == 2
+    assert "Invalid value for '--table'" in result.output
+
+
+def test_register_layout_command(runner, tmp_path):
+    reference = save(tmp_path, 'reference.png', photo(flat_board({}), REFERENCE_CORNERS))
+    result = runner.invoke(args=[
+        'register-layout', 'harvest', reference, '--columns', 'Crop,Qty,Unit'
+    ])
+    assert f'{ROWS} rows x {COLS} columns' in result.output
+
+    result = runner.invoke(args=['list-layouts'])
+    assert 'harvest\t12 cells\tCrop, Qty, Unit' in result.output
+
+
+@pytest.mark.parametrize('grid', ('3by4', '3x', 'x4', '0x3'))
+def test_register_layout_command_rejects_bad_grid(runner, tmp_path, grid):
+    reference = save(tmp_path, 'reference.png', photo(flat_board({}), REFERENCE_CORNERS))
+    result = runner.invoke(args=['register-layout', 'harvest', reference, '--grid', grid])
+    assert result.exit_code == 2
+    assert "Invalid value for '--grid'" in result.output
+
+
+def test_register_layout_command_rejects_duplicate_name(runner, tmp_path):
+    reference = save(tmp_path, 'reference.png', photo(flat_board({}), REFERENCE_CORNERS))
+    args = ['register-layout', 'harvest', reference, '--grid', '4x3']
+    assert runner.invoke(args=args).exit_code == 0
+    result = runner.invoke(args=args)
+    assert result.exit_code == 1
+    assert "Layout 'harvest' already exists." in result.output
+
+
+def test_create_with_layout(client, auth, app, template, monkeypatch, tmp_path):
+    batch = FakeBatch()
+    monkeypatch.setattr('flaskr.gcp.recognize_crops', batch)
+    data = io.BytesIO()
+    Image.fromarray(photo(flat_board(), SKEWED_CORNERS)).save(data, 'PNG')
+
+    auth.login()
+    assert b'harvest' in client.get('/create').data
+    client.post('/create', data={
+        'title': 'week 1', 'layout': str(template.id),
+        'image': (io.BytesIO(data.getvalue()), 'week.png'),
+    })
+
+    with app.app_context():
+        db = get_db()
+        post = db.execute('SELECT * FROM post WHERE id = 2').fetchone()
+        assert post['layout_id'] == template.id
+        assert post['gcp_output'].startswith('cell 0')
+        stored = db.execute(
+            'SELECT row, col FROM post_cell WHERE post_id = 2'
+        ).fetchall()
+        assert {tuple(row) for row in stored} == set(WRITTEN)
+
+    # the same board again: nothing changed, so nothing is read
+    client.post('/create', data={
+        'title': 'week 2', 'layout': str(template.id),
+        'image': (io.BytesIO(data.getvalue()), 'week.png'),
+    })
+    assert batch.sizes == [len(WRITTEN)]
+    with app.app_context():
+        db = get_db()
+        texts = [db.execute('SELECT gcp_output FROM post WHERE id = ?', (id,)).fetchone()[0]
+                 for id in (2, 3)]
+        assert texts[0] == texts[1]
+
+    client.post('/3/delete')
+    client.post('/2/delete')
+    with app.app_context():
+        assert get_db().execute('SELECT COUNT(*) FROM post_cell').fetchone()[0] == 0
+
+
+def test_corrections_are_not_copied_back(client, auth, app, template, monkeypatch):
+    batch = FakeBatch()
+    monkeypatch.setattr('flaskr.gcp.recognize_crops', batch)
+    data = io.BytesIO()
+    Image.fromarray(photo(flat_board(), SKEWED_CORNERS)).save(data, 'PNG')
+
+    def post(title):
+        client.post('/create', data={
+            'title': title, 'layout': str(template.id),
+            'image': (io.BytesIO(data.getvalue()), 'week.png'),
+        })
+
+    auth.login()
+    post('week 1')
+    client.post('/2/update', data={'title': 'week 1', 'gcp_output': 'Crop\nkale\t12'})
+    with app.app_context():
+        count = get_db().execute('SELECT COUNT(*) FROM post_cell').fetchone()[0]
+        assert count == 0
+
+    # the stale cells are gone, so the board is read again
+    post('week 2')
+    assert batch.sizes == [len(WRITTEN), len(WRITTEN)]
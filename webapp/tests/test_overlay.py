@@ -0,0 +1,115 @@
+import io
+import os
+from types import SimpleNamespace
+
+from PIL import Image
+
+from flaskr import overlay
+
+
+def box(left, top, right, bottom):
+    return SimpleNamespace(vertices=[SimpleNamespace(x=x, y=y) for x, y in (
+        (left, top), (right, top), (right, bottom), (left, bottom)
+    )])
+
+
+def symbol(left):
+    return SimpleNamespace(
+        bounding_box=box(left, 10, left + 8, 20), text='a', confidence=0.9
+    )
+
+
+DOCUMENT = SimpleNamespace(pages=[SimpleNamespace(blocks=[SimpleNamespace(
+    bounding_box=box(0, 0, 60, 40),
+    confidence=0.9,
+    paragraphs=[SimpleNamespace(
+        bounding_box=box(5, 5, 55, 25),
+        confidence=0.9,
+        words=[
+            SimpleNamespace(bounding_box=box(10, 10, 26, 20), confidence=0.9,
+                            symbols=[symbol(10), symbol(18)]),
+            SimpleNamespace(bounding_box=box(30, 10, 38, 20), confidence=0.9,
+                            symbols=[symbol(30)]),
+        ],
+    )],
+)])])
+
+
+def test_collect_bounds():
+    bounds = overlay.collect_bounds(DOCUMENT)
+    assert {level: len(b) for level, b in bounds.items()} == {
+        'block': 1, 'para': 1, 'word': 2, 'symbol': 3,
+    }
+    assert bounds['word'][1] == [(30, 10), (38, 10), (38, 20), (30, 20)]
+
+
+def test_draw_boxes():
+    image = Image.new('RGB', (60, 40), 'white')
+    overlay.draw_boxes(image, overlay.collect_bounds(DOCUMENT)['block'], 'blue')
+    assert image.getpixel((0, 0)) == (0, 0, 255)
+    assert image.getpixel((30, 30)) == (255, 255, 255)
+
+
+def upload_board(client):
+    data = io.BytesIO()
+    Image.new('RGB', (60, 40), 'white').save(data, 'PNG')
+    client.post('/create', data={
+        'title': 'board', 'image': (io.BytesIO(data.getvalue()), 'board.png'),
+    })
+
+
+def test_overlay_route(client, auth, app, monkeypatch):
+    calls = []
+
+    def fake_annotate_content(content):
+        calls.append(content)
+        return DOCUMENT
+
+    monkeypatch.setattr('flaskr.gcp.annotate_content', fake_annotate_content)
+    auth.login()
+    upload_board(client)
+    assert len(calls) == 1
+
+    for level in ('word', 'all', 'symbol'):
+        response = client.get(f'/2/overlay/{level}.jpg')
+        assert response.status_code == 200
+        assert response.mimetype == 'image/jpeg'
+    # drawn from the boxes saved at upload, without asking Vision again
+    assert len(calls) == 1
+
+    folder = os.path.join(app.config['OVERLAY_FOLDER'], '2')
+    assert sorted(os.listdir(folder)) == ['all.jpg', 'symbol.jpg', 'word.jpg']
+    mtime = os.path.getmtime(os.path.join(folder, 'word.jpg'))
+    client.get('/2/overlay/word.jpg')
+    assert os.path.getmtime(os.path.join(folder, 'word.jpg')) == mtime
+
+    assert client.get('/2/overlay/line.jpg').status_code == 404
+    assert client.get('/9/overlay/word.jpg').status_code == 404
+
+    bounds = os.path.join(app.config['OVERLAY_FOLDER'], 'bounds')
+    assert sum(len(files) for _, _, files in os.walk(bounds)) == 1
+    client.post('/2/delete')
+    assert not os.path.exists(folder)
+    assert sum(len(files) for _, _, files in os.walk(bounds)) == 0
+
+
+def test_overlay_without_boxes_does_not_call_vision(client, auth, monkeypatch):
+    def annotate(path):
+        raise AssertionError('overlays must not call Vision')
+
+    monkeypatch.setattr('flaskr.gcp.annotate', annotate)
+    auth.login()
+    # post 1 was never annotated here
+    assert client.get('/1/overlay/word.jpg').status_code == 404
+
+
+def test_overlay_is_for_any_signed_in_reviewer(client, auth, monkeypatch):
+    monkeypatch.setattr('flaskr.gcp.annotate_content', lambda content: DOCUMENT)
+    auth.login()
+    upload_board(client)
+    auth.logout()
+
+    response = client.get('/2/overlay/word.jpg')
+    assert response.headers['Location'] == '/auth/login'
+    auth.login('other', 'other')
+    assert client.get('/2/overlay/word.jpg').status_code == 200
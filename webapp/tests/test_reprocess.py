@@ -0,0 +1,96 @@
+import os
+
+import pytest
+from flaskr.db import get_db
+from flaskr.reprocess import format_duration, reprocess
+
+
+@pytest.fixture
+def posts(app):
+    with app.app_context():
+        db = get_db()
+        for n in range(2, 8):
+            db.execute(
+                'INSERT INTO post (title, img_path, gcp_output, author_id)'
+                ' VALUES (?, ?, ?, 1)',
+                (f'board {n}', f'board{n}.jpg', 'old text')
+            )
+        db.commit()
+    return list(range(1, 8))
+
+
+def outputs(app):
+    with app.app_context():
+        return {row['id']: row['gcp_output'] for row in get_db().execute(
+            'SELECT id, gcp_output FROM post'
+        )}
+
+
+def test_reprocess_command(runner, app, posts, ocr):
+    result = runner.invoke(args=['reprocess', '--batch-size', '3'])
+
+    assert 'Reprocessed 7 posts, 0 failed.' in result.output
+    assert '7/7 posts' in result.output
+    assert set(outputs(app).values()) == {'ocr text'}
+    assert sorted(os.path.basename(path) for path in ocr) == sorted(
+        ['test.jpg'] + [f'board{n}.jpg' for n in range(2, 8)]
+    )
+    with app.app_context():
+        assert get_db().execute(
+            'SELECT COUNT(*) FROM reprocess_checkpoint'
+        ).fetchone()[0] == 0
+
+
+def test_reprocess_id_range(runner, app, posts, ocr):
+    runner.invoke(args=['reprocess', '--start-id', '3', '--end-id', '5'])
+
+    changed = {id for id, text in outputs(app).items() if text == 'ocr text'}
+    assert changed == {3, 4, 5}
+
+
+def test_reprocess_resumes(app, posts, monkeypatch):
+    calls = []
+
+    def flaky(path):
+        calls.append(path)
+        if 'board5' in path:
+            raise KeyboardInterrupt
+        return 'new text'
+
+    monkeypatch.setattr('flaskr.gcp.detect_document', flaky)
+    with app.app_context():
+        with pytest.raises(KeyboardInterrupt):
+            reprocess(batch_size=2, workers=1, echo=lambda *a, **k: None)
+        # the batches holding posts 1-4 were committed before the interrupt
+        assert get_db().execute(
+            'SELECT last_id FROM reprocess_checkpoint'
+        ).fetchone()[0] == 4
+
+    monkeypatch.setattr('flaskr.gcp.detect_document', lambda path: 'new text')
+    with app.app_context():
+        processed, failed = reprocess(batch_size=2, echo=lambda *a, **k: None)
+    assert processed == 3
+    assert set(outputs(app).values()) == {'new text'}
+
+
+def test_reprocess_failures(app, posts, monkeypatch):
+    def broken(path):
+        if 'board3' in path:
+            raise RuntimeError('quota exceeded')
+        return 'new text'
+
+    monkeypatch.setattr('flaskr.gcp.detect_document', broken)
+    messages = []
+    with app.app_context():
+        processed, failed = reprocess(
+            echo=lambda message, **kwargs: messages.append(message)
+        )
+
+    assert failed == [3]
+    assert 'Post 3 failed: quota exceeded' in messages
+    assert outputs(app)[3] == 'old text'
+    assert outputs(app)[4] == 'new text'
+
+
+def test_format_duration():
+    assert format_duration(3725) == '1:02:05'
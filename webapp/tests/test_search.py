@@ -0,0 +1,116 @@
+import io
+
+import pytest
+
+from flaskr import search
+from flaskr.db import get_db
+
+
+@pytest.mark.parametrize(('a', 'b', 'limit', 'expected'), (
+    ('tomatoes', 'tomatoes', 2, 0),
+    ('tomatoes', 'tomatues', 2, 1),
+    ('lettuce', 'letuce', 1, 1),
+    ('harvest', 'havrets', 2, None),
+    ('kale', 'kohlrabi', 2, None),
+    ('beets', 'beats', 0, None),
+))
+def test_bounded_distance(a, b, limit, expected):
+    assert search.bounded_distance(a, b, limit) == expected
+    assert search.bounded_distance(b, a, limit) == expected
+
+
+def test_trigrams():
+    assert search.trigrams('kale') == ['  k', ' ka', 'ale', 'kal', 'le ']
+
+
+def add_post(db, title, text):
+    id = db.execute(
+        'INSERT INTO post (title, img_path, gcp_output, author_id)'
+        ' VALUES (?, ?, ?, 1)', (title, 'x.jpg', text)
+    ).lastrowid
+    search.index_post(db, id, title, text)
+    return id
+
+
+@pytest.fixture
+def posts(app):
+    with app.app_context():
+        db = get_db()
+        ids = {
+            'tomatoes': add_post(db, 'week 1', 'Harvest: tomatoes 10 lbs, kale 6'),
+            'tomatues': add_post(db, 'week 2', 'Harvest tomatues 12 lbs'),
+            'tomatos': add_post(db, 'week 3', 'Tomatos 9 lbs, lettuce'),
+            'beans': add_post(db, 'week 4', 'beans 3 lbs'),
+        }
+        db.commit()
+    return ids
+
+
+def test_fuzzy_search_ranks_by_distance(app, posts):
+    with app.app_context():
+        found = search.fuzzy_search(get_db(), 'tomatoes')
+    assert found == [posts['tomatoes'], posts['tomatos'], posts['tomatues']]
+
+
+def test_fuzzy_search_matches_every_word(app, posts):
+    with app.app_context():
+        db = get_db()
+        assert search.fuzzy_search(db, 'harvst tomatoes') == [
+            posts['tomatoes'], posts['tomatues']
+        ]
+        assert search.fuzzy_search(db, 'tomatoes beans') == []
+        assert search.fuzzy_search(db, 'lbs') == sorted(posts.values(), reverse=True)
+        # short words must match exactly
+        assert search.fuzzy_search(db, 'kal') == []
+        assert search.fuzzy_search(db, 'bean') == [posts['beans']]
+        assert search.fuzzy_search(db, '') == []
+
+
+def test_index_follows_updates(client, auth, app, posts):
+    auth.login()
+    with app.app_context():
+        get_db().execute(
+            'UPDATE post SET author_id = 1 WHERE id = ?', (posts['beans'],)
+        )
+        get_db().commit()
+
+    client.post(f"/{posts['beans']}/update", data={
+        'title': 'week 4', 'gcp_output': 'carrots 3 lbs',
+    })
+    with app.app_context():
+        db = get_db()
+        assert search.fuzzy_search(db, 'beans') == []
+        assert search.fuzzy_search(db, 'carots') == [posts['beans']]
+
+    client.post(f"/{posts['beans']}/delete")
+    with app.app_context():
+        db = get_db()
+        assert search.fuzzy_search(db, 'carrots') == []
+        assert db.execute(
+            'SELECT COUNT(*) FROM post_word WHERE post_id = ?', (posts['beans'],)
+        ).fetchone()[0] == 0
+
+
+def test_create_indexes_post(client, auth, app, ocr, image):
+    auth.login()
+    client.post('/create', data={
+        'title': 'greenhouse', 'image': (io.BytesIO(image()), 'a.png'),
+    })
+    with app.app_context():
+        assert search.fuzzy_search(get_db(), 'greenhuose ocr') == [2]
+
+
+def test_fuzzy_search_view(client, posts):
+    response = client.post('/', data={'search': 'tomatues', 'fuzzy': '1'})
+    assert response.data.count(b'<article') == 3
+    assert b'checked' in response.data
+
+    response = client.post('/', data={'search': 'tomatues'})
+    assert response.data.count(b'<article') == 1
+
+
+def test_reindex_search_command(runner, app):
+    result = runner.invoke(args=['reindex-search'])
+    assert 'Indexed 1 posts.' in result.output
+    with app.app_context():
+        assert search.fuzzy_search(get_db(), 'tittle') == [1]
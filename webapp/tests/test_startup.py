@@ -0,0 +1,50 @@
+import os
+import subprocess
+import sys
+
+from flaskr import startup
+
+IMPORTTIME = '''\
+import time: self [us] | cumulative | imported package
+import time:       120 |        120 |     google.protobuf.internal
+import time:      3000 |       3120 |   google.protobuf
+import time:       500 |       3620 | google.cloud.vision
+import time:       800 |        800 | flaskr.db
+'''
+
+
+def test_parse_importtime():
+    imports = startup.parse_importtime(IMPORTTIME.splitlines())
+    assert imports[0] == startup.Import('google.protobuf.internal', 120, 120, 2)
+    assert imports[2] == startup.Import('google.cloud.vision', 500, 3620, 0)
+    assert startup.by_package(imports) == [('google', 3620), ('flaskr', 800)]
+
+
+def test_create_app_does_not_import_ocr_engines(app):
+    code = (
+        'import sys; from flaskr import create_app; create_app();'
+        ' print(sorted(m for m in ("google.cloud.vision", "torch", "cv2")'
+        ' if m in sys.modules))'
+    )
+    result = subprocess.run(
+        [sys.executable, '-c', code], capture_output=True, text=True,
+        cwd=os.path.dirname(app.root_path), check=True,
+    )
+    assert result.stdout.strip() == '[]'
+
+
+def test_warmup_runs_engine_hooks(client, monkeypatch):
+    calls = []
+    monkeypatch.setattr('flaskr.gcp.warm_up', lambda: calls.append('gcp'))
+
+    assert client.get('/_ah/warmup').status_code == 204
+    # the page engine and the cell engine both default to Vision
+    assert calls == ['gcp', 'gcp']
+
+
+def test_profile_startup_command(runner):
+    result = runner.invoke(args=['profile-startup', '--path', '/hello', '--top', '5'])
+    assert result.exit_code == 0, result.output
+    assert 'GET /hello' in result.output
+    assert '(status 200)' in result.output
+    assert 'flaskr' in result.output
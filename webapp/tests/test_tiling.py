@@ -0,0 +1,101 @@
+import pytest
+from flaskr import tiling
+from flaskr.gcp import Word
+
+
+def word(text, left, top, right, bottom):
+    return Word(text, 0.9, (left, top, right, bottom), (0, 0, 0))
+
+
+def test_tile_boxes_cover_the_image_with_overlap():
+    assert tiling.tile_boxes(1000, 800, 2048, 256) == [(0, 0, 1000, 800)]
+
+    boxes = tiling.tile_boxes(5000, 3000, 2048, 256)
+    lefts = sorted({box[0] for box in boxes})
+    tops = sorted({box[1] for box in boxes})
+    assert len(boxes) == len(lefts) * len(tops) == 3 * 2
+    assert max(box[2] for box in boxes) == 5000
+    assert max(box[3] for box in boxes) == 3000
+    for a, b in zip(lefts, lefts[1:]):
+        assert a + 2048 - b >= 256
+
+
+def test_merge_keeps_the_reading_furthest_inside_its_tile():
+    left_tile = (0, 0, 1000, 500)
+    right_tile = (800, 0, 1800, 500)
+    tiles = [
+        (left_tile, [word('kale', 100, 100, 200, 140),
+                     word('tomat', 900, 100, 1000, 140)]),
+        (right_tile, [word('tomatoes', 905, 102, 1040, 141),
+                      word('12', 1300, 100, 1340, 140)]),
+    ]
+    merged = tiling.merge_tiles(tiles)
+    assert sorted(w.text for w in merged) == ['12', 'kale', 'tomatoes']
+
+
+def test_merge_keeps_overlapping_words_from_the_same_tile():
+    tile = (0, 0, 1000, 1000)
+    merged = tiling.merge_tiles([(tile, [word('a', 100, 100, 200, 140),
+                                         word('b', 110, 100, 210, 140)])])
+    assert len(merged) == 2
+
+
+def test_reading_order():
+    lines = tiling.reading_order([
+        word('12', 300, 102, 340, 138),
+        word('beans', 100, 200, 200, 240),
+        word('kale', 100, 100, 200, 140),
+        word('lbs', 400, 95, 440, 135),
+    ])
+    assert [[w.text for w in line] for line in lines] == [['kale', '12', 'lbs'], ['beans']]
+
+
+@pytest.fixture
+def board():
+    """A page whose pixels encode their own coordinates, so a fake reader
+    can tell where its tile came from."""
+    import numpy as np
+    from PIL import Image
+
+    y, x = np.mgrid[:1200, :3000]
+    pixels = np.dstack([x % 256, y % 256, x // 256 + 16 * (y // 256)])
+    return Image.fromarray(pixels.astype(np.uint8))
+
+
+PAGE = [
+    word('Harvest', 100, 100, 600, 200),
+    word('week', 1900, 100, 2150, 200),
+    word('tomatoes', 950, 600, 1250, 680),
+    word('40', 2800, 1000, 2900, 1100),
+]
+
+
+def fake_read_tile(tile):
+    """Returns the page words visible in a tile, clipped to its edges."""
+    r, g, b = tile.getpixel((0, 0))
+    left, top = r + 256 * (b % 16), g + 256 * (b // 16)
+    words = []
+    for w in PAGE:
+        box = (max(w.box[0], left) - left, max(w.box[1], top) - top,
+               min(w.box[2], left + tile.width) - left,
+               min(w.box[3], top + tile.height) - top)
+        if box[0] < box[2] and box[1] < box[3]:
+            whole = (box[2] - box[0]) == (w.box[2] - w.box[0])
+            words.append(w._replace(text=w.text if whole else w.text[:3], box=box))
+    return words
+
+
+def test_recognize_image_reads_tiles_in_parallel(app, board):
+    with app.app_context():
+        words = tiling.recognize_image(board, fake_read_tile, size=1024, overlap=400)
+    assert sorted(w.text for w in words) == ['40', 'Harvest', 'tomatoes', 'week']
+    assert {w.text: w.box for w in words}['tomatoes'] == PAGE[2].box
+
+
+def test_tiled_engine(app, board, tmp_path):
+    path = tmp_path / 'board.png'
+    board.save(path)
+    app.config.update(OCR_TILE_SIZE=1024, OCR_TILE_OVERLAP=400)
+    with app.app_context():
+        text = tiling.recognize(str(path), fake_read_tile)
+    assert text == 'Harvest week\ntomatoes\n40'
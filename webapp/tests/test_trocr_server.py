@@ -0,0 +1,155 @@
+import socket
+import threading
+
+import pytest
+from PIL import Image
+
+from flaskr import trocr, trocr_server
+from flaskr.ocr import OCRError
+from flaskr.trocr_server import Batcher, Histogram, Server
+
+
+class FakeModel(object):
+    """Reads an image's width back as its text and records batch sizes."""
+
+    def __init__(self, delay=None):
+        self.batches = []
+        self.delay = delay
+
+    def __call__(self, images):
+        if self.delay is not None:
+            self.delay.wait()
+        self.batches.append(len(images))
+        return [f'line {image.width}' for image in images]
+
+
+def line(width):
+    return Image.new('L', (width, 8), 255)
+
+
+@pytest.fixture
+def server(tmp_path):
+    model = FakeModel()
+    batcher = Batcher(model, max_batch_size=4, max_wait=0.05).start()
+    path = str(tmp_path / 'trocr.sock')
+    server = Server(path, batcher)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield path, model
+    server.shutdown()
+    server.server_close()
+    batcher.stop()
+
+
+def test_histogram():
+    histogram = Histogram((1, 2, 4))
+    for value in (1, 2, 3, 9):
+        histogram.observe(value)
+    assert histogram.snapshot() == {
+        'buckets': {'1': 1, '2': 2, '4': 3}, 'count': 4, 'sum': 15.0,
+    }
+
+
+def test_batcher_gathers_concurrent_requests():
+    release = threading.Event()
+    model = FakeModel(delay=release)
+    batcher = Batcher(model, max_batch_size=4, max_wait=0.05).start()
+    results = {}
+
+    def client(n):
+        results[n] = batcher.recognize([line(n)])
+
+    # the first request blocks the model while the rest queue up
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(1, 10)]
+    threads[0].start()
+    while batcher.batch_sizes.count == 0:
+        pass
+    for thread in threads[1:]:
+        thread.start()
+    while batcher._queue.qsize() < 8:
+        pass
+    release.set()
+    for thread in threads:
+        thread.join()
+    batcher.stop()
+
+    assert results == {n: [f'line {n}'] for n in range(1, 10)}
+    assert model.batches == [1, 4, 4]
+    stats = batcher.stats()
+    assert stats['batch_size']['count'] == 3
+    assert stats['batch_size']['buckets']['4'] == 3
+    assert stats['queue_depth_at_batch']['buckets']['4'] == 3
+
+
+def test_batcher_closes_batch_after_max_wait():
+    model = FakeModel()
+    batcher = Batcher(model, max_batch_size=8, max_wait=0.01).start()
+    assert batcher.recognize([line(3)], timeout=5) == ['line 3']
+    batcher.stop()
+    assert model.batches == [1]
+
+
+def test_batcher_errors_reach_every_caller():
+    def broken(images):
+        raise RuntimeError('out of memory')
+
+    batcher = Batcher(broken).start()
+    futures = batcher.submit([line(1), line(2)])
+    for future in futures:
+        with pytest.raises(RuntimeError):
+            future.result(5)
+    batcher.stop()
+
+
+def test_request_over_socket(server):
+    path, model = server
+    assert trocr_server.request(path, [line(5), line(7)]) == ['line 5', 'line 7']
+    assert trocr_server.request(path, []) == []
+
+    stats = trocr_server.stats(path)
+    assert stats['max_batch_size'] == 4
+    assert stats['batch_size']['count'] >= 1
+
+
+def test_server_error_raises_ocr_error(tmp_path):
+    def broken(images):
+        raise RuntimeError('model not loaded')
+
+    batcher = Batcher(broken).start()
+    path = str(tmp_path / 'broken.sock')
+    with Server(path, batcher) as server:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        with pytest.raises(OCRError, match='model not loaded'):
+            trocr_server.request(path, [line(1)])
+        server.shutdown()
+    batcher.stop()
+
+
+def test_unreachable_server_raises_ocr_error(tmp_path):
+    with pytest.raises(OCRError, match='TrOCR server'):
+        trocr_server.request(str(tmp_path / 'missing.sock'), [line(1)])
+
+    # listening, but never answering
+    path = str(tmp_path / 'silent.sock')
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as silent:
+        silent.bind(path)
+        silent.listen()
+        with pytest.raises(OCRError, match='timed out'):
+            trocr_server.request(path, [line(1)], timeout=0.05)
+
+
+def test_recognize_batch_uses_server(app, server):
+    path, model = server
+    app.config['TROCR_SOCKET'] = path
+    with app.app_context():
+        assert trocr.recognize_batch([line(4)]) == ['line 4']
+    assert model.batches == [1]
+
+
+def test_metrics_include_server(app, client, server):
+    path, model = server
+    app.config['TROCR_SOCKET'] = path
+    assert client.get('/metrics').get_json()['trocr']['max_batch_size'] == 4
+
+    app.config['TROCR_SOCKET'] = path + '.missing'
+    assert client.get('/metrics').get_json()['trocr'] is None